@@ -0,0 +1,204 @@
+import asyncio
+import functools
+import time
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from users.models import UserProfile
+from .caching import _connect
+from .concurrency import run_blocking
+
+# Admission control for agent runs started from web requests (process_trip and
+# the chat and trip plan endpoints). Each run holds a slot; slots and the wait
+# queue live in the planner cache database so the caps hold across every
+# worker process on the host.
+#
+# - at most PLANNER_ADMISSION_MAX_RUNS runs at once, of which
+#   PLANNER_ADMISSION_PAID_RESERVED can only be taken by paying users;
+# - at most PLANNER_ADMISSION_PER_USER runs per user, and as many waiting;
+# - a request that cannot start waits in a queue of PLANNER_ADMISSION_QUEUE_SIZE
+#   for up to PLANNER_ADMISSION_MAX_WAIT seconds, paying users first. A full
+#   queue or a wait that runs out gets a 429 with Retry-After.
+#
+# Slots expire after PLANNER_ADMISSION_SLOT_TTL seconds and waiters that stop
+# polling are dropped, so a crashed process cannot leak capacity.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS admission_slots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    lane TEXT NOT NULL,
+    acquired_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS admission_queue (
+    ticket INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    lane TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    seen_at REAL NOT NULL
+);
+"""
+
+PAID, FREE = "paid", "free"
+PRIORITIES = {PAID: 1, FREE: 0}
+
+
+class AdmissionRejected(Exception):
+    """Raised when an agent run cannot be admitted; ``retry_after`` is in seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _connection():
+    return _connect(str(settings.PLANNER_CACHE_DB), SCHEMA)
+
+
+def _has_room(lane, running_by_lane):
+    """Free runs may not take the slots reserved for the paid lane."""
+    if sum(running_by_lane.values()) >= settings.PLANNER_ADMISSION_MAX_RUNS:
+        return False
+    if lane == FREE:
+        return running_by_lane.get(FREE, 0) < settings.PLANNER_ADMISSION_MAX_RUNS - settings.PLANNER_ADMISSION_PAID_RESERVED
+    return True
+
+
+def lane_for(user):
+    """Users with prepaid itineraries or wallet credit wait in the paid lane."""
+    if user.prepaid_itineraries_count > 0:
+        return PAID
+    return PAID if UserProfile.objects.filter(user=user, paid_plan_credits__gt=0).exists() else FREE
+
+
+def _transaction(step):
+    """Runs ``step(connection, now)`` inside one write transaction."""
+    connection = _connection()
+    now = time.time()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        stale = now - max(5.0, 10 * settings.PLANNER_ADMISSION_POLL_INTERVAL)
+        connection.execute("DELETE FROM admission_slots WHERE expires_at < ?", (now,))
+        connection.execute("DELETE FROM admission_queue WHERE seen_at < ?", (stale,))
+        result = step(connection, now)
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+    return result
+
+
+def enqueue(user_id, lane):
+    """Takes a place in the wait queue and returns its ticket, or None if the user's or the global queue is full."""
+
+    def step(connection, now):
+        waiting, users_waiting = connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(user_id = ?), 0) FROM admission_queue", (user_id,)
+        ).fetchone()
+        if waiting >= settings.PLANNER_ADMISSION_QUEUE_SIZE or users_waiting >= settings.PLANNER_ADMISSION_PER_USER:
+            return None
+        return connection.execute(
+            "INSERT INTO admission_queue (user_id, lane, priority, seen_at) VALUES (?, ?, ?, ?)",
+            (user_id, lane, PRIORITIES[lane], now),
+        ).lastrowid
+
+    return _transaction(step)
+
+
+def try_admit(ticket):
+    """
+    Turns ``ticket`` into a slot if its run may start now and returns the
+    slot id, else None. Runs start in queue order, paid lane first; a waiter
+    held back by its own user's cap or its lane's capacity does not block
+    the ones behind it.
+    """
+
+    def step(connection, now):
+        connection.execute("UPDATE admission_queue SET seen_at = ? WHERE ticket = ?", (now, ticket))
+        running = dict(connection.execute("SELECT user_id, COUNT(*) FROM admission_slots GROUP BY user_id").fetchall())
+        running_by_lane = dict(connection.execute("SELECT lane, COUNT(*) FROM admission_slots GROUP BY lane").fetchall())
+        waiters = connection.execute("SELECT ticket, user_id, lane FROM admission_queue ORDER BY priority DESC, ticket").fetchall()
+        for waiter, user_id, lane in waiters:
+            if running.get(user_id, 0) >= settings.PLANNER_ADMISSION_PER_USER or not _has_room(lane, running_by_lane):
+                continue
+            if waiter != ticket:
+                return None
+            connection.execute("DELETE FROM admission_queue WHERE ticket = ?", (ticket,))
+            return connection.execute(
+                "INSERT INTO admission_slots (user_id, lane, acquired_at, expires_at) VALUES (?, ?, ?, ?)",
+                (user_id, lane, now, now + settings.PLANNER_ADMISSION_SLOT_TTL),
+            ).lastrowid
+        return None
+
+    return _transaction(step)
+
+
+def leave_queue(ticket):
+    _connection().execute("DELETE FROM admission_queue WHERE ticket = ?", (ticket,))
+
+
+def release(slot_id):
+    _connection().execute("DELETE FROM admission_slots WHERE id = ?", (slot_id,))
+
+
+async def admit(user):
+    """Waits for a slot for one of ``user``'s agent runs and returns its id; raises AdmissionRejected."""
+    lane = await run_blocking(lane_for, user)
+    ticket = await run_blocking(enqueue, user.pk, lane)
+    if ticket is None:
+        raise AdmissionRejected("Too many requests are waiting. Please try again shortly.", settings.PLANNER_ADMISSION_RETRY_AFTER)
+    deadline = time.monotonic() + settings.PLANNER_ADMISSION_MAX_WAIT
+    try:
+        while True:
+            slot_id = await run_blocking(try_admit, ticket)
+            if slot_id is not None:
+                return slot_id
+            if time.monotonic() >= deadline:
+                raise AdmissionRejected("The planner is busy right now. Please try again shortly.", settings.PLANNER_ADMISSION_RETRY_AFTER)
+            await asyncio.sleep(settings.PLANNER_ADMISSION_POLL_INTERVAL)
+    except BaseException:
+        await run_blocking(leave_queue, ticket)
+        raise
+
+
+async def _release_after(slot_id, content):
+    try:
+        async for part in content:
+            yield part
+    finally:
+        await run_blocking(release, slot_id)
+
+
+def admission_controlled(view):
+    """
+    Admits POST requests to an async agent view before running it, answering
+    429 with Retry-After when they cannot be. The slot is held until the
+    response is complete, including the whole body of streaming responses.
+    """
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'POST':
+            return await view(request, *args, **kwargs)
+        user = await request.auser()
+        try:
+            slot_id = await admit(user)
+        except AdmissionRejected as e:
+            print(f"--- admission_controlled: rejected {view.__name__} for user {user.pk}: {e} ---")
+            response = JsonResponse({'status': 'error', 'message': str(e)}, status=429)
+            response['Retry-After'] = str(int(e.retry_after))
+            return response
+        try:
+            response = await view(request, *args, **kwargs)
+        except BaseException:
+            await run_blocking(release, slot_id)
+            raise
+        if response.streaming:
+            response.streaming_content = _release_after(slot_id, response.streaming_content)
+        else:
+            await run_blocking(release, slot_id)
+        return response
+
+    return wrapper
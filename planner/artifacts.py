@@ -0,0 +1,143 @@
+import hashlib
+import json
+import re
+import sqlite3
+import time
+
+from django.conf import settings
+
+from .caching import _connect
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    digest TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artifacts_stored_at ON artifacts (stored_at);
+"""
+
+REF_PREFIX = "artifact:sha256:"
+# References as they appear inside the serialized checkpoint and write blobs.
+REF_PATTERN = re.compile(rb"artifact:sha256:([0-9a-f]{64})")
+
+
+def is_ref(value):
+    return isinstance(value, str) and value.startswith(REF_PREFIX)
+
+
+class ArtifactStore:
+    """
+    Content-addressed storage for the large agent outputs of a graph run.
+
+    Values are stored JSON encoded under their sha256, so the same output
+    (e.g. a cached forecast shared by many trips) is kept once, and graph state
+    and every checkpoint only carry the short reference. Rows live in the
+    checkpoint database. Once no snapshot points at them any more they are
+    dropped by prune_unreferenced, which runs after every graph run; rows
+    not written for a long time are expired by age as well (see
+    `manage.py compact_checkpoints`).
+    """
+
+    def __init__(self, path=None):
+        self._path = path
+
+    @property
+    def path(self):
+        return str(self._path or settings.PLANNER_CHECKPOINT_DB)
+
+    def put_encoded(self, encoded):
+        digest = hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+        _connect(self.path, SCHEMA).execute(
+            "INSERT INTO artifacts (digest, value, size, stored_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(digest) DO UPDATE SET stored_at = excluded.stored_at",
+            (digest, encoded, len(encoded), time.time()),
+        )
+        return REF_PREFIX + digest
+
+    def put(self, value):
+        return self.put_encoded(json.dumps(value))
+
+    def get_many(self, refs):
+        """Maps each reference to its value; raises LookupError if one is missing."""
+        digests = {ref[len(REF_PREFIX):]: ref for ref in refs}
+        if not digests:
+            return {}
+        placeholders = ", ".join("?" * len(digests))
+        rows = _connect(self.path, SCHEMA).execute(
+            f"SELECT digest, value FROM artifacts WHERE digest IN ({placeholders})", list(digests)
+        ).fetchall()
+        values = {digests[digest]: json.loads(value) for digest, value in rows}
+        missing = set(digests.values()) - set(values)
+        if missing:
+            raise LookupError(f"Artifacts missing from the store: {sorted(missing)}")
+        return values
+
+    def get(self, ref):
+        return self.get_many([ref])[ref]
+
+    def prune(self, max_age):
+        """Drops artifacts not written for ``max_age`` seconds; returns how many went."""
+        return _connect(self.path, SCHEMA).execute(
+            "DELETE FROM artifacts WHERE stored_at < ?", (time.time() - max_age,)
+        ).rowcount
+
+    def prune_unreferenced(self, grace):
+        """
+        Drops artifacts that no checkpoint or pending write refers to, sparing
+        those written in the last ``grace`` seconds, which a run in flight may
+        not have checkpointed yet. Returns how many went.
+        """
+        connection = _connect(self.path, SCHEMA)
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            referenced = set()
+            for table, column in (("checkpoints", "checkpoint"), ("checkpoints", "metadata"), ("writes", "value")):
+                try:
+                    blobs = connection.execute(f"SELECT {column} FROM {table}")
+                except sqlite3.OperationalError:
+                    continue  # no run has created the checkpoint tables yet
+                for (blob,) in blobs:
+                    if blob:
+                        referenced.update(digest.decode() for digest in REF_PATTERN.findall(bytes(blob)))
+            stale = [
+                (digest,) for (digest,) in connection.execute(
+                    "SELECT digest FROM artifacts WHERE stored_at < ?", (time.time() - grace,)
+                )
+                if digest not in referenced
+            ]
+            connection.executemany("DELETE FROM artifacts WHERE digest = ?", stale)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return len(stale)
+
+    def stats(self):
+        count, size = _connect(self.path, SCHEMA).execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts").fetchone()
+        return {"artifacts": count, "bytes": size}
+
+
+artifact_store = ArtifactStore()
+
+
+def offload_fields(result, names):
+    """
+    Replaces the named values of ``result`` that encode to more than
+    settings.PLANNER_ARTIFACT_INLINE_BYTES with artifact references.
+    Small values stay inline. Returns only the replaced fields.
+    """
+    offloaded = {}
+    for name in names:
+        encoded = json.dumps(result[name])
+        if len(encoded) > settings.PLANNER_ARTIFACT_INLINE_BYTES:
+            offloaded[name] = artifact_store.put_encoded(encoded)
+    return offloaded
+
+
+def resolve_fields(values):
+    """Returns ``values`` with every artifact reference replaced by its value, in one lookup."""
+    refs = [value for value in values.values() if is_ref(value)]
+    resolved = artifact_store.get_many(refs)
+    return {name: resolved[value] if is_ref(value) else value for name, value in values.items()}
@@ -0,0 +1,194 @@
+import asyncio
+import time
+
+import requests
+from django.conf import settings
+
+from .caching import _connect
+from .concurrency import run_blocking
+from .resilience import is_retryable
+
+# Circuit breakers for the external providers. Their state lives in the
+# planner cache database, so when one worker sees a provider go down every
+# worker on the host stops waiting on it, and `manage.py circuit_breakers`
+# can show and reset them.
+#
+# closed     calls go through; consecutive outage-like failures are counted.
+# open       calls fail fast with CircuitOpenError for the reset timeout.
+# half_open  one probe call is let through; success closes the breaker,
+#            failure opens it again.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS circuit_breakers (
+    provider TEXT PRIMARY KEY,
+    state TEXT NOT NULL DEFAULT 'closed',
+    consecutive_failures INTEGER NOT NULL DEFAULT 0,
+    opened_at REAL,
+    probe_started_at REAL,
+    last_error TEXT NOT NULL DEFAULT '',
+    successes INTEGER NOT NULL DEFAULT 0,
+    failures INTEGER NOT NULL DEFAULT 0,
+    rejected INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL
+);
+"""
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose breaker is open."""
+
+    # Retrying straight away would only be rejected again.
+    is_retryable = False
+
+    def __init__(self, provider, retry_in):
+        super().__init__(f"{provider} is unavailable (circuit open, next probe in {retry_in:.0f}s)")
+        self.provider = provider
+        self.retry_in = retry_in
+
+
+def is_outage(error):
+    """Failures that say the provider is down or overloaded, as opposed to a bad request."""
+    if isinstance(error, requests.RequestException):
+        response = getattr(error, "response", None)
+        return response is None or response.status_code >= 500 or response.status_code == 429
+    return is_retryable(error)
+
+
+def _connection():
+    return _connect(str(settings.PLANNER_CACHE_DB), SCHEMA)
+
+
+class CircuitBreaker:
+    """
+    A circuit breaker for one provider. ``counts_as_failure(error)`` decides
+    which exceptions count towards opening it; others (say a 404 for an
+    unknown city) show the provider is up and count as successes.
+    """
+
+    def __init__(self, provider, counts_as_failure=is_outage):
+        self.provider = provider
+        self.counts_as_failure = counts_as_failure
+
+    def before_call(self):
+        """
+        Returns if a call may go out now, else raises CircuitOpenError. Only
+        one probe runs while half open; returns True when this call is it.
+        """
+        connection = _connection()
+        now = time.time()
+        reset_timeout = settings.PLANNER_BREAKER_RESET_TIMEOUT
+        connection.execute("INSERT OR IGNORE INTO circuit_breakers (provider, updated_at) VALUES (?, ?)", (self.provider, now))
+        state, opened_at = connection.execute(
+            "SELECT state, opened_at FROM circuit_breakers WHERE provider = ?", (self.provider,)
+        ).fetchone()
+        if state == CLOSED:
+            return False
+        # A probe that never reported back (its worker died) is replaced after another reset timeout.
+        claimed = connection.execute(
+            "UPDATE circuit_breakers SET state = ?, probe_started_at = ?, updated_at = ? "
+            "WHERE provider = ? AND state != ? AND opened_at <= ? AND (probe_started_at IS NULL OR probe_started_at <= ?)",
+            (HALF_OPEN, now, now, self.provider, CLOSED, now - reset_timeout, now - reset_timeout),
+        ).rowcount
+        if claimed:
+            print(f"--- CircuitBreaker: probing {self.provider} ---")
+            return True
+        connection.execute("UPDATE circuit_breakers SET rejected = rejected + 1 WHERE provider = ?", (self.provider,))
+        raise CircuitOpenError(self.provider, max((opened_at or now) + reset_timeout - now, 0))
+
+    def release_probe(self):
+        """Lets another call probe at once, for a probe that gave up before reaching the provider."""
+        _connection().execute(
+            "UPDATE circuit_breakers SET probe_started_at = NULL WHERE provider = ? AND state = ?", (self.provider, HALF_OPEN)
+        )
+
+    def record_success(self):
+        now = time.time()
+        connection = _connection()
+        (previous,) = connection.execute("SELECT state FROM circuit_breakers WHERE provider = ?", (self.provider,)).fetchone() or (CLOSED,)
+        connection.execute(
+            "UPDATE circuit_breakers SET state = ?, consecutive_failures = 0, opened_at = NULL, "
+            "probe_started_at = NULL, successes = successes + 1, updated_at = ? WHERE provider = ?",
+            (CLOSED, now, self.provider),
+        )
+        if previous != CLOSED:
+            print(f"--- CircuitBreaker: {self.provider} recovered, closing ---")
+
+    def record_failure(self, error):
+        now = time.time()
+        # The right-hand sides all see the row as it was before this UPDATE.
+        rows = _connection().execute(
+            "UPDATE circuit_breakers SET "
+            "state = CASE WHEN state = :half_open OR consecutive_failures + 1 >= :threshold THEN :open ELSE state END, "
+            "opened_at = CASE WHEN state = :open THEN opened_at "
+            "WHEN state = :half_open OR consecutive_failures + 1 >= :threshold THEN :now ELSE opened_at END, "
+            "probe_started_at = NULL, consecutive_failures = consecutive_failures + 1, failures = failures + 1, "
+            "last_error = :error, updated_at = :now WHERE provider = :provider RETURNING state, consecutive_failures",
+            {
+                "half_open": HALF_OPEN, "open": OPEN, "threshold": settings.PLANNER_BREAKER_FAILURE_THRESHOLD,
+                "now": now, "error": str(error)[:500], "provider": self.provider,
+            },
+        ).fetchall()
+        if rows and rows[0][0] == OPEN:
+            print(f"--- CircuitBreaker: {self.provider} open after {rows[0][1]} failures ({error}) ---")
+
+    def _record(self, error):
+        if self.counts_as_failure(error):
+            self.record_failure(error)
+        else:
+            self.record_success()
+
+    def call(self, func, *args, **kwargs):
+        """Calls ``func`` through the breaker."""
+        self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self._record(e)
+            raise
+        self.record_success()
+        return result
+
+    async def acall(self, call, prepare=None):
+        """
+        Awaits ``call()``, a coroutine factory, through the breaker. Cancelled
+        calls are not counted. ``prepare()`` (say, waiting for a rate limit
+        slot) is awaited once the breaker lets the call through; its failures
+        are not the provider's and are not counted either.
+        """
+        probing = await run_blocking(self.before_call)
+        if prepare is not None:
+            try:
+                await prepare()
+            except BaseException:
+                if probing:
+                    await asyncio.shield(run_blocking(self.release_probe))
+                raise
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await run_blocking(self._record, e)
+            raise
+        await run_blocking(self.record_success)
+        return result
+
+    def reset(self):
+        _connection().execute("DELETE FROM circuit_breakers WHERE provider = ?", (self.provider,))
+
+
+def breaker_states():
+    """Every breaker on record, with its counters."""
+    connection = _connection()
+    columns = ("provider", "state", "consecutive_failures", "opened_at", "last_error", "successes", "failures", "rejected", "updated_at")
+    rows = connection.execute(f"SELECT {', '.join(columns)} FROM circuit_breakers ORDER BY provider").fetchall()
+    return [dict(zip(columns, row)) for row in rows]
+
+
+serper_breaker = CircuitBreaker("serper")
+openweathermap_breaker = CircuitBreaker("openweathermap")
+newsdata_breaker = CircuitBreaker("newsdata")
+# Errors from the local embedding server all mean it is not serving.
+ollama_breaker = CircuitBreaker("ollama", counts_as_failure=lambda error: True)
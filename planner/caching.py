@@ -0,0 +1,163 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS cache_entries_lru ON cache_entries (namespace, last_access);
+CREATE TABLE IF NOT EXISTS cache_stats (
+    namespace TEXT PRIMARY KEY,
+    hits INTEGER NOT NULL DEFAULT 0,
+    misses INTEGER NOT NULL DEFAULT 0,
+    evictions INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+_local = threading.local()
+
+
+def _connect(path, schema=SCHEMA):
+    """Returns this thread's connection to a local SQLite file, creating ``schema`` on first use."""
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    connection = connections.get((path, schema))
+    if connection is None:
+        connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(schema)
+        connections[(path, schema)] = connection
+    return connection
+
+
+def normalize_query(text):
+    """Lowercases and collapses whitespace/punctuation so near-identical queries share a key."""
+    text = re.sub(r"[^\w\s]", " ", str(text).lower())
+    return " ".join(text.split())
+
+
+def make_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class SQLiteCache:
+    """
+    A TTL and size-bounded (LRU) key/value cache stored in a local SQLite file.
+
+    The file is shared by every gunicorn worker on the host and survives
+    restarts. Values must be JSON serialisable. Hit/miss/eviction counters are
+    kept per namespace in the same file so they aggregate across processes.
+    """
+
+    def __init__(self, namespace, ttl, max_entries, path=None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._path = path
+
+    @property
+    def path(self):
+        return str(self._path or settings.PLANNER_CACHE_DB)
+
+    def _count(self, connection, column, amount=1):
+        connection.execute(
+            f"INSERT INTO cache_stats (namespace, {column}) VALUES (?, ?) "
+            f"ON CONFLICT(namespace) DO UPDATE SET {column} = {column} + excluded.{column}",
+            (self.namespace, amount),
+        )
+
+    def get(self, key):
+        connection = _connect(self.path)
+        now = time.time()
+        row = connection.execute(
+            "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?",
+            (self.namespace, key),
+        ).fetchone()
+        if row is None or row[1] <= now:
+            if row is not None:
+                connection.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+            self._count(connection, "misses")
+            return None
+        connection.execute(
+            "UPDATE cache_entries SET last_access = ? WHERE namespace = ? AND key = ?",
+            (now, self.namespace, key),
+        )
+        self._count(connection, "hits")
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        connection = _connect(self.path)
+        now = time.time()
+        connection.execute(
+            "INSERT OR REPLACE INTO cache_entries (namespace, key, value, created_at, expires_at, last_access) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (self.namespace, key, json.dumps(value), now, now + (ttl or self.ttl), now),
+        )
+        self._evict(connection, now)
+
+    def delete(self, key):
+        _connect(self.path).execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+    def delete_prefix(self, prefix):
+        """Drops every entry whose key starts with ``prefix``."""
+        _connect(self.path).execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND substr(key, 1, ?) = ?",
+            (self.namespace, len(prefix), prefix),
+        )
+
+    def _evict(self, connection, now):
+        connection.execute("DELETE FROM cache_entries WHERE namespace = ? AND expires_at <= ?", (self.namespace, now))
+        (size,) = connection.execute("SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (self.namespace,)).fetchone()
+        overflow = size - self.max_entries
+        if overflow > 0:
+            connection.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key IN ("
+                "SELECT key FROM cache_entries WHERE namespace = ? ORDER BY last_access LIMIT ?)",
+                (self.namespace, self.namespace, overflow),
+            )
+            self._count(connection, "evictions", overflow)
+
+    def clear(self):
+        connection = _connect(self.path)
+        connection.execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+        connection.execute("DELETE FROM cache_stats WHERE namespace = ?", (self.namespace,))
+
+    def stats(self):
+        connection = _connect(self.path)
+        row = connection.execute(
+            "SELECT hits, misses, evictions FROM cache_stats WHERE namespace = ?", (self.namespace,)
+        ).fetchone()
+        hits, misses, evictions = row or (0, 0, 0)
+        (size,) = connection.execute("SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (self.namespace,)).fetchone()
+        lookups = hits + misses
+        return {
+            "namespace": self.namespace,
+            "entries": size,
+            "hits": hits,
+            "misses": misses,
+            "evictions": evictions,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+def namespaces(path=None):
+    """Lists every namespace that has entries or counters in the cache database."""
+    connection = _connect(str(path or settings.PLANNER_CACHE_DB))
+    rows = connection.execute(
+        "SELECT namespace FROM cache_stats UNION SELECT DISTINCT namespace FROM cache_entries ORDER BY namespace"
+    ).fetchall()
+    return [row[0] for row in rows]
@@ -0,0 +1,126 @@
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from langchain_core.messages import HumanMessage
+
+from .concurrency import run_blocking, run_in_background
+from .models import ChatMessage, Trip
+from .providers import ainvoke_llm, message_text
+
+# Conversation memory for the trip chat. The prompt carries the last
+# PLANNER_CHAT_HISTORY_TURNS turns verbatim plus a rolling summary of the
+# turns before them, stored on the trip. Once PLANNER_CHAT_SUMMARY_BATCH more
+# turns have piled up behind the window they are folded into the summary in
+# one model call, so summarising costs one call every few turns rather than
+# every turn. The fold runs in the background after the reply has been sent.
+# Sizes are budgeted in estimated tokens.
+
+# Gemini averages roughly four characters of English per token.
+CHARS_PER_TOKEN = 4
+
+CHAT_SUMMARY_PROMPT = """
+You maintain the memory of a conversation between a traveller and a travel assistant about one trip.
+Update the summary below with the new conversation turns. Keep every decision, preference, constraint
+and change to the plan the traveller asked for; drop greetings and repetition. Write at most {words} words
+of plain prose.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}
+"""
+
+
+def estimate_tokens(text):
+    return (len(text or "") + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text, tokens):
+    limit = tokens * CHARS_PER_TOKEN
+    return text if len(text) <= limit else text[:limit].rsplit(" ", 1)[0] + " ..."
+
+
+def fit_to_budget(texts, tokens):
+    """The leading ``texts`` that fit in ``tokens``."""
+    kept = []
+    for text in texts:
+        tokens -= estimate_tokens(text)
+        if tokens < 0:
+            break
+        kept.append(text)
+    return kept
+
+
+def load_chat_memory(trip_id):
+    """
+    The trip's conversation summary and its most recent turns as
+    ``{"chat_summary": str, "chat_history": [{"role", "content"}, ...]}``;
+    turns are dropped oldest first to stay within PLANNER_CHAT_HISTORY_TOKENS.
+    """
+    summary, through = Trip.objects.values_list('chat_summary', 'chat_summary_through').get(id=trip_id)
+    # Turns behind the window wait here until a batch is folded into the summary.
+    unsummarised = settings.PLANNER_CHAT_HISTORY_TURNS + settings.PLANNER_CHAT_SUMMARY_BATCH
+    recent = ChatMessage.objects.filter(trip_id=trip_id, id__gt=through).order_by('-id').values_list('question', 'response_markdown')
+    budget = settings.PLANNER_CHAT_HISTORY_TOKENS - estimate_tokens(summary)
+    turns = []
+    for question, response in recent[:unsummarised]:
+        budget -= estimate_tokens(question) + estimate_tokens(response)
+        if budget < 0:
+            break
+        turns.append(({"role": "user", "content": question}, {"role": "assistant", "content": response}))
+    history = [message for turn in reversed(turns) for message in turn]
+    return {"chat_summary": summary, "chat_history": history}
+
+
+def turns_to_fold(trip_id):
+    """
+    The summary so far and the turns that have fallen out of the window, if
+    there are a batch of them. Only the oldest PLANNER_CHAT_SUMMARY_FOLD_TOKENS
+    worth are returned (always at least one turn); the rest wait for the next fold.
+    """
+    summary, through = Trip.objects.values_list('chat_summary', 'chat_summary_through').get(id=trip_id)
+    pending = list(ChatMessage.objects.filter(trip_id=trip_id, id__gt=through).order_by('id'))
+    if len(pending) < settings.PLANNER_CHAT_HISTORY_TURNS + settings.PLANNER_CHAT_SUMMARY_BATCH:
+        return summary, through, []
+    budget = settings.PLANNER_CHAT_SUMMARY_FOLD_TOKENS
+    turns = []
+    for turn in pending[:len(pending) - settings.PLANNER_CHAT_HISTORY_TURNS]:
+        budget -= estimate_tokens(turn.question) + estimate_tokens(turn.response_markdown)
+        if budget < 0 and turns:
+            break
+        turns.append(turn)
+    return summary, through, turns
+
+
+async def update_chat_summary(trip_id):
+    """
+    Folds the turns that fell out of the recent window into the trip's chat
+    summary. Best effort: on failure the turns are folded on a later turn.
+    Returns whether the summary changed.
+    """
+    try:
+        summary, through, turns = await run_blocking(turns_to_fold, trip_id)
+        if not turns:
+            return False
+        prompt = CHAT_SUMMARY_PROMPT.format(
+            words=settings.PLANNER_CHAT_SUMMARY_TOKENS * 3 // 4,
+            summary=summary or "(none yet)",
+            turns="\n".join(f"Traveller: {turn.question}\nAssistant: {turn.response_markdown}" for turn in turns),
+        )
+        result = await ainvoke_llm([HumanMessage(content=prompt)], site="gemini:chat_summary")
+        new_summary = truncate_to_tokens(message_text(result).strip(), settings.PLANNER_CHAT_SUMMARY_TOKENS)
+        # Conditional on the old marker, so two replies finishing together fold each turn once.
+        updated = await run_blocking(
+            Trip.objects.filter(id=trip_id, chat_summary_through=through).update,
+            chat_summary=new_summary, chat_summary_through=turns[-1].id,
+        )
+        print(f"--- update_chat_summary: folded {len(turns)} turns of trip {trip_id} into the summary ---")
+        return bool(updated)
+    except Exception as e:
+        print(f"--- update_chat_summary: could not update the summary of trip {trip_id}: {e} ---")
+        return False
+
+
+def schedule_chat_summary(trip_id):
+    """Runs update_chat_summary in the background, so the reply is not held up by the fold."""
+    return run_in_background(async_to_sync(update_chat_summary), trip_id)
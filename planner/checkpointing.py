@@ -0,0 +1,140 @@
+import os
+import sqlite3
+import time
+
+from django.conf import settings
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+from .concurrency import run_blocking
+
+# Same layout as SqliteSaver's table plus a created_at column, so retention can
+# expire snapshots by age. Created before SqliteSaver.setup() runs, which then
+# finds the table in place.
+CHECKPOINTS_TABLE = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata BLOB,
+    created_at REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE INDEX IF NOT EXISTS checkpoints_created_at ON checkpoints (created_at);
+"""
+
+
+class DiskCheckpointer(SqliteSaver):
+    """
+    A LangGraph checkpointer that keeps graph snapshots in a local SQLite file.
+
+    Snapshots survive restarts and are shared by every process on the host, so
+    a run that died half way can be resumed from its last completed step.
+    SqliteSaver only implements the sync API; the async methods LangGraph uses
+    from ``graph.ainvoke`` run those on the blocking executor. The connection
+    is opened on first use and guarded by SqliteSaver's lock.
+    """
+
+    def __init__(self, path=None, *, serde=None):
+        self._path = path
+        self._conn = None
+        self._conn_path = None
+        super().__init__(None, serde=serde)
+
+    @property
+    def path(self):
+        return str(self._path or settings.PLANNER_CHECKPOINT_DB)
+
+    @property
+    def conn(self):
+        # Reopened when PLANNER_CHECKPOINT_DB changes (e.g. tests pointing it at a temporary file).
+        path = self.path
+        if self._conn is None or self._conn_path != path:
+            self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self._conn_path = path
+            self.is_setup = False
+        return self._conn
+
+    @conn.setter
+    def conn(self, value):
+        self._conn = value
+        self._conn_path = self.path
+
+    def setup(self):
+        if self.is_setup and self._conn_path == self.path:
+            return
+        self.conn.executescript(CHECKPOINTS_TABLE)
+        super().setup()
+
+    async def aget_tuple(self, config):
+        return await run_blocking(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        checkpoints = await run_blocking(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for checkpoint in checkpoints:
+            yield checkpoint
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await run_blocking(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return await run_blocking(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        return await run_blocking(self.delete_thread, thread_id)
+
+    def prune(self, thread_id=None, max_age=None, max_per_thread=None):
+        """
+        Applies the retention policy and returns how many snapshots were removed.
+
+        Snapshots older than ``max_age`` seconds go, then all but the newest
+        ``max_per_thread`` of each thread (or of ``thread_id`` only). Pending
+        writes of removed snapshots are dropped with them.
+        """
+        thread_filter, params = ("AND thread_id = ?", [str(thread_id)]) if thread_id is not None else ("", [])
+        removed = 0
+        with self.cursor() as cursor:
+            if max_age:
+                cursor.execute(
+                    f"DELETE FROM checkpoints WHERE created_at < ? {thread_filter}",
+                    [time.time() - max_age, *params],
+                )
+                removed += cursor.rowcount
+            if max_per_thread:
+                # checkpoint ids are time-ordered (uuid6), newest first.
+                cursor.execute(
+                    "DELETE FROM checkpoints WHERE rowid IN ("
+                    "SELECT rowid FROM (SELECT rowid, ROW_NUMBER() OVER ("
+                    "PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) AS position "
+                    f"FROM checkpoints WHERE 1 = 1 {thread_filter}) WHERE position > ?)",
+                    [*params, max_per_thread],
+                )
+                removed += cursor.rowcount
+            cursor.execute(
+                "DELETE FROM writes WHERE NOT EXISTS (SELECT 1 FROM checkpoints c "
+                "WHERE c.thread_id = writes.thread_id AND c.checkpoint_ns = writes.checkpoint_ns "
+                f"AND c.checkpoint_id = writes.checkpoint_id) {thread_filter}",
+                params,
+            )
+        return removed
+
+    def vacuum(self):
+        with self.lock:
+            self.setup()
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.conn.execute("VACUUM")
+
+    def stats(self):
+        with self.cursor(transaction=False) as cursor:
+            threads, checkpoints = cursor.execute(
+                "SELECT COUNT(DISTINCT thread_id), COUNT(*) FROM checkpoints"
+            ).fetchone()
+            (writes,) = cursor.execute("SELECT COUNT(*) FROM writes").fetchone()
+        return {
+            "threads": threads,
+            "checkpoints": checkpoints,
+            "writes": writes,
+            "bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+        }
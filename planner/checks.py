@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+
+@register()
+def chroma_server_configured(app_configs, **kwargs):
+    """The web server and the generation workers must share one trip index, so a Chroma server is required."""
+    if settings.PLANNER_CHROMA_HOST:
+        return []
+    return [Error(
+        "PLANNER_CHROMA_HOST is not set.",
+        hint="Start a Chroma server (`chroma run --path planner_chroma --port 8001`) and point PLANNER_CHROMA_HOST at it.",
+        id="planner.E001",
+    )]
@@ -0,0 +1,80 @@
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+_executor = None
+_background_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_blocking_executor():
+    """Returns the bounded thread pool used for blocking work inside graph nodes."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.PLANNER_BLOCKING_WORKERS,
+                    thread_name_prefix="planner-blocking",
+                )
+    return _executor
+
+
+def get_background_executor():
+    """Returns the small thread pool for work that runs after the response has been sent."""
+    global _background_executor
+    if _background_executor is None:
+        with _executor_lock:
+            if _background_executor is None:
+                _background_executor = ThreadPoolExecutor(
+                    max_workers=settings.PLANNER_BACKGROUND_WORKERS,
+                    thread_name_prefix="planner-background",
+                )
+    return _background_executor
+
+
+def _in_pool_thread(func, *args, **kwargs):
+    # Django only recycles connections around requests (and on the shared sync
+    # thread), so pool threads would otherwise hold theirs open forever and
+    # never honour CONN_MAX_AGE.
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Runs a blocking callable (ORM access, markdown rendering, ...) off the event loop.
+
+    sync_to_async defaults to thread_sensitive=True, which funnels every caller
+    onto the single shared sync thread, so the parallel branches of the graph
+    would queue behind each other. In "executor" mode the call goes to a
+    dedicated bounded pool instead, with stale database connections closed
+    around each call; "thread_sensitive" keeps the old behaviour.
+    """
+    if settings.PLANNER_BRANCH_EXECUTION == "thread_sensitive":
+        return await sync_to_async(func)(*args, **kwargs)
+    return await sync_to_async(_in_pool_thread, thread_sensitive=False, executor=get_blocking_executor())(func, *args, **kwargs)
+
+
+def run_in_background(func, *args, **kwargs):
+    """
+    Starts a blocking callable on the background pool without waiting for it.
+
+    The pool outlives the event loop of the request that scheduled the work,
+    which a bare asyncio task would not under WSGI. Failures are logged, not
+    raised; the returned future is only for callers that want to wait.
+    """
+    def run():
+        try:
+            return _in_pool_thread(func, *args, **kwargs)
+        except Exception:
+            print(f"--- run_in_background: {getattr(func, '__name__', func)} failed ---")
+            traceback.print_exc()
+    return get_background_executor().submit(run)
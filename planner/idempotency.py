@@ -0,0 +1,263 @@
+import asyncio
+import contextlib
+import functools
+import hashlib
+import json
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .caching import _connect
+from .concurrency import run_blocking
+from .models import IdempotencyKey
+
+# Two guards against running the same expensive request twice:
+#
+# idempotent       POSTs carrying an idempotency key (the Idempotency-Key
+#                  header, or an idempotency_key form field) run once; a
+#                  repeat gets the first response replayed, after waiting for
+#                  it if the first request is still running.
+# single_flight    identical agent runs for a trip that arrive while one is in
+#                  flight wait for it and share its result instead of starting
+#                  their own. Flights live in the planner cache database so
+#                  they are shared by every worker process on the host.
+# exclusive_flight runs holding the same key take turns: each waits for the
+#                  one in flight, then runs itself. Graph runs of a trip use
+#                  it, as they share the trip's checkpoint thread and row.
+
+REPLAYED_HEADERS = ('Content-Type', 'Location', 'Retry-After')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS single_flights (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    result TEXT,
+    finished_at REAL
+);
+"""
+
+
+def new_idempotency_key():
+    return uuid.uuid4().hex
+
+
+def request_fingerprint(request):
+    """Hash of the request's path and form data, so a key reused for a different request can be refused."""
+    fields = sorted(
+        (name, request.POST.getlist(name)) for name in request.POST
+        if name not in ('csrfmiddlewaretoken', 'idempotency_key')
+    )
+    return hashlib.sha256(json.dumps([request.path, fields]).encode('utf-8')).hexdigest()
+
+
+def claim_key(user, key, endpoint, fingerprint):
+    """
+    Records that the request for ``key`` has started. Returns None if this
+    caller should run it, else the existing record. Expired keys, and claims
+    left in progress by a request that died, are taken over.
+    """
+    now = timezone.now()
+    IdempotencyKey.objects.filter(user=user, created_at__lt=now - timedelta(seconds=settings.PLANNER_IDEMPOTENCY_TTL)).delete()
+    IdempotencyKey.objects.filter(
+        user=user, key=key, status_code__isnull=True,
+        created_at__lt=now - timedelta(seconds=settings.PLANNER_IDEMPOTENCY_IN_PROGRESS_TTL),
+    ).delete()
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.create(user=user, key=key, endpoint=endpoint, request_fingerprint=fingerprint)
+        return None
+    except IntegrityError:
+        return IdempotencyKey.objects.filter(user=user, key=key).first()
+
+
+def store_response(user, key, response):
+    IdempotencyKey.objects.filter(user=user, key=key).update(
+        status_code=response.status_code,
+        response_headers={name: response[name] for name in REPLAYED_HEADERS if response.has_header(name)},
+        response_body=response.content.decode(response.charset),
+        completed_at=timezone.now(),
+    )
+
+
+def forget_key(user, key):
+    IdempotencyKey.objects.filter(user=user, key=key).delete()
+
+
+def replay(record):
+    response = HttpResponse(record.response_body, status=record.status_code)
+    for name, value in record.response_headers.items():
+        response[name] = value
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """
+    Makes an async POST view idempotent per user and key. Requests without a
+    key run as before. Streaming responses, 429s and server errors are not
+    stored, so those requests can be retried with the same key.
+    """
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key') or request.POST.get('idempotency_key')
+        if request.method != 'POST' or not key:
+            return await view(request, *args, **kwargs)
+        user = await request.auser()
+        fingerprint = request_fingerprint(request)
+
+        deadline = time.monotonic() + settings.PLANNER_IDEMPOTENCY_WAIT
+        while True:
+            record = await run_blocking(claim_key, user, key[:255], view.__name__, fingerprint)
+            if record is None:
+                break
+            if record.request_fingerprint != fingerprint:
+                return JsonResponse(
+                    {'status': 'error', 'message': 'This idempotency key was already used for a different request.'}, status=422,
+                )
+            if record.status_code is not None:
+                print(f"--- idempotent: replaying {view.__name__} response for key {key} ---")
+                return replay(record)
+            if time.monotonic() >= deadline:
+                response = JsonResponse({'status': 'error', 'message': 'This request is still being processed.'}, status=409)
+                response['Retry-After'] = str(int(settings.PLANNER_IDEMPOTENCY_WAIT))
+                return response
+            await asyncio.sleep(settings.PLANNER_SINGLE_FLIGHT_POLL_INTERVAL)
+
+        try:
+            response = await view(request, *args, **kwargs)
+        except BaseException:
+            await run_blocking(forget_key, user, key[:255])
+            raise
+        if response.streaming or response.status_code == 429 or response.status_code >= 500:
+            await run_blocking(forget_key, user, key[:255])
+        else:
+            await run_blocking(store_response, user, key[:255], response)
+        return response
+
+    return wrapper
+
+
+def _connection():
+    return _connect(str(settings.PLANNER_CACHE_DB), SCHEMA)
+
+
+def claim_flight(key, owner):
+    """
+    Returns ("lead", None) if ``owner`` should run the flight, ("done", result)
+    if it finished moments ago, or ("wait", None) while another owner runs it.
+    """
+    connection = _connection()
+    now = time.time()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        row = connection.execute("SELECT expires_at, result, finished_at FROM single_flights WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            expires_at, result, finished_at = row
+            if result is not None and finished_at >= now - settings.PLANNER_SINGLE_FLIGHT_RESULT_TTL:
+                connection.execute("COMMIT")
+                return "done", json.loads(result)
+            if result is None and expires_at >= now:
+                connection.execute("COMMIT")
+                return "wait", None
+        connection.execute(
+            "INSERT OR REPLACE INTO single_flights (key, owner, expires_at, result, finished_at) VALUES (?, ?, ?, NULL, NULL)",
+            (key, owner, now + settings.PLANNER_SINGLE_FLIGHT_TTL),
+        )
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    return "lead", None
+
+
+def finish_flight(key, owner, result):
+    now = time.time()
+    connection = _connection()
+    connection.execute(
+        "UPDATE single_flights SET result = ?, finished_at = ? WHERE key = ? AND owner = ?",
+        (json.dumps(result, default=str), now, key, owner),
+    )
+    connection.execute("DELETE FROM single_flights WHERE finished_at < ?", (now - settings.PLANNER_SINGLE_FLIGHT_RESULT_TTL,))
+
+
+def abandon_flight(key, owner):
+    _connection().execute("DELETE FROM single_flights WHERE key = ? AND owner = ?", (key, owner))
+
+
+async def single_flight(key, run):
+    """
+    Awaits ``run()`` unless an identical flight (same ``key``) is already
+    running, in which case waits for and returns that flight's result.
+    Results must be JSON serialisable. A flight that raised hands the error
+    to the requests waiting on it as a RuntimeError.
+    """
+    owner = uuid.uuid4().hex
+    while True:
+        role, result = await run_blocking(claim_flight, key, owner)
+        if role == "done":
+            print(f"--- single_flight: {key} attached to a finished run ---")
+            if "error" in result:
+                raise RuntimeError(result["error"])
+            return result["value"]
+        if role == "lead":
+            break
+        await asyncio.sleep(settings.PLANNER_SINGLE_FLIGHT_POLL_INTERVAL)
+
+    try:
+        value = await run()
+    except asyncio.CancelledError:
+        await asyncio.shield(run_blocking(abandon_flight, key, owner))
+        raise
+    except Exception as e:
+        await run_blocking(finish_flight, key, owner, {"error": str(e)})
+        raise
+    await run_blocking(finish_flight, key, owner, {"value": value})
+    return value
+
+
+def renew_flight(key, owner):
+    _connection().execute(
+        "UPDATE single_flights SET expires_at = ? WHERE key = ? AND owner = ? AND result IS NULL",
+        (time.time() + settings.PLANNER_SINGLE_FLIGHT_TTL, key, owner),
+    )
+
+
+@contextlib.asynccontextmanager
+async def exclusive_flight(key):
+    """
+    Holds the flight ``key`` for the duration of the block, after waiting for
+    whoever holds it now. The claim is renewed while held, so it outlasts
+    PLANNER_SINGLE_FLIGHT_TTL for long runs but not a crashed process.
+    """
+    owner = uuid.uuid4().hex
+    waited = False
+    while True:
+        role, _ = await run_blocking(claim_flight, key, owner)
+        if role == "lead":
+            break
+        if not waited:
+            print(f"--- exclusive_flight: waiting for the run holding {key} ---")
+            waited = True
+        await asyncio.sleep(settings.PLANNER_SINGLE_FLIGHT_POLL_INTERVAL)
+
+    async def keep_claim():
+        while True:
+            await asyncio.sleep(settings.PLANNER_SINGLE_FLIGHT_TTL / 3)
+            try:
+                await run_blocking(renew_flight, key, owner)
+            except Exception as e:
+                print(f"--- exclusive_flight: could not renew {key}: {e} ---")
+
+    renewal = asyncio.create_task(keep_claim())
+    try:
+        yield
+    finally:
+        renewal.cancel()
+        await asyncio.shield(run_blocking(abandon_flight, key, owner))
@@ -0,0 +1,293 @@
+import asyncio
+import json
+import os
+import socket
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .artifacts import resolve_fields
+from .concurrency import run_blocking
+from .models import GenerationEvent, GenerationJob
+
+# A database-backed job queue for trip generation. Web requests only enqueue;
+# `manage.py run_generation_worker` processes claim jobs under a lease that
+# they keep renewing, so a crashed worker's jobs are picked up again once its
+# lease expires. Claims are conditional UPDATEs, which makes any number of
+# worker processes safe to run side by side.
+
+ACTIVE_STATUSES = (GenerationJob.QUEUED, GenerationJob.RUNNING)
+FINISHED_STATUSES = (GenerationJob.SUCCEEDED, GenerationJob.FAILED)
+
+# Agent outputs sent along with node_finished events so the trip page can
+# render those sections before the whole graph is done.
+STREAMED_ARTIFACTS = ('weather_forecast', 'packing_list', 'activity_suggestions')
+TERMINAL_EVENTS = ('job_succeeded', 'job_failed')
+STREAM_HEARTBEAT_SECONDS = 15
+
+# Job kinds: a full generation, and a repair run that only reruns the nodes
+# that failed or were left pending when a full run hit its deadline.
+COMPLETE_TRIP = 'complete_trip'
+REPAIR = 'repair'
+
+
+def new_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def enqueue_generation(trip_id, kind=COMPLETE_TRIP):
+    """Queues a generation job for the trip, reusing one that is already queued or running."""
+    existing = GenerationJob.objects.filter(trip_id=trip_id, kind=kind, status__in=ACTIVE_STATUSES).first()
+    if existing:
+        return existing
+    try:
+        with transaction.atomic():
+            return GenerationJob.objects.create(
+                trip_id=trip_id, kind=kind, max_attempts=settings.PLANNER_JOB_MAX_ATTEMPTS,
+            )
+    except IntegrityError:
+        # A concurrent request queued it first (one_active_generation_job_per_trip_and_kind).
+        return GenerationJob.objects.get(trip_id=trip_id, kind=kind, status__in=ACTIVE_STATUSES)
+
+
+def _claimable(now):
+    return (
+        Q(status=GenerationJob.QUEUED, run_after__lte=now)
+        | Q(status=GenerationJob.RUNNING, lease_expires_at__lt=now, attempts__lt=F('max_attempts'))
+    )
+
+
+def reap_expired_jobs():
+    """Fails running jobs whose lease expired after their last allowed attempt."""
+    now = timezone.now()
+    return GenerationJob.objects.filter(
+        status=GenerationJob.RUNNING, lease_expires_at__lt=now, attempts__gte=F('max_attempts'),
+    ).update(status=GenerationJob.FAILED, error='Worker lease expired', finished_at=now, updated_at=now)
+
+
+def claim_job(worker_id, lease_seconds):
+    """Atomically leases the next runnable job to ``worker_id``; returns None when the queue is empty."""
+    now = timezone.now()
+    candidates = list(
+        GenerationJob.objects.filter(_claimable(now)).order_by('run_after', 'created_at').values_list('id', flat=True)[:10]
+    )
+    for job_id in candidates:
+        claimed = GenerationJob.objects.filter(_claimable(now), id=job_id).update(
+            status=GenerationJob.RUNNING,
+            leased_by=worker_id,
+            lease_expires_at=now + timedelta(seconds=lease_seconds),
+            attempts=F('attempts') + 1,
+            progress=0,
+            progress_message='Starting',
+            updated_at=now,
+        )
+        if claimed:
+            return GenerationJob.objects.get(id=job_id)
+    return None
+
+
+def _owned(job_id, worker_id):
+    return GenerationJob.objects.filter(id=job_id, leased_by=worker_id, status=GenerationJob.RUNNING)
+
+
+def renew_lease(job_id, worker_id, lease_seconds):
+    """Extends the lease; returns False if the job was taken over by another worker."""
+    now = timezone.now()
+    return bool(_owned(job_id, worker_id).update(lease_expires_at=now + timedelta(seconds=lease_seconds), updated_at=now))
+
+
+def update_progress(job_id, worker_id, progress, message):
+    _owned(job_id, worker_id).update(progress=progress, progress_message=message[:255], updated_at=timezone.now())
+
+
+def complete_job(job_id, worker_id):
+    now = timezone.now()
+    _owned(job_id, worker_id).update(
+        status=GenerationJob.SUCCEEDED, progress=100, progress_message='Done', error='',
+        finished_at=now, updated_at=now,
+    )
+
+
+def fail_job(job_id, worker_id, error):
+    """
+    Requeues the job with exponential backoff, or fails it once its attempts are used up.
+
+    Returns the job's new status, or None if the worker no longer owns it.
+    """
+    job = _owned(job_id, worker_id).first()
+    if job is None:
+        return None
+    now = timezone.now()
+    if job.attempts < job.max_attempts:
+        delay = settings.PLANNER_JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        _owned(job_id, worker_id).update(
+            status=GenerationJob.QUEUED, run_after=now + timedelta(seconds=delay), leased_by='',
+            lease_expires_at=None, error=error, progress_message=f'Retrying in {delay}s', updated_at=now,
+        )
+        return GenerationJob.QUEUED
+    _owned(job_id, worker_id).update(
+        status=GenerationJob.FAILED, error=error, progress_message='Failed', finished_at=now, updated_at=now,
+    )
+    return GenerationJob.FAILED
+
+
+def latest_job(trip_id):
+    return GenerationJob.objects.filter(trip_id=trip_id).order_by('-created_at').first()
+
+
+def job_status(job):
+    if job is None:
+        return {'status': 'none'}
+    return {
+        'status': job.status,
+        'kind': job.kind,
+        'progress': job.progress,
+        'message': job.progress_message,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'error': job.error,
+    }
+
+
+def record_event(job_id, event, node='', **payload):
+    return GenerationEvent.objects.create(job_id=job_id, event=event, node=node, payload=payload)
+
+
+def events_after(job_id, last_event_id, limit=100):
+    return list(GenerationEvent.objects.filter(job_id=job_id, id__gt=last_event_id).order_by('id')[:limit])
+
+
+def sse_message(event, data, event_id=None):
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {json.dumps(data, default=str)}"]
+    return "\n".join(lines) + "\n\n"
+
+
+async def stream_job_events(trip_id, last_event_id=0):
+    """
+    Yields Server-Sent Events for the trip's latest generation job until it finishes.
+
+    Events are read back from the database, so the stream works no matter
+    which worker process runs the job. Clients that reconnect send
+    Last-Event-ID and only receive what they missed.
+    """
+    job = await run_blocking(latest_job, trip_id)
+    if job is None:
+        yield sse_message('status', job_status(None))
+        return
+
+    yield "retry: 3000\n\n"
+    deadline = time.monotonic() + settings.PLANNER_PROGRESS_STREAM_TIMEOUT
+    last_sent = time.monotonic()
+    while time.monotonic() < deadline:
+        events = await run_blocking(events_after, job.id, last_event_id)
+        for event in events:
+            last_event_id = event.id
+            last_sent = time.monotonic()
+            yield sse_message(event.event, {'node': event.node, **event.payload}, event_id=event.id)
+            if event.event in TERMINAL_EVENTS:
+                return
+
+        if not events:
+            job = await run_blocking(GenerationJob.objects.get, id=job.id)
+            if job.status in FINISHED_STATUSES:
+                # Finished without a terminal event, e.g. reaped after a worker crash.
+                yield sse_message('status', job_status(job))
+                return
+            if time.monotonic() - last_sent >= STREAM_HEARTBEAT_SECONDS:
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+        await asyncio.sleep(settings.PLANNER_PROGRESS_POLL_INTERVAL)
+    yield sse_message('timeout', job_status(job))
+
+
+async def run_job(job, worker_id, lease_seconds):
+    """Runs one claimed job to completion, renewing its lease and publishing progress as nodes finish."""
+    from .langgraph_logic import GRAPH_NODES, generate_complete_trip_automatically
+
+    finished_nodes = set()
+
+    async def report_progress(event, node_name, **data):
+        if event != 'node_finished':
+            await run_blocking(record_event, job.id, event, node_name, attempt=job.attempts)
+            return
+        finished_nodes.add(node_name)
+        progress = min(99, int(len(finished_nodes) * 100 / len(GRAPH_NODES)))
+        result = data.get('result') or {}
+        artifacts = await run_blocking(resolve_fields, {
+            field: result[field] for field in result.get('changed_fields', ()) if field in STREAMED_ARTIFACTS
+        })
+        await run_blocking(
+            record_event, job.id, event, node_name, attempt=job.attempts, progress=progress,
+            duration=round(data.get('duration', 0.0), 3), warning=result.get('warning', ''), artifacts=artifacts,
+        )
+        await run_blocking(update_progress, job.id, worker_id, progress, f'Finished {node_name}')
+
+    lease_lost = False
+
+    async def keep_lease(generation):
+        """Renews the lease; once it is lost, cancels the run so it cannot overlap with the worker that took over."""
+        nonlocal lease_lost
+        renewed_at = time.monotonic()
+        while True:
+            await asyncio.sleep(lease_seconds / 3)
+            try:
+                if await run_blocking(renew_lease, job.id, worker_id, lease_seconds):
+                    renewed_at = time.monotonic()
+                    continue
+                print(f"--- run_job: lost the lease on job {job.id} ---")
+            except Exception as e:
+                # The lease may still hold; give up only once it would have expired.
+                print(f"--- run_job: could not renew the lease on job {job.id}: {e} ---")
+                if time.monotonic() - renewed_at < lease_seconds:
+                    continue
+            lease_lost = True
+            generation.cancel()
+            return
+
+    print(f"--- run_job: {worker_id} running job {job.id} ({job.kind}) for trip {job.trip_id}, attempt {job.attempts} ---")
+    async def finish_failed(error):
+        status = await run_blocking(fail_job, job.id, worker_id, error)
+        if status is not None:
+            event = 'job_retrying' if status == GenerationJob.QUEUED else 'job_failed'
+            await run_blocking(record_event, job.id, event, attempt=job.attempts, error=error)
+
+    await run_blocking(record_event, job.id, 'job_started', attempt=job.attempts)
+    # Retries pick up from the last checkpoint of the attempt that failed.
+    generation = asyncio.create_task(generate_complete_trip_automatically(
+        {"trip_id": job.trip_id}, listener=report_progress, resume=job.attempts > 1, repair=job.kind == REPAIR,
+    ))
+    lease_task = asyncio.create_task(keep_lease(generation))
+    try:
+        try:
+            result = await generation
+        except asyncio.CancelledError:
+            if not lease_lost:
+                raise
+            # The job now belongs to another worker, which records its outcome.
+            print(f"--- run_job: stopped job {job.id} after losing its lease ---")
+            return
+        pending = result.get("pending_nodes") or []
+        if not result.get("complete_generation"):
+            await finish_failed(result.get("warning", "Generation failed"))
+        elif pending and job.kind == REPAIR:
+            # Backfills retry with backoff until the late nodes make it in time.
+            await finish_failed(f"Still pending: {', '.join(pending)}")
+        else:
+            if pending:
+                # The trip was saved with what finished in time; the rest is backfilled.
+                await run_blocking(enqueue_generation, job.trip_id, REPAIR)
+            await run_blocking(complete_job, job.id, worker_id)
+            await run_blocking(record_event, job.id, 'job_succeeded', attempt=job.attempts, progress=100, pending_nodes=pending)
+    except Exception as e:
+        print(traceback.format_exc())
+        await finish_failed(str(e))
+    finally:
+        lease_task.cancel()
+        generation.cancel()
@@ -1,23 +1,25 @@
-from .models import Trip, ChatMessage, Checkpoint
-from typing import TypedDict, Annotated, Optional
-from langgraph.graph import StateGraph, END
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_community.utilities import GoogleSerperAPIWrapper
+from .models import Trip, ChatMessage, Checkpoint, GraphRunProfile
+from typing import Any, TypedDict, Annotated, Optional
+from langgraph.graph import StateGraph, START, END
 import os
-from .models import Trip, ChatMessage, Checkpoint
+import re
 from langchain_core.messages import HumanMessage, AIMessage
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 import asyncio
-from asgiref.sync import sync_to_async
-from .rag_logic import hyde_search_trips
+import functools
+import operator
+import threading
+from django.conf import settings
+from .rag_logic import retrieve_trip_context
 import json
-from .utils import convert_markdown_to_html
+from .utils import MarkdownBlockBuffer, convert_markdown_to_html
 from langchain_core.tools import tool
-# Initialize LLM
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-pro", google_api_key=os.getenv("GOOGLE_API_KEY"))
-
-# Initialize GoogleSerperAPIWrapper
-search = GoogleSerperAPIWrapper(serper_api_key=os.getenv("SERPER_API_KEY"))
+from .providers import llm, ainvoke_llm, astream_llm, message_text, serper_search, cached_llm_text
+from .artifacts import artifact_store, is_ref, offload_fields, resolve_fields
+from .chat_memory import fit_to_budget, load_chat_memory, schedule_chat_summary
+from .concurrency import run_blocking
+from .idempotency import exclusive_flight
+from .profiling import NodeTimeline, current_timeline, timed_node
 
 class ActivitySuggestion(BaseModel):
     name: str
@@ -73,31 +75,261 @@ class ItineraryDay(BaseModel):
 class StructuredItinerary(BaseModel):
     days: list[ItineraryDay]
 
+class TripSnapshot(BaseModel):
+    """The trip preferences every agent reads (and the last run's warnings), loaded once per graph run."""
+    model_config = ConfigDict(frozen=True)
+
+    id: int
+    user_id: int
+    destination: str
+    month: str
+    duration: int
+    num_people: str
+    holiday_type: str
+    budget_type: str
+    comments: Optional[str] = None
+    generation_warnings: dict = {}
+
+def merge_warnings(left, right):
+    return {**(left or {}), **(right or {})}
+
 # Define state
+# An agent output as it travels through the graph: a reference into the
+# artifact store (see artifacts.py), or the value itself when it is small.
+Artifact = Any
+
 class GraphState(TypedDict):
     trip_id: int
+    trip: TripSnapshot
+    changed_fields: Annotated[list[str], operator.add]
+    # Agent nodes a repair run executes; every other agent node is skipped.
+    only_nodes: Optional[list[str]]
+    warnings: Annotated[dict, merge_warnings]
     preferences_text: str
-    itinerary: str
-    activity_suggestions: list[ActivitySuggestion]
-    useful_links: list[UsefulLink]
-    weather_forecast: dict
-    packing_list: str
-    food_culture_info: FoodCultureInfo
-    accommodation_info: list[AccommodationOption]
-    expense_breakdown: str
-    complete_trip_plan: str
+    itinerary: Artifact
+    activity_suggestions: Artifact
+    useful_links: Artifact
+    weather_forecast: Artifact
+    packing_list: Artifact
+    food_culture_info: Artifact
+    accommodation_info: Artifact
+    expense_breakdown: Artifact
+    complete_trip_plan: Artifact
     
     chat_history: Annotated[list[dict], "List of question-response pairs"]
     user_question: str
     chat_response: str
 
+async def load_trip_snapshot(state):
+    """
+    Returns the trip preferences for a node. Graph runs carry the snapshot in
+    state, so only standalone agent calls (process_trip, chat tools) hit the
+    database here.
+    """
+    if state.get('trip') is not None:
+        return state['trip']
+    values = await run_blocking(Trip.objects.values(*TripSnapshot.model_fields).get, id=state['trip_id'])
+    timeline = current_timeline.get()
+    if timeline is not None:
+        timeline.trip_reads += 1
+    return TripSnapshot(**values)
+
+# Trip columns produced by the agents. Agents only return these; they are
+# written once, by persist_outputs at the end of a graph run or by
+# run_agent_standalone for single-agent calls.
+PERSISTED_FIELDS = (
+    "itinerary", "activity_suggestions", "useful_links", "weather_forecast", "packing_list",
+    "food_culture_info", "accommodation_info", "expense_breakdown", "complete_trip_plan",
+)
+
+def save_trip_fields(trip_id, user_id=None, **fields):
+    """
+    Writes only the given columns of a trip (save(update_fields=...)), never
+    the whole row. Pass the owner's ``user_id`` when it is at hand, so the
+    post_save handlers need not look it up.
+    """
+    if not fields:
+        return
+    trip = Trip(id=trip_id, user_id=user_id)
+    for name, value in fields.items():
+        setattr(trip, name, value)
+    trip.save(update_fields=list(fields))
+
+def changed_fields(result):
+    """The persisted fields an agent produced successfully; failed agents change nothing."""
+    if not isinstance(result, dict) or result.get("warning"):
+        return []
+    return [name for name in PERSISTED_FIELDS if name in result]
+
+def tracks_changes(node_name, func):
+    """
+    Records which trip fields a graph node produced so persist_outputs only
+    writes those, and moves the large ones into the artifact store so state
+    (and every checkpoint) only carries their references. Warnings are kept
+    per node for repair runs, which skip the nodes they did not select.
+    """
+    @functools.wraps(func)
+    async def wrapper(state):
+        only_nodes = state.get('only_nodes')
+        if only_nodes is not None and node_name not in only_nodes:
+            return {}
+        result = await func(state)
+        names = changed_fields(result)
+        if names:
+            result = {**result, **await run_blocking(offload_fields, result, names)}
+        result = {**result, "changed_fields": names}
+        if result.get("warning"):
+            result["warnings"] = {node_name: result["warning"]}
+        return result
+    return wrapper
+
+# Warnings of nodes that ran out of time start with this; repair runs backfill them.
+PENDING_PREFIX = "Pending: "
+
+def pending_nodes(warnings):
+    return [node for node, warning in (warnings or {}).items() if str(warning).startswith(PENDING_PREFIX)]
+
+def node_timeout(node_name):
+    """Seconds a node may run: its configured timeout, cut short by the run's deadline. None means unbounded."""
+    timeout = settings.PLANNER_NODE_TIMEOUTS.get(node_name, settings.PLANNER_NODE_TIMEOUT) or None
+    timeline = current_timeline.get()
+    remaining = timeline.remaining() if timeline is not None else None
+    if remaining is not None:
+        timeout = remaining if timeout is None else min(timeout, remaining)
+    return timeout
+
+def with_deadline(node_name, func):
+    """
+    Bounds a graph node by node_timeout(). A node that runs out of time, or
+    that reads the output of one that did, returns a pending warning instead
+    of its outputs, so the rest of the trip is saved without waiting for it.
+    """
+    @functools.wraps(func)
+    async def wrapper(state):
+        waiting_on = [node for node in NODE_DEPENDENCIES[node_name] if node in pending_nodes(state.get('warnings'))]
+        if waiting_on:
+            return {"warning": f"{PENDING_PREFIX}waiting for {', '.join(waiting_on)}"}
+        timeout = node_timeout(node_name)
+        if timeout is not None and timeout <= 0:
+            print(f"--- {node_name}: generation deadline passed, left pending ---")
+            return {"warning": f"{PENDING_PREFIX}generation deadline passed"}
+        try:
+            return await asyncio.wait_for(func(state), timeout)
+        except asyncio.TimeoutError:
+            print(f"--- {node_name}: timed out after {timeout:.1f} seconds, left pending ---")
+            return {"warning": f"{PENDING_PREFIX}timed out after {timeout:.0f}s"}
+    return wrapper
+
+def merged_warnings(previous, rerun_nodes, new_warnings):
+    """Warnings of the nodes that ran replace theirs from earlier runs; the rest are kept."""
+    warnings = {node: warning for node, warning in (previous or {}).items() if node not in rerun_nodes}
+    warnings.update(new_warnings or {})
+    return warnings
+
+async def persist_outputs(state):
+    """Writes every agent output of the run, and its warnings, in a single UPDATE of the changed columns."""
+    names = list(dict.fromkeys(state.get('changed_fields') or []))
+    print(f"--- persist_outputs: writing {names} for trip {state['trip_id']} ---")
+    previous = state['trip'].generation_warnings if state.get('trip') is not None else {}
+    warnings = merged_warnings(previous, state.get('only_nodes') or AGENT_NODES, state.get('warnings'))
+
+    def write():
+        fields = resolve_fields({name: state[name] for name in names})
+        user_id = state['trip'].user_id if state.get('trip') is not None else None
+        save_trip_fields(state['trip_id'], user_id, **fields, generation_warnings=warnings)
+
+    await run_blocking(write)
+    return {}
+
+# Chat tools run side by side, and each merges its warning into the trip's
+# generation_warnings; the read-modify-write must not interleave.
+_standalone_write_lock = threading.Lock()
+
+async def run_agent_standalone(agent, state):
+    """Runs one agent outside the graph and saves just the fields it produced, plus its warning."""
+    result = await agent(state)
+    names = changed_fields(result)
+    node_name = next((name for name, node_agent in AGENT_NODES.items() if node_agent is agent), None)
+    user_id = state['trip'].user_id if state.get('trip') is not None else None
+
+    def write():
+        fields = {name: result[name] for name in names}
+        with _standalone_write_lock:
+            if node_name is not None:
+                previous = Trip.objects.values_list('generation_warnings', flat=True).get(id=state['trip_id'])
+                warnings = merged_warnings(previous, [node_name], {node_name: result["warning"]} if result.get("warning") else {})
+                if warnings != (previous or {}):
+                    fields["generation_warnings"] = warnings
+            save_trip_fields(state['trip_id'], user_id, **fields)
+
+    await run_blocking(write)
+    return result
+
+def nodes_to_repair(outputs, warnings, has_places):
+    """
+    The agent nodes a repair run has to execute: those whose outputs are empty
+    or that reported a warning last time, plus every node reading their outputs.
+    """
+    selected = {node for node, fields in NODE_OUTPUTS.items() if any(not outputs.get(field) for field in fields)}
+    selected |= set(warnings or {}) & set(AGENT_NODES)
+    if outputs.get("itinerary") and not has_places:
+        selected.add("extract_places")
+
+    while True:
+        produced = {field for node in selected for field in NODE_OUTPUTS[node]}
+        dependents = {node for node, reads in NODE_INPUTS.items() if produced & set(reads)} - selected
+        if not dependents:
+            break
+        selected |= dependents
+    return [node for node in AGENT_NODES if node in selected]
+
+def load_repair_plan(trip_id, warnings):
+    outputs = Trip.objects.values(*PERSISTED_FIELDS).get(id=trip_id)
+    has_places = Checkpoint.objects.filter(trip_id=trip_id).exists()
+    return nodes_to_repair(outputs, warnings, has_places)
+
+# Prompts of the agents whose output depends only on the destination (and
+# month/trip shape), not on the user. Their outputs are served from the
+# artifact cache, keyed on a hash of the template, so edit them here.
+WEATHER_FORECAST_PROMPT = """
+    Provide a weather forecast for {destination} in {month}.
+    Include temperature, precipitation, and travel advice.
+    Do not repeat any section headers or content.
+    """
+
+PACKING_LIST_PROMPT = """
+    Generate a packing list for a {holiday_type} trip to {destination} in {month} for {duration} days.
+    Use bullet points for each item.
+    Base the list on the weather and trip type.
+    Do not repeat any section headers or content.
+    """
+
+CULTURAL_INFO_PROMPT = """
+        Provide a list of important cultural norms and etiquette tips for a trip to {destination}.
+        Do not repeat any section headers or content.
+        """
+
 # Agent functions
 import time
 
+async def _itinerary_search_context(query):
+    """
+    Runs one of generate_itinerary's search queries under its own timeout.
+    A failing or slow query degrades to a placeholder line without holding up the others.
+    """
+    try:
+        search_results = await asyncio.wait_for(serper_search(query, site="serper:itinerary"), timeout=settings.PLANNER_ITINERARY_SEARCH_TIMEOUT)
+        return "\n".join([r.get('snippet', '') for r in search_results.get('organic', [])[:3]]) + "\n"
+    except asyncio.TimeoutError:
+        print(f"--- generate_itinerary: Serper API timed out for query '{query}' ---")
+    except Exception as e:
+        print(f"--- generate_itinerary: Serper API Error for query '{query}': {e} ---")
+    return f"Could not retrieve information for query: {query}\n"
+
 async def generate_itinerary(state):
     print("--- generate_itinerary: START ---")
     start_time = time.time()
-    trip = await sync_to_async(Trip.objects.get)(id=state['trip_id'])
+    trip = await load_trip_snapshot(state)
 
     # 1. Generate multiple search queries
     query_generation_prompt = f"""
@@ -119,7 +351,7 @@ async def generate_itinerary(state):
     """
     try:
         print("--- generate_itinerary: Generating search queries... ---")
-        query_generation_result = await sync_to_async(llm.invoke)([HumanMessage(content=query_generation_prompt)])
+        query_generation_result = await ainvoke_llm([HumanMessage(content=query_generation_prompt)], site="gemini:itinerary_queries")
         json_string = query_generation_result.content.strip()
         # Extract JSON from markdown code block if present
         if json_string.startswith('```json') and json_string.endswith('```'):
@@ -132,17 +364,9 @@ async def generate_itinerary(state):
         print(f"--- generate_itinerary: Query generation failed: {e} ---")
         queries = [f"best things to do in {trip.destination} in {trip.month}"]
 
-    # 2. Execute all queries and combine the results
-    search_context = ""
+    # 2. Execute all queries concurrently and combine the results in query order
     print("--- generate_itinerary: Executing search queries... ---")
-    for query in queries:
-        try:
-            search_results = await sync_to_async(search.results)(query)
-            search_context += "\n".join([r['snippet'] for r in search_results.get('organic', [])[:3]])
-            search_context += "\n"
-        except Exception as e:
-            print(f"--- generate_itinerary: Serper API Error for query '{query}': {e} ---")
-            search_context += f"Could not retrieve information for query: {query}\n"
+    search_context = "".join(await asyncio.gather(*(_itinerary_search_context(query) for query in queries)))
     print(f"--- generate_itinerary: Combined search context:\n{search_context} ---")
 
 
@@ -223,7 +447,7 @@ async def generate_itinerary(state):
     try:
         print("--- generate_itinerary: Generating itinerary with LLM... ---")
         llm_start_time = time.time()
-        result = await sync_to_async(llm.invoke)([HumanMessage(content=prompt)])
+        result = await ainvoke_llm([HumanMessage(content=prompt)], site="gemini:itinerary", hedge=True)
         llm_end_time = time.time()
         print(f"--- generate_itinerary: LLM call took {llm_end_time - llm_start_time:.2f} seconds ---")
         
@@ -238,11 +462,10 @@ async def generate_itinerary(state):
         parsed_itinerary = json.loads(json_string)
         validated_itinerary = StructuredItinerary(**parsed_itinerary)
         
-        trip.itinerary = json.dumps(validated_itinerary.dict()) # Store as JSON string
-        await sync_to_async(trip.save)()
+        itinerary = json.dumps(validated_itinerary.dict()) # Store as JSON string
         end_time = time.time()
         print(f"--- generate_itinerary: END ({end_time - start_time:.2f} seconds) ---")
-        return {"itinerary": trip.itinerary}
+        return {"itinerary": itinerary}
     except json.JSONDecodeError as e:
         print(f"--- generate_itinerary: JSON Decode Error: {e} ---")
         print(f"--- generate_itinerary: Raw LLM output: {json_string} ---")
@@ -256,11 +479,11 @@ async def generate_itinerary(state):
 async def recommend_activities_agent(state):
     print("--- recommend_activities_agent: START ---")
     start_time = time.time()
-    trip = await sync_to_async(Trip.objects.get)(id=state['trip_id'])
+    trip = await load_trip_snapshot(state)
     query = f"Unique local activities in {trip.destination} for {trip.month}"
     try:
         search_start_time = time.time()
-        search_results = await sync_to_async(search.results)(query)
+        search_results = await serper_search(query, site="serper:recommend_activities")
         search_end_time = time.time()
         print(f"--- recommend_activities_agent: Search call took {search_end_time - search_start_time:.2f} seconds ---")
         organic_results = search_results.get("organic", [])
@@ -274,11 +497,10 @@ async def recommend_activities_agent(state):
                 video_url=""
             ))
         
-        trip.activity_suggestions = [act.dict() for act in activities]
-        await sync_to_async(trip.save)()
+        activity_suggestions = [act.dict() for act in activities]
         end_time = time.time()
         print(f"--- recommend_activities_agent: END ({end_time - start_time:.2f} seconds) ---")
-        return {"activity_suggestions": trip.activity_suggestions}
+        return {"activity_suggestions": activity_suggestions}
     except Exception as e:
         end_time = time.time()
         print(f"--- recommend_activities_agent: ERROR ({end_time - start_time:.2f} seconds) - {e} ---")
@@ -287,11 +509,11 @@ async def recommend_activities_agent(state):
 async def fetch_useful_links_agent(state):
     print("--- fetch_useful_links_agent: START ---")
     start_time = time.time()
-    trip = await sync_to_async(Trip.objects.get)(id=state['trip_id'])
+    trip = await load_trip_snapshot(state)
     query = f"Travel tips and guides for {trip.destination} in {trip.month}"
     try:
         search_start_time = time.time()
-        search_results = await sync_to_async(search.results)(query)
+        search_results = await serper_search(query, site="serper:fetch_useful_links")
         search_end_time = time.time()
         print(f"--- fetch_useful_links_agent: Search call took {search_end_time - search_start_time:.2f} seconds ---")
         organic_results = search_results.get("organic", [])
@@ -301,11 +523,10 @@ async def fetch_useful_links_agent(state):
         ]
         unique_links_data = set((link.title, link.link) for link in links)
         links = [UsefulLink(title=title, link=link) for title, link in unique_links_data]
-        trip.useful_links = [link.dict() for link in links]
-        await sync_to_async(trip.save)()
+        useful_links = [link.dict() for link in links]
         end_time = time.time()
         print(f"--- fetch_useful_links_agent: END ({end_time - start_time:.2f} seconds) ---")
-        return {"useful_links": trip.useful_links}
+        return {"useful_links": useful_links}
     except Exception as e:
         end_time = time.time()
         print(f"--- fetch_useful_links_agent: ERROR ({end_time - start_time:.2f} seconds) - {e} ---")
@@ -314,22 +535,19 @@ async def fetch_useful_links_agent(state):
 async def weather_forecaster_agent(state):
     print("--- weather_forecaster_agent: START ---")
     start_time = time.time()
-    trip = await sync_to_async(Trip.objects.get)(id=state['trip_id'])
-    prompt = f"""
-    Provide a weather forecast for {trip.destination} in {trip.month}.
-    Include temperature, precipitation, and travel advice.
-    Do not repeat any section headers or content.
-    """
+    trip = await load_trip_snapshot(state)
     try:
         llm_start_time = time.time()
-        result = await sync_to_async(llm.invoke)([HumanMessage(content=prompt)])
+        forecast = await cached_llm_text(
+            "weather_forecaster", WEATHER_FORECAST_PROMPT, refresh=state.get('refresh_cache', False),
+            destination=trip.destination, month=trip.month,
+        )
         llm_end_time = time.time()
         print(f"--- weather_forecaster_agent: LLM call took {llm_end_time - llm_start_time:.2f} seconds ---")
-        trip.weather_forecast = convert_markdown_to_html(result.content.strip())
-        await sync_to_async(trip.save)()
+        weather_forecast = await run_blocking(convert_markdown_to_html, forecast)
         end_time = time.time()
         print(f"--- weather_forecaster_agent: END ({end_time - start_time:.2f} seconds) ---")
-        return {"weather_forecast": trip.weather_forecast}
+        return {"weather_forecast": weather_forecast}
     except Exception as e:
         end_time = time.time()
         print(f"--- weather_forecaster_agent: ERROR ({end_time - start_time:.2f} seconds) - {e} ---")
@@ -338,23 +556,19 @@ async def weather_forecaster_agent(state):
 async def packing_list_generator_agent(state):
     print("--- packing_list_generator_agent: START ---")
     start_time = time.time()
-    trip = await sync_to_async(Trip.objects.get)(id=state['trip_id'])
-    prompt = f"""
-    Generate a packing list for a {trip.holiday_type} trip to {trip.destination} in {trip.month} for {trip.duration} days.
-    Use bullet points for each item.
-    Base the list on the weather and trip type.
-    Do not repeat any section headers or content.
-    """
+    trip = await load_trip_snapshot(state)
     try:
         llm_start_time = time.time()
-        result = await sync_to_async(llm.invoke)([HumanMessage(content=prompt)])
+        packing_list = await cached_llm_text(
+            "packing_list_generator", PACKING_LIST_PROMPT, refresh=state.get('refresh_cache', False),
+            holiday_type=trip.holiday_type, destination=trip.destination, month=trip.month, duration=trip.duration,
+        )
         llm_end_time = time.time()
         print(f"--- packing_list_generator_agent: LLM call took {llm_end_time - llm_start_time:.2f} seconds ---")
-        trip.packing_list = convert_markdown_to_html(result.content.strip())
-        await sync_to_async(trip.save)()
+        packing_list = await run_blocking(convert_markdown_to_html, packing_list)
         end_time = time.time()
         print(f"--- packing_list_generator_agent: END ({end_time - start_time:.2f} seconds) ---")
-        return {"packing_list": trip.packing_list}
+        return {"packing_list": packing_list}
     except Exception as e:
         end_time = time.time()
         print(f"--- packing_list_generator_agent: ERROR ({end_time - start_time:.2f} seconds) - {e} ---")
@@ -363,11 +577,11 @@ async def packing_list_generator_agent(state):
 async def food_culture_recommender_agent(state):
     print("--- food_culture_recommender_agent: START ---")
     start_time = time.time()
-    trip = await sync_to_async(Trip.objects.get)(id=state['trip_id'])
+    trip = await load_trip_snapshot(state)
     query = f"Popular local dishes and dining options in {trip.destination} for {trip.budget_type} budget"
     try:
         search_start_time = time.time()
-        search_results = await sync_to_async(search.results)(query)
+        search_results = await serper_search(query, site="serper:food_culture_recommender")
         search_end_time = time.time()
         print(f"--- food_culture_recommender_agent: Search call took {search_end_time - search_start_time:.2f} seconds ---")
         organic_results = search_results.get("organic", [])
@@ -381,43 +595,132 @@ async def food_culture_recommender_agent(state):
                 video_url=""
             ))
         
-        cultural_prompt = f"""
-        Provide a list of important cultural norms and etiquette tips for a trip to {trip.destination}.
-        Do not repeat any section headers or content.
-        """
         llm_start_time = time.time()
-        cultural_info_result = await sync_to_async(llm.invoke)([HumanMessage(content=cultural_prompt)])
+        cultural_text = await cached_llm_text(
+            "food_culture_recommender", CULTURAL_INFO_PROMPT, refresh=state.get('refresh_cache', False),
+            destination=trip.destination,
+        )
         llm_end_time = time.time()
         print(f"--- food_culture_recommender_agent: LLM call took {llm_end_time - llm_start_time:.2f} seconds ---")
-        cultural_info = convert_markdown_to_html(cultural_info_result.content.strip())
+        cultural_info = await run_blocking(convert_markdown_to_html, cultural_text)
 
-        food_culture_info = FoodCultureInfo(food_options=[fo.dict() for fo in food_options], cultural_info=cultural_info)
-        trip.food_culture_info = food_culture_info.dict()
-        await sync_to_async(trip.save)()
+        food_culture_info = FoodCultureInfo(food_options=[fo.dict() for fo in food_options], cultural_info=cultural_info).dict()
         end_time = time.time()
         print(f"--- food_culture_recommender_agent: END ({end_time - start_time:.2f} seconds) ---")
-        return {"food_culture_info": trip.food_culture_info}
+        return {"food_culture_info": food_culture_info}
     except Exception as e:
         end_time = time.time()
         print(f"--- food_culture_recommender_agent: ERROR ({end_time - start_time:.2f} seconds) - {e} ---")
         return {"food_culture_info": {}, "warning": f"Failed to fetch food and culture: {str(e)}"}
 
-async def generate_complete_trip_automatically(state):
+def record_run_profile(trip_id, mode, succeeded, timeline):
+    """Stores the run's node timings and critical path; runs that executed no node are skipped."""
+    if not settings.PLANNER_RECORD_RUN_PROFILES or not timeline.spans:
+        return None
+    critical_path = timeline.critical_path(GRAPH_DEPENDENCIES)
+    return GraphRunProfile.objects.create(
+        trip_id=trip_id,
+        mode=mode,
+        succeeded=succeeded,
+        wall_clock=timeline.wall_clock(),
+        node_timings=timeline.node_timings(),
+        critical_path=critical_path["nodes"],
+        critical_path_seconds=critical_path["duration"],
+    )
+
+async def generate_complete_trip_automatically(state, listener=None, resume=False, repair=False, deadline=None):
+    """
+    Runs the full generation graph for a trip.
+
+    Nodes get ``deadline`` seconds overall (PLANNER_GENERATION_DEADLINE by
+    default, 0 for none) on top of their own timeouts. Nodes still running
+    then are left pending: the trip is saved with everything that finished
+    and ``pending_nodes`` lists the rest, for a repair run to backfill.
+
+    With ``resume=True`` a previous run that stopped part way (an exception or
+    a crashed worker) continues from its last checkpoint, so nodes that already
+    finished are not paid for again. Otherwise the trip's thread is cleared and
+    the run starts from scratch.
+
+    With ``repair=True`` only the agent nodes whose outputs are missing or
+    carried a warning last time, and the nodes that depend on them, are
+    executed; ``repaired_nodes`` in the result lists them.
+
+    Large agent outputs in the returned state are artifact references; the
+    values themselves are saved on the trip.
+
+    Runs of one trip share its checkpoint thread and row, so they never
+    overlap: whichever caller comes second (a view, a chat tool or a queued
+    job) waits for the first to finish.
+    """
+    async with exclusive_flight(f"graph:{state['trip_id']}"):
+        return await _run_graph(state, listener, resume, repair, deadline)
+
+async def _run_graph(state, listener, resume, repair, deadline):
     print(f"Starting complete trip generation for trip {state['trip_id']}")
     
-    config = {"configurable": {"thread_id": str(state['trip_id'])}}
+    thread_id = str(state['trip_id'])
+    config = {"configurable": {"thread_id": thread_id}}
+    deadline = settings.PLANNER_GENERATION_DEADLINE if deadline is None else deadline
+    timeline = NodeTimeline(listener=listener, deadline=time.time() + deadline if deadline else None)
+    timeline_token = current_timeline.set(timeline)
+    mode = GraphRunProfile.REPAIR if repair else GraphRunProfile.FULL
+    succeeded = False
     
     try:
-        final_state = await graph.ainvoke(state, config=config)
+        snapshot = await graph.aget_state(config) if resume and not repair else None
+        repaired_nodes = None
+        if snapshot is not None and snapshot.next:
+            print(f"--- generate_complete_trip_automatically: resuming trip {thread_id} at {list(snapshot.next)} ---")
+            mode = GraphRunProfile.RESUME
+            final_state = await graph.ainvoke(None, config=config)
+        else:
+            # A fresh thread, so reducer channels such as changed_fields don't carry over from older runs.
+            await checkpointer.adelete_thread(thread_id)
+            # Load the preferences once; every node reads them from state.
+            state = {**state, "trip": await load_trip_snapshot(state)}
+            if repair:
+                repaired_nodes = await run_blocking(load_repair_plan, state['trip_id'], state['trip'].generation_warnings)
+                print(f"--- generate_complete_trip_automatically: repairing {repaired_nodes} for trip {thread_id} ---")
+                if not repaired_nodes:
+                    return {"complete_generation": True, "repaired_nodes": [], "pending_nodes": [], "node_timings": {}, "trip_reads": timeline.trip_reads}
+                state["only_nodes"] = repaired_nodes
+            final_state = await graph.ainvoke(state, config=config)
+        branch_overlap = timeline.overlap_report(BRANCH_NODES)
+        critical_path = timeline.critical_path(GRAPH_DEPENDENCIES)
+        late_nodes = pending_nodes(final_state.get("warnings"))
+        if late_nodes:
+            print(f"--- generate_complete_trip_automatically: {late_nodes} left pending for trip {thread_id} ---")
+        succeeded = True
         print(f"Finished complete trip generation for trip {state['trip_id']}")
+        print(f"--- generate_complete_trip_automatically: branch overlap {branch_overlap} ---")
+        print(f"--- generate_complete_trip_automatically: critical path {critical_path} ---")
         return {
             "complete_generation": True,
-            **final_state
+            **final_state,
+            "node_timings": timeline.node_timings(),
+            "branch_overlap": branch_overlap,
+            "critical_path": critical_path,
+            "pending_nodes": late_nodes,
+            "trip_reads": timeline.trip_reads,
+            **({"repaired_nodes": repaired_nodes} if repaired_nodes is not None else {}),
         }
         
     except Exception as e:
         print(f"Error in complete trip generation: {str(e)}")
         return {"complete_generation": False, "warning": f"Failed to generate complete trip: {str(e)}"}
+    finally:
+        current_timeline.reset(timeline_token)
+        try:
+            await run_blocking(record_run_profile, thread_id, mode, succeeded, timeline)
+        except Exception as e:
+            print(f"--- generate_complete_trip_automatically: could not record the run profile for trip {thread_id}: {e} ---")
+        try:
+            await run_blocking(checkpointer.prune, thread_id=thread_id, max_per_thread=settings.PLANNER_CHECKPOINT_MAX_PER_THREAD)
+            # Outputs of this trip's earlier runs are unreferenced once their snapshots are gone.
+            await run_blocking(artifact_store.prune_unreferenced, settings.PLANNER_ARTIFACT_ORPHAN_GRACE)
+        except Exception as e:
+            print(f"--- generate_complete_trip_automatically: could not prune checkpoints for trip {thread_id}: {e} ---")
 
 @tool
 async def update_activities(instruction: str = None, trip_id: int = None) -> str:
@@ -430,7 +733,7 @@ async def update_activities(instruction: str = None, trip_id: int = None) -> str
     if not trip_id:
         return "Error: trip_id was not provided to the tool."
     state = {"trip_id": trip_id, "user_question": instruction or ""}
-    result = await recommend_activities_agent(state)
+    result = await run_agent_standalone(recommend_activities_agent, state)
     if result.get("warning"): return f"Failed to update activities: {result['warning']}"
     return "Activity suggestions updated successfully."
 
@@ -445,7 +748,7 @@ async def update_useful_links(instruction: str = None, trip_id: int = None) -> s
     if not trip_id:
         return "Error: trip_id was not provided to the tool."
     state = {"trip_id": trip_id, "user_question": instruction or ""}
-    result = await fetch_useful_links_agent(state)
+    result = await run_agent_standalone(fetch_useful_links_agent, state)
     if result.get("warning"): return f"Failed to update useful links: {result['warning']}"
     return "Useful links updated successfully."
 
@@ -458,8 +761,8 @@ async def update_weather_forecast(instruction: str = None, trip_id: int = None)
     """
     if not trip_id:
         return "Error: trip_id was not provided to the tool."
-    state = {"trip_id": trip_id, "user_question": instruction or ""}
-    result = await weather_forecaster_agent(state)
+    state = {"trip_id": trip_id, "user_question": instruction or "", "refresh_cache": True}
+    result = await run_agent_standalone(weather_forecaster_agent, state)
     if result.get("warning"): return f"Failed to update weather forecast: {result['warning']}"
     return "Weather forecast updated successfully."
 
@@ -473,8 +776,8 @@ async def update_packing_list(instruction: str = None, trip_id: int = None) -> s
     """
     if not trip_id:
         return "Error: trip_id was not provided to the tool."
-    state = {"trip_id": trip_id, "user_question": instruction or ""}
-    result = await packing_list_generator_agent(state)
+    state = {"trip_id": trip_id, "user_question": instruction or "", "refresh_cache": True}
+    result = await run_agent_standalone(packing_list_generator_agent, state)
     if result.get("warning"): return f"Failed to update packing list: {result['warning']}"
     return "Packing list updated successfully."
 
@@ -487,8 +790,8 @@ async def update_food_culture_info(instruction: str = None, trip_id: int = None)
     """
     if not trip_id:
         return "Error: trip_id was not provided to the tool."
-    state = {"trip_id": trip_id, "user_question": instruction or ""}
-    result = await food_culture_recommender_agent(state)
+    state = {"trip_id": trip_id, "user_question": instruction or "", "refresh_cache": True}
+    result = await run_agent_standalone(food_culture_recommender_agent, state)
     if result.get("warning"): return f"Failed to update food and culture information: {result['warning']}"
     return "Food and culture information updated successfully."
 
@@ -502,7 +805,7 @@ async def update_accommodation_info(instruction: str = None, trip_id: int = None
     if not trip_id:
         return "Error: trip_id was not provided to the tool."
     state = {"trip_id": trip_id, "user_question": instruction or ""}
-    result = await accommodation_recommender_agent(state)
+    result = await run_agent_standalone(accommodation_recommender_agent, state)
     if result.get("warning"): return f"Failed to update accommodation information: {result['warning']}"
     return "Accommodation information updated successfully."
 
@@ -516,7 +819,7 @@ async def update_expense_breakdown(instruction: str = None, trip_id: int = None)
     if not trip_id:
         return "Error: trip_id was not provided to the tool."
     state = {"trip_id": trip_id, "user_question": instruction or ""}
-    result = await expense_breakdown_agent(state)
+    result = await run_agent_standalone(expense_breakdown_agent, state)
     if result.get("warning"): return f"Failed to update expense breakdown: {result['warning']}"
     return "Expense breakdown updated successfully."
 
@@ -530,7 +833,7 @@ async def update_complete_trip_plan(instruction: str = None, trip_id: int = None
     if not trip_id:
         return "Error: trip_id was not provided to the tool."
     state = {"trip_id": trip_id, "user_question": instruction or ""}
-    result = await complete_trip_plan_agent(state)
+    result = await run_agent_standalone(complete_trip_plan_agent, state)
     if result.get("warning"): return f"Failed to update complete trip plan: {result['warning']}"
     return "Complete trip plan updated successfully."
 
@@ -549,26 +852,64 @@ async def generate_full_trip_plan(instruction: str = None, trip_id: int = None)
         return f"Failed to generate full trip plan: {result['warning']}"
     return "Full trip plan generated successfully."
 
+@tool
+async def repair_trip_plan(instruction: str = None, trip_id: int = None) -> str:
+    """
+    Regenerates only the parts of the current trip plan that are missing or failed to generate last time
+    (for example accommodation or weather that could not be fetched), keeping everything else as it is.
+    Use this tool when the user says a section is empty, broken or failed to load.
+    The trip ID is handled automatically. Do not ask the user for it.
+    """
+    if not trip_id:
+        return "Error: trip_id was not provided to the tool."
+    state = {"trip_id": trip_id, "user_question": instruction or ""}
+    result = await generate_complete_trip_automatically(state, repair=True)
+    if result.get("warning"):
+        return f"Failed to repair trip plan: {result['warning']}"
+    if not result.get("repaired_nodes"):
+        return "Nothing needed repairing; every section of the trip plan is complete."
+    return f"Repaired: {', '.join(node.replace('_', ' ') for node in result['repaired_nodes'])}."
+
 tools = [
     update_activities, update_useful_links, update_weather_forecast, update_packing_list,
     update_food_culture_info, update_accommodation_info, update_expense_breakdown, update_complete_trip_plan,
-    generate_full_trip_plan,
+    generate_full_trip_plan, repair_trip_plan,
 ]
 
 llm_with_tools = llm.bind_tools(tools)
 
-async def chat_agent(state):
-    print("--- chat_agent: START ---")
-    trip = await sync_to_async(Trip.objects.get)(id=state['trip_id'])
+# Trip fields each chat tool rewrites; None means it rewrites or reads the
+# whole plan. run_chat_tools runs tools whose fields do not overlap at the
+# same time, and the rest in the order the model asked for them.
+CHAT_TOOL_FIELDS = {
+    "update_activities": {"activity_suggestions"},
+    "update_useful_links": {"useful_links"},
+    "update_weather_forecast": {"weather_forecast"},
+    "update_packing_list": {"packing_list"},
+    "update_food_culture_info": {"food_culture_info"},
+    "update_accommodation_info": {"accommodation_info"},
+    "update_expense_breakdown": {"expense_breakdown"},
+    # Synthesised from every other section.
+    "update_complete_trip_plan": None,
+    "generate_full_trip_plan": None,
+    "repair_trip_plan": None,
+}
+
+def chat_tools_conflict(first, second):
+    first_fields, second_fields = CHAT_TOOL_FIELDS.get(first), CHAT_TOOL_FIELDS.get(second)
+    return first_fields is None or second_fields is None or bool(first_fields & second_fields)
+
+async def build_chat_messages(trip, state):
+    """Builds the chat prompt: retrieved trip context, the conversation so far and the new question."""
     user_question = state['user_question']
-    chat_history = state.get('chat_history', [])
+    memory = await run_blocking(load_chat_memory, trip.id)
+    chat_history = memory['chat_history']
     print(f"--- chat_agent: User question: {user_question} ---")
 
-    # RAG with HyDE: Search for relevant trip plans
-    print("--- chat_agent: Starting RAG with HyDE search... ---")
-    user_id = await sync_to_async(lambda: trip.user.id)()
-    retrieved_docs = await hyde_search_trips(user_question, user_id=user_id)
-    context = "\n".join(retrieved_docs)
+    # RAG: search the user's trips, with HyDE only when the question needs it
+    user_id = trip.user_id
+    retrieved_docs = await retrieve_trip_context(user_question, user_id=user_id)
+    context = "\n".join(fit_to_budget(retrieved_docs, settings.PLANNER_CHAT_CONTEXT_TOKENS))
     print(f"--- chat_agent: Retrieved context:\n{context} ---")
 
 
@@ -580,6 +921,9 @@ async def chat_agent(state):
     Context:
     {context}
 
+    Summary of the earlier conversation:
+    {memory['chat_summary'] or "(none)"}
+
     Conversation History:
     """
     
@@ -594,54 +938,148 @@ async def chat_agent(state):
     messages.insert(0, HumanMessage(content=prompt_with_context))
             
     messages.append(HumanMessage(content=user_question))
+    return messages
+
+async def run_chat_tool(tool_call, trip):
+    """Runs one tool call under its timeout and returns its output line for the model."""
+    name = tool_call["name"]
+    selected_tool = next((t for t in tools if t.name == name), None)
+    if selected_tool is None:
+        print(f"--- chat_agent: Tool {name} not found. ---")
+        return f"Tool {name} not found."
+    tool_args = {**tool_call["args"], "trip_id": trip.id}
+    timeout = settings.PLANNER_CHAT_TOOL_TIMEOUTS.get(name, settings.PLANNER_CHAT_TOOL_TIMEOUT) or None
+    try:
+        print(f"--- chat_agent: Executing tool '{name}' with args: {tool_args} ---")
+        tool_output = await asyncio.wait_for(selected_tool.ainvoke(tool_args), timeout)
+        print(f"--- chat_agent: Tool '{name}' output: {tool_output} ---")
+        return f"Tool {name} executed: {tool_output}"
+    except asyncio.TimeoutError:
+        print(f"--- chat_agent: Tool {name} timed out after {timeout:g}s ---")
+        return f"Tool {name} timed out after {timeout:g} seconds; that section was not updated."
+    except Exception as e:
+        print(f"--- chat_agent: Error executing tool {name}: {str(e)} ---")
+        return f"Error executing tool {name}: {str(e)}"
+
+async def run_chat_tools(tool_calls, trip):
+    """
+    Executes the tools the model asked for and returns their outputs as text,
+    in the order of ``tool_calls``. Tools that touch different trip fields run
+    concurrently, at most PLANNER_CHAT_TOOL_CONCURRENCY at a time; a tool
+    waits for the earlier ones whose fields it shares (see CHAT_TOOL_FIELDS).
+    """
+    print(f"--- chat_agent: LLM decided to use tools: {tool_calls} ---")
+    semaphore = asyncio.Semaphore(max(1, settings.PLANNER_CHAT_TOOL_CONCURRENCY))
+    tasks = []
+
+    async def run(tool_call, earlier):
+        # Errors are already turned into output lines, so waiting cannot raise.
+        await asyncio.gather(*earlier)
+        async with semaphore:
+            return await run_chat_tool(tool_call, trip)
+
+    for tool_call in tool_calls:
+        earlier = [task for previous, task in zip(tool_calls, tasks) if chat_tools_conflict(previous["name"], tool_call["name"])]
+        tasks.append(asyncio.ensure_future(run(tool_call, earlier)))
+    try:
+        return list(await asyncio.gather(*tasks))
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def save_chat_reply(trip, user_question, chat_response_text):
+    print(f"--- chat_agent: Final response:\n{chat_response_text} ---")
+    chat_response_html = await run_blocking(convert_markdown_to_html, chat_response_text)
+    await run_blocking(
+        ChatMessage.objects.create,
+        trip_id=trip.id, question=user_question, response=chat_response_html, response_markdown=chat_response_text,
+    )
+    return chat_response_html
+
+async def chat_agent(state):
+    print("--- chat_agent: START ---")
+    trip = await load_trip_snapshot(state)
+    messages = await build_chat_messages(trip, state)
 
     print("--- chat_agent: Calling LLM with tools... ---")
-    response = await sync_to_async(llm_with_tools.invoke)(messages)
+    response = await ainvoke_llm(messages, model=llm_with_tools, site="gemini:chat")
 
     if response.tool_calls:
-        print(f"--- chat_agent: LLM decided to use tools: {response.tool_calls} ---")
-        tool_outputs = []
-        for tool_call in response.tool_calls:
-            selected_tool = next((t for t in tools if t.name == tool_call.name), None)
-            if selected_tool:
-                try:
-                    tool_args = tool_call.args
-                    tool_args['trip_id'] = trip.id
-                    print(f"--- chat_agent: Executing tool '{tool_call.name}' with args: {tool_args} ---")
-                    tool_output = await selected_tool.invoke(tool_args)
-                    print(f"--- chat_agent: Tool '{tool_call.name}' output: {tool_output} ---")
-                    tool_outputs.append(f"Tool {tool_call.name} executed: {tool_output}")
-                except Exception as e:
-                    print(f"--- chat_agent: Error executing tool {tool_call.name}: {str(e)} ---")
-                    tool_outputs.append(f"Error executing tool {tool_call.name}: {str(e)}")
-            else:
-                print(f"--- chat_agent: Tool {tool_call.name} not found. ---")
-                tool_outputs.append(f"Tool {tool_call.name} not found.")
-        
+        tool_outputs = await run_chat_tools(response.tool_calls, trip)
         messages.append(response)
         messages.append(AIMessage(content=str(tool_outputs)))
         print("--- chat_agent: Calling LLM again with tool results... ---")
-        final_response = await sync_to_async(llm.invoke)(messages)
+        final_response = await ainvoke_llm(messages, site="gemini:chat")
         chat_response_text = final_response.content
     else:
         print("--- chat_agent: LLM answered directly. ---")
         chat_response_text = response.content
 
-    print(f"--- chat_agent: Final response:\n{chat_response_text} ---")
-    chat_message = await sync_to_async(ChatMessage.objects.create)(
-        trip=trip, question=user_question, response=convert_markdown_to_html(chat_response_text)
-    )
+    chat_response_html = await save_chat_reply(trip, state['user_question'], chat_response_text)
+    schedule_chat_summary(trip.id)
     print("--- chat_agent: END ---")
-    return {"chat_response": convert_markdown_to_html(chat_response_text)}
+    return {"chat_response": chat_response_html}
+
+async def _stream_markdown(chunks, buffer, parts):
+    """Yields rendered HTML for each markdown block completed by the streamed chunks."""
+    async for chunk in chunks:
+        text = message_text(chunk)
+        parts.append(text)
+        block = buffer.feed(text)
+        if block:
+            yield await run_blocking(convert_markdown_to_html, block)
+
+async def stream_chat_agent(state):
+    """
+    Streaming variant of chat_agent for the chat view.
+
+    Yields ``("delta", html)`` for each markdown block as soon as the model has
+    written it, then ``("done", html)`` with the whole answer, which is stored
+    as a ChatMessage exactly like chat_agent does.
+    """
+    print("--- stream_chat_agent: START ---")
+    trip = await load_trip_snapshot(state)
+    messages = await build_chat_messages(trip, state)
+    buffer = MarkdownBlockBuffer()
+    parts = []
+
+    # Streaming the tool-enabled call means a direct answer starts arriving
+    # immediately; tool calls only show up once the chunks are merged.
+    response = None
+
+    async def first_round():
+        nonlocal response
+        async for chunk in astream_llm(messages, model=llm_with_tools, site="gemini:chat_stream"):
+            response = chunk if response is None else response + chunk
+            yield chunk
+
+    async for html in _stream_markdown(first_round(), buffer, parts):
+        yield "delta", html
+
+    if response is not None and response.tool_calls:
+        tool_outputs = await run_chat_tools(response.tool_calls, trip)
+        messages.append(response)
+        messages.append(AIMessage(content=str(tool_outputs)))
+        print("--- stream_chat_agent: Streaming LLM answer with tool results... ---")
+        async for html in _stream_markdown(astream_llm(messages, site="gemini:chat_stream"), buffer, parts):
+            yield "delta", html
+
+    rest = buffer.flush()
+    if rest:
+        yield "delta", await run_blocking(convert_markdown_to_html, rest)
+    chat_response_html = await save_chat_reply(trip, state['user_question'], "".join(parts))
+    schedule_chat_summary(trip.id)
+    yield "done", chat_response_html
+    print("--- stream_chat_agent: END ---")
 
 async def accommodation_recommender_agent(state):
     print("--- accommodation_recommender_agent: START ---")
     start_time = time.time()
-    trip = await sync_to_async(Trip.objects.get)(id=state['trip_id'])
+    trip = await load_trip_snapshot(state)
     query = f"Best hostels and stays in {trip.destination} for {trip.month} with {trip.budget_type} budget, including ratings and booking links"
     try:
         search_start_time = time.time()
-        search_results = await sync_to_async(search.results)(query)
+        search_results = await serper_search(query, site="serper:accommodation_recommender")
         search_end_time = time.time()
         print(f"--- accommodation_recommender_agent: Search call took {search_end_time - search_start_time:.2f} seconds ---")
         organic_results = search_results.get("organic", [])
@@ -658,11 +1096,10 @@ async def accommodation_recommender_agent(state):
                 image_url=result.get("thumbnail", ""), video_url=""
             ))
         
-        trip.accommodation_info = [acc.dict() for acc in accommodations]
-        await sync_to_async(trip.save)()
+        accommodation_info = [acc.dict() for acc in accommodations]
         end_time = time.time()
         print(f"--- accommodation_recommender_agent: END ({end_time - start_time:.2f} seconds) ---")
-        return {"accommodation_info": trip.accommodation_info}
+        return {"accommodation_info": accommodation_info}
     except Exception as e:
         end_time = time.time()
         print(f"--- accommodation_recommender_agent: ERROR ({end_time - start_time:.2f} seconds) - {e} ---")
@@ -671,7 +1108,7 @@ async def accommodation_recommender_agent(state):
 async def expense_breakdown_agent(state):
     print("--- expense_breakdown_agent: START ---")
     start_time = time.time()
-    trip = await sync_to_async(Trip.objects.get)(id=state['trip_id'])
+    trip = await load_trip_snapshot(state)
     prompt = f"""
     Based on the following trip details, provide a general expense breakdown.
     Assume average costs for {trip.destination} in {trip.month} for a {trip.budget_type} budget.
@@ -688,7 +1125,7 @@ async def expense_breakdown_agent(state):
     """
     try:
         llm_start_time = time.time()
-        result = await sync_to_async(llm.invoke)([HumanMessage(content=prompt)])
+        result = await ainvoke_llm([HumanMessage(content=prompt)], site="gemini:expense_breakdown")
         llm_end_time = time.time()
         print(f"--- expense_breakdown_agent: LLM call took {llm_end_time - llm_start_time:.2f} seconds ---")
 
@@ -702,21 +1139,17 @@ async def expense_breakdown_agent(state):
         else:
             result_content = result.content
 
-        trip.expense_breakdown = convert_markdown_to_html(result_content.strip())
-        await sync_to_async(trip.save)()
+        expense_breakdown = await run_blocking(convert_markdown_to_html, result_content.strip())
         end_time = time.time()
         print(f"--- expense_breakdown_agent: END ({end_time - start_time:.2f} seconds) ---")
-        return {"expense_breakdown": trip.expense_breakdown}
+        return {"expense_breakdown": expense_breakdown}
     except Exception as e:
         end_time = time.time()
         print(f"--- expense_breakdown_agent: ERROR ({end_time - start_time:.2f} seconds) - {e} ---")
         return {"expense_breakdown": "", "warning": str(e)}
 
-async def complete_trip_plan_agent(state):
-    print("--- complete_trip_plan_agent: START ---")
-    start_time = time.time()
-    trip = await sync_to_async(Trip.objects.get)(id=state['trip_id'])
-    prompt = f"""
+def complete_trip_plan_prompt(trip):
+    return f"""
     Create a day-by-day trip plan based on the following details.
 
     **Trip Details:**
@@ -739,10 +1172,16 @@ async def complete_trip_plan_agent(state):
     - Add local tips and practical advice.
     - For EVERY specific place to visit (like a temple, museum, palace, park, zoo, dam, fort, etc.), you MUST enclose its name in <place> tags. For example: <place>Gwalior Fort</place>, <place>Gwalior Zoo</place>, <place>Tighra Dam</place>. Do NOT tag restaurants, hotels, or general activities as places.
     """
+
+async def complete_trip_plan_agent(state):
+    print("--- complete_trip_plan_agent: START ---")
+    start_time = time.time()
+    trip = await load_trip_snapshot(state)
+    prompt = complete_trip_plan_prompt(trip)
     print(f"--- complete_trip_plan_agent: Starting for trip_id={{trip.id}} ---")
     try:
         llm_start_time = time.time()
-        result = await sync_to_async(llm.invoke)([HumanMessage(content=prompt)])
+        result = await ainvoke_llm([HumanMessage(content=prompt)], site="gemini:complete_trip_plan")
         llm_end_time = time.time()
         print(f"--- complete_trip_plan_agent: LLM call took {llm_end_time - llm_start_time:.2f} seconds ---")
         
@@ -773,12 +1212,50 @@ async def complete_trip_plan_agent(state):
         print(traceback.format_exc())
         return {"complete_trip_plan": "", "warning": str(e)}
 
+async def stream_complete_trip_plan(state):
+    """
+    Streaming variant of complete_trip_plan_agent.
+
+    Yields ``("delta", html)`` per finished markdown block while the plan is
+    written, saves the assembled plan to the trip, then yields ``("done", html)``
+    with the whole plan rendered, or ``("error", message)`` if nothing came back.
+    """
+    print("--- stream_complete_trip_plan: START ---")
+    start_time = time.time()
+    trip = await load_trip_snapshot(state)
+    buffer = MarkdownBlockBuffer()
+    parts = []
+    first_token_at = None
+    async for html in _stream_markdown(astream_llm([HumanMessage(content=complete_trip_plan_prompt(trip))], site="gemini:complete_trip_plan_stream"), buffer, parts):
+        if first_token_at is None:
+            first_token_at = time.time()
+            print(f"--- stream_complete_trip_plan: first block after {first_token_at - start_time:.2f} seconds ---")
+        yield "delta", html
+    rest = buffer.flush()
+    if rest:
+        yield "delta", await run_blocking(convert_markdown_to_html, rest)
+
+    result_content = "".join(parts).strip()
+    if not result_content:
+        yield "error", "LLM returned an empty plan."
+        return
+    await run_blocking(save_trip_fields, trip.id, trip.user_id, complete_trip_plan=result_content)
+    print(f"--- stream_complete_trip_plan: END ({time.time() - start_time:.2f} seconds) ---")
+    yield "done", await run_blocking(convert_markdown_to_html, result_content)
+
 
 async def extract_places_agent(state):
     print("--- extract_places_agent: START ---")
-    trip = await sync_to_async(Trip.objects.get)(id=state['trip_id'])
-    
-    itinerary_json = trip.itinerary
+    trip_id = state['trip_id']
+
+    # Inside the graph the itinerary arrives through state; only standalone
+    # calls need to read it back from the database.
+    if 'itinerary' in state:
+        itinerary_json = state['itinerary']
+        if is_ref(itinerary_json):
+            itinerary_json = await run_blocking(artifact_store.get, itinerary_json)
+    else:
+        itinerary_json = await run_blocking(Trip.objects.values_list('itinerary', flat=True).get, id=trip_id)
     if not itinerary_json:
         print("--- extract_places_agent: No itinerary found in trip. Skipping. ---")
         return {"trip_id": state['trip_id']}
@@ -790,7 +1267,7 @@ async def extract_places_agent(state):
         print(f"--- extract_places_agent: Error parsing or validating itinerary JSON: {e} ---")
         return {"warning": f"Failed to process itinerary data: {e}", "trip_id": state['trip_id']}
 
-    await sync_to_async(Checkpoint.objects.filter(trip=trip).delete)()
+    await run_blocking(Checkpoint.objects.filter(trip_id=trip_id).delete)
 
     for day in validated_itinerary.days:
         activity_order = 1
@@ -799,8 +1276,9 @@ async def extract_places_agent(state):
             if "arrive" in activity.description.lower() or "depart" in activity.description.lower() or "check into" in activity.description.lower():
                 continue
 
-            await sync_to_async(Checkpoint.objects.create)(
-                trip=trip,
+            await run_blocking(
+                Checkpoint.objects.create,
+                trip_id=trip_id,
                 name=activity.location or activity.description[:100],
                 description=activity.description,
                 day_number=day.day_number,
@@ -818,48 +1296,88 @@ async def extract_places_agent(state):
 
 
 # Define the graph
+# The agent nodes of the graph, the trip fields each one produces, and the
+# outputs of other nodes it reads (everything reads the trip preferences).
+# The graph's edges and the node sets repair runs rerun are derived from these.
+AGENT_NODES = {
+    "generate_itinerary": generate_itinerary,
+    "recommend_activities": recommend_activities_agent,
+    "fetch_useful_links": fetch_useful_links_agent,
+    "weather_forecaster": weather_forecaster_agent,
+    "packing_list_generator": packing_list_generator_agent,
+    "food_culture_recommender": food_culture_recommender_agent,
+    "accommodation_recommender": accommodation_recommender_agent,
+    "expense_breakdown_node": expense_breakdown_agent,
+    "generate_complete_trip_plan": complete_trip_plan_agent,
+    "extract_places": extract_places_agent,
+}
+
+NODE_OUTPUTS = {
+    "generate_itinerary": ("itinerary",),
+    "recommend_activities": ("activity_suggestions",),
+    "fetch_useful_links": ("useful_links",),
+    "weather_forecaster": ("weather_forecast",),
+    "packing_list_generator": ("packing_list",),
+    "food_culture_recommender": ("food_culture_info",),
+    "accommodation_recommender": ("accommodation_info",),
+    "expense_breakdown_node": ("expense_breakdown",),
+    "generate_complete_trip_plan": ("complete_trip_plan",),
+    # Writes the trip's map Checkpoint rows rather than a trip field.
+    "extract_places": (),
+}
+
+NODE_INPUTS = {
+    "extract_places": ("itinerary",),
+}
+
+
+def node_dependencies():
+    """Maps every agent node to the nodes whose outputs it reads."""
+    producers = {field: node for node, fields in NODE_OUTPUTS.items() for field in fields}
+    return {
+        node: sorted({producers[field] for field in NODE_INPUTS.get(node, ())})
+        for node in AGENT_NODES
+    }
+
+
+NODE_DEPENDENCIES = node_dependencies()
+
+# Nodes that only read the trip preferences; they all start with the run and should run side by side.
+BRANCH_NODES = [node for node, dependencies in NODE_DEPENDENCIES.items() if not dependencies]
+
+# Nodes no other node waits for; persist_outputs runs once all of them are done.
+SINK_NODES = [node for node in AGENT_NODES if not any(node in dependencies for dependencies in NODE_DEPENDENCIES.values())]
+
+# Predecessors of every node of the compiled graph, for critical path analysis.
+GRAPH_DEPENDENCIES = {**NODE_DEPENDENCIES, "persist_outputs": SINK_NODES}
+
 workflow = StateGraph(GraphState)
-workflow.add_node("generate_itinerary", generate_itinerary)
-workflow.add_node("recommend_activities", recommend_activities_agent)
-workflow.add_node("fetch_useful_links", fetch_useful_links_agent)
-workflow.add_node("weather_forecaster", weather_forecaster_agent)
-workflow.add_node("packing_list_generator", packing_list_generator_agent)
-workflow.add_node("food_culture_recommender", food_culture_recommender_agent)
-workflow.add_node("accommodation_recommender", accommodation_recommender_agent)
-workflow.add_node("expense_breakdown_node", expense_breakdown_agent)
-
-def join_node(state):
-    # This node doesn't need to do anything, it just serves as a join point
-    # for the parallel branches.
-    return {"user_question": ""}
-
-workflow.add_node("join_node", join_node)
-workflow.add_node("generate_complete_trip_plan", complete_trip_plan_agent)
-workflow.add_node("extract_places", extract_places_agent)
-
-
-workflow.set_entry_point("generate_itinerary")
-
-workflow.add_edge("generate_itinerary", "recommend_activities")
-workflow.add_edge("generate_itinerary", "fetch_useful_links")
-workflow.add_edge("generate_itinerary", "weather_forecaster")
-workflow.add_edge("generate_itinerary", "packing_list_generator")
-workflow.add_edge("generate_itinerary", "food_culture_recommender")
-workflow.add_edge("generate_itinerary", "accommodation_recommender")
-
-workflow.add_edge("recommend_activities", "join_node")
-workflow.add_edge("fetch_useful_links", "join_node")
-workflow.add_edge("weather_forecaster", "join_node")
-workflow.add_edge("packing_list_generator", "join_node")
-workflow.add_edge("food_culture_recommender", "join_node")
-workflow.add_edge("accommodation_recommender", "join_node")
-
-workflow.add_edge("join_node", "generate_complete_trip_plan")
-workflow.add_edge("generate_complete_trip_plan", "extract_places")
-workflow.add_edge("extract_places", "expense_breakdown_node")
-workflow.add_edge("expense_breakdown_node", END)
-
-
-from langgraph.checkpoint.memory import MemorySaver
-
-graph = workflow.compile(checkpointer=MemorySaver())
+for node_name, agent in AGENT_NODES.items():
+    workflow.add_node(node_name, timed_node(node_name, tracks_changes(node_name, with_deadline(node_name, agent))))
+workflow.add_node("persist_outputs", timed_node("persist_outputs", persist_outputs))
+
+# A node starts as soon as the nodes it reads from are done, not when some
+# unrelated stage of the pipeline is. A list of sources makes LangGraph wait
+# for all of them before running the target once.
+for node_name, dependencies in NODE_DEPENDENCIES.items():
+    if not dependencies:
+        workflow.add_edge(START, node_name)
+    else:
+        workflow.add_edge(dependencies if len(dependencies) > 1 else dependencies[0], node_name)
+workflow.add_edge(SINK_NODES, "persist_outputs")
+workflow.add_edge("persist_outputs", END)
+
+
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from .checkpointing import DiskCheckpointer
+
+# Types carried in GraphState that the checkpointer may deserialize.
+checkpoint_serde = JsonPlusSerializer(allowed_msgpack_modules=[("planner.langgraph_logic", "TripSnapshot")])
+
+# Snapshots live on disk (settings.PLANNER_CHECKPOINT_DB), one thread per trip.
+checkpointer = DiskCheckpointer(serde=checkpoint_serde)
+
+graph = workflow.compile(checkpointer=checkpointer)
+
+# Every node of a full run, in the order they are declared; used for progress reporting.
+GRAPH_NODES = [name for name in graph.nodes if not name.startswith("__")]
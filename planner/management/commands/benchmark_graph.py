@@ -0,0 +1,163 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+from planner.models import Trip
+from users.models import User
+
+FAKE_ITINERARY = {
+    "days": [
+        {
+            "day_number": 1,
+            "theme": "Benchmark Day",
+            "activities": [
+                {"time": "Morning", "description": "Visit the old town", "location": "Old Town"},
+                {"time": "Evening", "description": "Dinner by the river", "location": "Riverside"},
+            ],
+        }
+    ]
+}
+
+
+def fake_llm_response(messages):
+    prompt = messages[-1].content
+    if "search queries" in prompt:
+        content = json.dumps(["benchmark query one", "benchmark query two", "benchmark query three"])
+    elif "Pydantic schema" in prompt:
+        content = json.dumps(FAKE_ITINERARY)
+    else:
+        content = "- Simulated model output"
+    return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+
+def fake_search_response(query):
+    return {"organic": [{"title": f"Result for {query}", "link": "https://example.com", "snippet": "Simulated snippet"}]}
+
+
+class FakeSerperResponse:
+    def __init__(self, query):
+        self.status = 200
+        self.query = query
+
+    def raise_for_status(self):
+        pass
+
+    async def json(self):
+        return fake_search_response(self.query)
+
+
+class FakeSerperSession:
+    """Stands in for the aiohttp session, so serper_search runs everything but the network round trip."""
+
+    def __init__(self, wait):
+        self.wait = wait
+        self.closed = False
+
+    @contextlib.asynccontextmanager
+    async def post(self, url, params=None, headers=None):
+        await self.wait()
+        yield FakeSerperResponse(params["q"])
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares concurrent graph.ainvoke throughput with thread-hopping provider calls '
+        '(the old sync_to_async path) against the native async provider layer, and reports '
+        'how much the parallel branches overlapped. '
+        'Provider latency is simulated at the Gemini and Serper client boundary and runs '
+        'against a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trips', type=int, default=20, help='Number of concurrent trip generations')
+        parser.add_argument('--llm-latency', type=float, default=0.2, help='Simulated seconds per LLM call')
+        parser.add_argument('--search-latency', type=float, default=0.1, help='Simulated seconds per search call')
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        # Benchmark trips must not reach the real vector index.
+        indexing = override_settings(PLANNER_INDEX_TRIPS_ON_SAVE=False)
+        indexing.enable()
+        try:
+            user = User.objects.create_user(username='benchmark', email='benchmark@example.com', password='benchmark')
+            trip_ids = [
+                Trip.objects.create(
+                    user=user, destination=f'Benchmark City {n}', month='May', duration=3, num_people='2',
+                    holiday_type='cultural', budget_type='medium',
+                ).id
+                # Distinct destinations, so the shared search and artifact caches cannot serve one run from another.
+                for n in range(options['trips'])
+            ]
+
+            results = {}
+            for mode in ('threaded', 'async'):
+                # The agents log every step to stdout; keep the report readable.
+                with contextlib.redirect_stdout(io.StringIO()):
+                    elapsed, runs = async_to_sync(self.run_mode)(mode, trip_ids, options['llm_latency'], options['search_latency'])
+                results[mode] = elapsed
+                parallelism = [run["branch_overlap"].get("parallelism", 0) for run in runs if run.get("branch_overlap")]
+                mean_parallelism = sum(parallelism) / len(parallelism) if parallelism else 0
+                self.stdout.write(
+                    f"{mode:>8}: {len(trip_ids)} runs in {elapsed:.2f}s "
+                    f"({len(trip_ids) / elapsed:.2f} runs/s, mean branch parallelism {mean_parallelism:.2f})"
+                )
+            self.stdout.write(self.style.SUCCESS(f"Speedup: {results['threaded'] / results['async']:.1f}x"))
+        finally:
+            indexing.disable()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    async def run_mode(self, mode, trip_ids, llm_latency, search_latency):
+        """
+        Runs the graph for every trip with the providers faked at their client
+        boundary: Gemini below the LangChain model (its SDK request) and Serper
+        below the aiohttp session, so retries, rate limiting, circuit breakers
+        and caching all run as in production.
+        """
+        from planner import langgraph_logic, providers
+
+        def blocking_generate(model, messages, stop=None, run_manager=None, **kwargs):
+            time.sleep(llm_latency)
+            return fake_llm_response(messages)
+
+        if mode == 'threaded':
+            # LangChain's default async path: the blocking SDK call on a worker thread.
+            agenerate = BaseChatModel._agenerate
+            search_wait = sync_to_async(time.sleep, thread_sensitive=False)
+        else:
+            async def agenerate(model, messages, stop=None, run_manager=None, **kwargs):
+                await asyncio.sleep(llm_latency)
+                return fake_llm_response(messages)
+
+            search_wait = asyncio.sleep
+        session = FakeSerperSession(lambda: search_wait(search_latency))
+
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(
+                    PLANNER_CACHE_DB=os.path.join(directory, 'cache.sqlite3'),
+                    PLANNER_CHECKPOINT_DB=os.path.join(directory, 'checkpoints.sqlite3'),
+                    PLANNER_RATE_LIMITS={},
+                ), \
+                mock.patch.object(ChatGoogleGenerativeAI, '_generate', blocking_generate), \
+                mock.patch.object(ChatGoogleGenerativeAI, '_agenerate', agenerate), \
+                mock.patch.object(providers, '_get_serper_session', lambda: session):
+            start_time = time.time()
+            runs = await asyncio.gather(*(
+                langgraph_logic.generate_complete_trip_automatically({"trip_id": trip_id})
+                for trip_id in trip_ids
+            ))
+            return time.time() - start_time, runs
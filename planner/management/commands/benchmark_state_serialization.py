@@ -0,0 +1,169 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from langchain_core.messages import AIMessage
+
+from planner.checkpointing import DiskCheckpointer
+from planner.models import Trip
+from users.models import User
+
+ACTIVITIES_PER_DAY = 5
+
+
+class MeasuringCheckpointer(DiskCheckpointer):
+    """Records the serialized size and serialization time of every snapshot and pending write."""
+
+    def __init__(self, path, *, serde=None):
+        super().__init__(path, serde=serde)
+        self.checkpoints = []
+        self.writes = []
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        start = time.perf_counter()
+        _, data = self.serde.dumps_typed(checkpoint)
+        self.checkpoints.append((metadata.get("step"), len(data), time.perf_counter() - start))
+        return super().put(config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        start = time.perf_counter()
+        size = sum(len(self.serde.dumps_typed(value)[1]) for _, value in writes)
+        self.writes.append((size, time.perf_counter() - start))
+        return super().put_writes(config, writes, task_id, task_path)
+
+
+def fake_itinerary(days):
+    return {
+        "days": [
+            {
+                "day_number": day,
+                "theme": f"Day {day} highlights",
+                "activities": [
+                    {
+                        "time": time_of_day,
+                        "description": f"Explore landmark {day}.{index} with a local guide and time for photos",
+                        "location": f"Landmark {day}.{index}",
+                        "latitude": 38.7 + index / 100,
+                        "longitude": -9.1 - index / 100,
+                    }
+                    for index, time_of_day in enumerate(["Morning", "Late morning", "Afternoon", "Evening", "Night"][:ACTIVITIES_PER_DAY])
+                ],
+            }
+            for day in range(1, days + 1)
+        ]
+    }
+
+
+def fake_markdown(kilobytes):
+    paragraph = "- **Tip:** Book popular sights ahead and carry water; afternoons are busy in high season.\n"
+    return paragraph * max(1, kilobytes * 1024 // len(paragraph))
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs the generation graph with realistic output sizes and reports the bytes and time spent '
+        'serializing each checkpoint, with agent outputs kept inline in state versus passed as '
+        'artifact references. Uses simulated providers and a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='Trip length; the itinerary grows with it')
+        parser.add_argument('--output-kb', type=int, default=6, help='Size of each simulated LLM text output')
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            user = User.objects.create_user(username='benchmark', email='benchmark@example.com', password='benchmark')
+            trip = Trip.objects.create(
+                user=user, destination='Lisbon', month='May', duration=options['days'], num_people='2',
+                holiday_type='cultural', budget_type='medium',
+            )
+
+            reports = {}
+            for mode, inline_bytes in (('inline', 10 ** 12), ('refs', None)):
+                with tempfile.TemporaryDirectory() as directory:
+                    reports[mode] = self.run_mode(trip.id, os.path.join(directory, 'checkpoints.sqlite3'), inline_bytes, options)
+
+            self.stdout.write(f"{'step':>4}  {'inline bytes':>12} {'ms':>7}  {'refs bytes':>12} {'ms':>7}")
+            for (step, inline_size, inline_time), (_, refs_size, refs_time) in zip(reports['inline']['checkpoints'], reports['refs']['checkpoints']):
+                self.stdout.write(f"{step:>4}  {inline_size:>12,} {inline_time * 1000:>7.2f}  {refs_size:>12,} {refs_time * 1000:>7.2f}")
+
+            for mode, report in reports.items():
+                sizes = [size for _, size, _ in report['checkpoints']]
+                self.stdout.write(
+                    f"{mode:>6}: {len(sizes)} snapshots, {sum(sizes):,} bytes (max {max(sizes):,}), "
+                    f"{sum(seconds for _, _, seconds in report['checkpoints']) * 1000:.2f} ms serializing; "
+                    f"writes {sum(size for size, _ in report['writes']):,} bytes; "
+                    f"latest snapshot loads in {report['load_seconds'] * 1000:.2f} ms; "
+                    f"artifact store {report['artifact_bytes']:,} bytes"
+                )
+            inline_total = sum(size for _, size, _ in reports['inline']['checkpoints'])
+            refs_total = sum(size for _, size, _ in reports['refs']['checkpoints'])
+            self.stdout.write(self.style.SUCCESS(f"Snapshot bytes reduced {inline_total / refs_total:.1f}x with artifact references"))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run_mode(self, trip_id, checkpoint_path, inline_bytes, options):
+        from planner import langgraph_logic
+        from planner.artifacts import ArtifactStore
+
+        itinerary = json.dumps(fake_itinerary(options['days']))
+        text = fake_markdown(options['output_kb'])
+
+        async def fake_llm(messages, model=None, **kwargs):
+            prompt = messages[-1].content
+            if "search queries" in prompt:
+                return AIMessage(content=json.dumps(["query one", "query two", "query three"]))
+            if "Pydantic schema" in prompt:
+                return AIMessage(content=itinerary)
+            return AIMessage(content=text)
+
+        async def fake_cached_llm_text(agent_name, template, refresh=False, **params):
+            return text
+
+        async def fake_search(query, **kwargs):
+            return {"organic": [
+                {"title": f"{query} result {index}", "link": f"https://example.com/{index}",
+                 "snippet": "A simulated search snippet describing the place in a sentence or two.",
+                 "thumbnail": f"https://example.com/{index}.jpg"}
+                for index in range(10)
+            ]}
+
+        saver = MeasuringCheckpointer(checkpoint_path, serde=langgraph_logic.checkpoint_serde)
+        graph = langgraph_logic.workflow.compile(checkpointer=saver)
+        settings_override = {'PLANNER_CHECKPOINT_DB': checkpoint_path}
+        if inline_bytes is not None:
+            settings_override['PLANNER_ARTIFACT_INLINE_BYTES'] = inline_bytes
+
+        with override_settings(**settings_override), \
+                mock.patch.object(langgraph_logic, 'graph', graph), \
+                mock.patch.object(langgraph_logic, 'checkpointer', saver), \
+                mock.patch.object(langgraph_logic, 'ainvoke_llm', fake_llm), \
+                mock.patch.object(langgraph_logic, 'cached_llm_text', fake_cached_llm_text), \
+                mock.patch.object(langgraph_logic, 'serper_search', fake_search), \
+                contextlib.redirect_stdout(io.StringIO()):
+            result = async_to_sync(langgraph_logic.generate_complete_trip_automatically)({"trip_id": trip_id})
+            if not result.get("complete_generation"):
+                raise RuntimeError(result.get("warning"))
+
+            start = time.perf_counter()
+            saver.get_tuple({"configurable": {"thread_id": str(trip_id), "checkpoint_ns": ""}})
+            load_seconds = time.perf_counter() - start
+            artifact_bytes = ArtifactStore(checkpoint_path).stats()["bytes"]
+
+        saver.conn.close()
+        return {
+            'checkpoints': saver.checkpoints,
+            'writes': saver.writes,
+            'load_seconds': load_seconds,
+            'artifact_bytes': artifact_bytes,
+        }
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from planner.caching import SQLiteCache, namespaces
+
+
+class Command(BaseCommand):
+    help = 'Shows hit/miss counters of the shared planner caches, optionally clearing a namespace.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', metavar='NAMESPACE', help='Remove every entry and counter of the given namespace')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            SQLiteCache(options['clear'], ttl=0, max_entries=0).clear()
+            self.stdout.write(self.style.SUCCESS(f"Cleared cache namespace '{options['clear']}'."))
+            return
+
+        names = namespaces()
+        if not names:
+            self.stdout.write('No cache activity recorded yet.')
+            return
+        for name in names:
+            stats = SQLiteCache(name, ttl=0, max_entries=0).stats()
+            self.stdout.write(
+                f"{name}: {stats['entries']} entries, {stats['hits']} hits, {stats['misses']} misses, "
+                f"{stats['evictions']} evictions, hit rate {stats['hit_rate']:.1%}"
+            )
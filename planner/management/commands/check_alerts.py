@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
+from planner.breakers import CircuitOpenError, newsdata_breaker
 from planner.models import Trip
 from planner.views import get_current_weather # Reusing existing weather function
 from django.core.mail import send_mail
@@ -13,6 +14,11 @@ from datetime import timedelta
 NEWS_API_KEY = os.getenv('NEWSDATA_API_KEY')
 NEWS_API_URL = "https://newsdata.io/api/1/news"
 
+def get_news(params):
+    response = requests.get(NEWS_API_URL, params=params, timeout=10)
+    response.raise_for_status() # Raise an exception for HTTP errors
+    return response.json()
+
 def fetch_news_alerts(destination):
     if not NEWS_API_KEY:
         return []
@@ -26,9 +32,8 @@ def fetch_news_alerts(destination):
             'category': 'travel', # Filter by category
             'timeframe': 24, # News from the last 24 hours
         }
-        response = requests.get(NEWS_API_URL, params=params, timeout=10)
-        response.raise_for_status() # Raise an exception for HTTP errors
-        data = response.json()
+        # Fails fast while NewsData.io is down instead of waiting out the timeout for every trip.
+        data = newsdata_breaker.call(get_news, params)
         
         alerts = []
         for article in data.get('results', [])[:3]: # Get top 3 articles
@@ -38,7 +43,7 @@ def fetch_news_alerts(destination):
             if any(keyword in title or keyword in description for keyword in ['warning', 'alert', 'disruption', 'strike', 'advisory', 'emergency']):
                 alerts.append(f"News Alert: {article.get('title')} - {article.get('link')}")
         return alerts
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, CircuitOpenError) as e:
         print(f"Error fetching news from NewsData.io: {e}")
         return []
 
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from planner.breakers import CircuitBreaker, breaker_states
+
+
+class Command(BaseCommand):
+    help = 'Shows the circuit breaker of every external provider (shared by all worker processes), optionally resetting one.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', metavar='PROVIDER', help='Close the given provider\'s breaker and clear its counters')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            CircuitBreaker(options['reset']).reset()
+            self.stdout.write(self.style.SUCCESS(f"Reset the {options['reset']} circuit breaker."))
+            return
+
+        states = breaker_states()
+        if not states:
+            self.stdout.write('No provider calls recorded yet.')
+            return
+        now = time.time()
+        for row in states:
+            line = (
+                f"{row['provider']}: {row['state']}, {row['consecutive_failures']} consecutive failures, "
+                f"{row['successes']} ok / {row['failures']} failed / {row['rejected']} rejected"
+            )
+            if row['opened_at']:
+                line += f", open for {now - row['opened_at']:.0f}s"
+            if row['last_error']:
+                line += f"; last error: {row['last_error']}"
+            style = self.style.SUCCESS if row['state'] == 'closed' else self.style.WARNING
+            self.stdout.write(style(line))
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from planner.artifacts import artifact_store
+from planner.langgraph_logic import checkpointer
+
+
+class Command(BaseCommand):
+    help = 'Applies the checkpoint retention policy to the LangGraph snapshot database (snapshots and the artifacts they reference) and reclaims the freed space.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=settings.PLANNER_CHECKPOINT_MAX_AGE, help='Drop snapshots older than this many seconds (0 keeps all)')
+        parser.add_argument('--max-per-thread', type=int, default=settings.PLANNER_CHECKPOINT_MAX_PER_THREAD, help='Keep at most this many snapshots per trip (0 keeps all)')
+        parser.add_argument('--no-vacuum', action='store_true', help='Skip VACUUM after pruning')
+
+    def handle(self, *args, **options):
+        before = {**checkpointer.stats(), 'artifacts': artifact_store.stats()['artifacts']}
+        removed = checkpointer.prune(max_age=options['max_age'], max_per_thread=options['max_per_thread'])
+        removed_artifacts = artifact_store.prune(options['max_age']) if options['max_age'] else 0
+        removed_artifacts += artifact_store.prune_unreferenced(settings.PLANNER_ARTIFACT_ORPHAN_GRACE)
+        if not options['no_vacuum']:
+            checkpointer.vacuum()
+        after = {**checkpointer.stats(), 'artifacts': artifact_store.stats()['artifacts']}
+
+        self.stdout.write(f"Checkpoint database: {checkpointer.path}")
+        for label, stats in (("Before", before), ("After", after)):
+            self.stdout.write(
+                f"{label:<8} {stats['threads']:>6} threads  {stats['checkpoints']:>8} snapshots  "
+                f"{stats['writes']:>8} writes  {stats['artifacts']:>8} artifacts  {stats['bytes'] / 1024:>10.1f} KiB"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} snapshot(s) and {removed_artifacts} artifact(s)."))
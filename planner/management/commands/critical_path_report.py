@@ -0,0 +1,58 @@
+import statistics
+from collections import Counter, defaultdict
+
+from django.core.management.base import BaseCommand
+
+from planner.models import GraphRunProfile
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Summarises recorded generation runs: wall-clock time, per-node durations and how often '
+        'each node sits on the critical path, i.e. which nodes are worth making faster.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--last', type=int, default=200, help='Number of most recent runs to include')
+        parser.add_argument('--mode', choices=[mode for mode, _ in GraphRunProfile.MODE_CHOICES], default=GraphRunProfile.FULL)
+        parser.add_argument('--include-failed', action='store_true', help='Also include runs that did not finish')
+
+    def handle(self, *args, **options):
+        profiles = GraphRunProfile.objects.filter(mode=options['mode'])
+        if not options['include_failed']:
+            profiles = profiles.filter(succeeded=True)
+        profiles = list(profiles[:options['last']])
+        if not profiles:
+            self.stdout.write('No generation runs recorded yet.')
+            return
+
+        wall_clocks = [profile.wall_clock for profile in profiles]
+        self.stdout.write(
+            f"{len(profiles)} {options['mode']} runs: wall clock mean {statistics.mean(wall_clocks):.2f}s, "
+            f"p50 {percentile(wall_clocks, 0.5):.2f}s, p95 {percentile(wall_clocks, 0.95):.2f}s"
+        )
+
+        durations = defaultdict(list)
+        on_path = Counter()
+        paths = Counter()
+        for profile in profiles:
+            for node, timing in profile.node_timings.items():
+                durations[node].append(timing['duration'])
+            on_path.update(profile.critical_path)
+            paths[' -> '.join(profile.critical_path)] += 1
+
+        self.stdout.write(f"\n{'node':<30} {'runs':>5} {'mean s':>8} {'p95 s':>8} {'critical':>9}")
+        for node, values in sorted(durations.items(), key=lambda item: -on_path[item[0]]):
+            self.stdout.write(
+                f"{node:<30} {len(values):>5} {statistics.mean(values):>8.2f} {percentile(values, 0.95):>8.2f} "
+                f"{on_path[node] / len(profiles):>9.0%}"
+            )
+
+        self.stdout.write('\nMost common critical paths:')
+        for path, count in paths.most_common(5):
+            self.stdout.write(f"{count / len(profiles):>5.0%}  {path}")
@@ -2,9 +2,11 @@ from django.core.management.base import BaseCommand
 from planner.rag_logic import index_trips
 
 class Command(BaseCommand):
-    help = 'Indexes all trip plans into the vector store.'
+    help = 'Brings the vector store in line with the trips: embeds new and changed trips, drops deleted ones.'
 
     def handle(self, *args, **options):
         self.stdout.write('Starting to index trip plans...')
-        index_trips()
-        self.stdout.write(self.style.SUCCESS('Successfully indexed all trip plans.'))
+        counts = index_trips()
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {counts['trips']} trips ({counts['embedded']} embedded, {counts['removed']} removed)."
+        ))
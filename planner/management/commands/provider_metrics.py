@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+
+from planner.ratelimit import bucket_stats, reset_bucket_stats
+from planner.resilience import call_site_stats, reset_call_site_stats
+
+
+def seconds(value):
+    return f"{value:.2f}" if value is not None else '-'
+
+
+class Command(BaseCommand):
+    help = (
+        'Shows attempt counts, retries, hedging and tail latency of every provider call site, '
+        'and how calls queued under the provider rate limits, across all worker processes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Clear the recorded metrics')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            reset_call_site_stats()
+            reset_bucket_stats()
+            self.stdout.write(self.style.SUCCESS('Cleared provider call metrics.'))
+            return
+
+        stats = call_site_stats()
+        if not stats:
+            self.stdout.write('No provider calls recorded yet.')
+            return
+        self.stdout.write(
+            f"{'call site':<36} {'calls':>6} {'att/call':>8} {'failed':>6} {'hedged':>6} {'won':>4} "
+            f"{'no budget':>9} {'p50 s':>6} {'p95 s':>6} {'p99 s':>6}"
+        )
+        for row in stats:
+            self.stdout.write(
+                f"{row['site']:<36} {row['calls']:>6} {row['attempts_per_call']:>8.2f} {row['failures']:>6} "
+                f"{row['hedges']:>6} {row['hedge_wins']:>4} {row['budget_exhausted']:>9} "
+                f"{seconds(row['p50']):>6} {seconds(row['p95']):>6} {seconds(row['p99']):>6}"
+            )
+
+        buckets = bucket_stats()
+        if buckets:
+            self.stdout.write('')
+            self.stdout.write(
+                f"{'rate limit':<36} {'per s':>7} {'burst':>6} {'tokens':>7} {'granted':>8} {'queued':>7} {'avg wait':>8} {'rejected':>8}"
+            )
+            for row in buckets:
+                limit = f"{row['limit_per_second']:.2f}" if row['limit_per_second'] else '-'
+                burst = f"{row['burst']:.0f}" if row['burst'] else '-'
+                tokens = f"{row['tokens']:.2f}" if row['tokens'] is not None else '-'
+                self.stdout.write(
+                    f"{row['bucket']:<36} {limit:>7} {burst:>6} {tokens:>7} {row['granted']:>8} {row['queued']:>7} "
+                    f"{seconds(row['average_wait']):>8} {row['rejected']:>8}"
+                )
@@ -0,0 +1,44 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from planner.concurrency import run_blocking
+from planner.jobs import claim_job, new_worker_id, reap_expired_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = 'Processes queued trip generation jobs. Start several processes to scale generation throughput.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help='Jobs run at the same time by this process')
+        parser.add_argument('--lease-seconds', type=int, default=settings.PLANNER_JOB_LEASE_SECONDS, help='Lease length; renewed while a job runs')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds between polls of an empty queue')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run_worker(options['concurrency'], options['lease_seconds'], options['poll_interval'], options['burst']))
+
+    async def run_worker(self, concurrency, lease_seconds, poll_interval, burst):
+        worker_id = new_worker_id()
+        self.stdout.write(f"Generation worker {worker_id} started (concurrency {concurrency}).")
+        running = set()
+        while True:
+            reaped = await run_blocking(reap_expired_jobs)
+            if reaped:
+                self.stdout.write(f"Marked {reaped} abandoned job(s) as failed.")
+
+            while len(running) < concurrency:
+                job = await run_blocking(claim_job, worker_id, lease_seconds)
+                if job is None:
+                    break
+                running.add(asyncio.create_task(run_job(job, worker_id, lease_seconds)))
+
+            if not running:
+                if burst:
+                    break
+                await asyncio.sleep(poll_interval)
+                continue
+            _, running = await asyncio.wait(running, timeout=poll_interval, return_when=asyncio.FIRST_COMPLETED)
+
+        self.stdout.write(self.style.SUCCESS("Queue drained, worker exiting."))
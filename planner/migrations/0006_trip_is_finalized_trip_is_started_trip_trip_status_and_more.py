@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0005_alter_trip_activity_suggestions_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='is_finalized',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='is_started',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='trip_status',
+            field=models.CharField(default='draft', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='Checkpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('description', models.TextField()),
+                ('completed', models.BooleanField(default=False)),
+                ('time', models.TimeField(blank=True, help_text='Activity time (e.g., 09:00)', null=True)),
+                ('location', models.CharField(blank=True, help_text='Specific location for this activity', max_length=255, null=True)),
+                ('tips', models.TextField(blank=True, help_text='Tips and advice for this activity', null=True)),
+                ('day_number', models.PositiveIntegerField(default=1, help_text='Day of the trip (1, 2, 3, etc.)')),
+                ('order_in_day', models.PositiveIntegerField(default=1, help_text='Order of activity within the day')),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='planner.trip')),
+            ],
+            options={
+                'ordering': ['day_number', 'order_in_day', 'time'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Feedback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rating', models.IntegerField(choices=[(1, 'Like'), (2, 'Dislike')], default=1)),
+                ('feedback', models.TextField()),
+                ('checkpoint', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='planner.checkpoint')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
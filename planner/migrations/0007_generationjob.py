@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:14
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0006_trip_is_finalized_trip_is_started_trip_trip_status_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(default='complete_trip', max_length=50)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], db_index=True, default='queued', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=3)),
+                ('progress', models.PositiveIntegerField(default=0, help_text='Completion percentage of the current attempt')),
+                ('progress_message', models.CharField(blank=True, max_length=255)),
+                ('error', models.TextField(blank=True)),
+                ('leased_by', models.CharField(blank=True, max_length=255)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='generation_jobs', to='planner.trip')),
+            ],
+            options={
+                'ordering': ['created_at'],
+            },
+        ),
+    ]
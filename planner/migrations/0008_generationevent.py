@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0007_generationjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(max_length=50)),
+                ('node', models.CharField(blank=True, max_length=100)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='planner.generationjob')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0008_generationevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='generation_warnings',
+            field=models.JSONField(blank=True, default=dict, help_text='Warnings of the last generation, by graph node; repair runs rerun these nodes'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0009_trip_generation_warnings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GraphRunProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mode', models.CharField(choices=[('full', 'Full'), ('resume', 'Resume'), ('repair', 'Repair')], default='full', max_length=10)),
+                ('succeeded', models.BooleanField(default=True)),
+                ('wall_clock', models.FloatField(help_text='Seconds from the first node starting to the last one finishing')),
+                ('node_timings', models.JSONField(blank=True, default=dict)),
+                ('critical_path', models.JSONField(blank=True, default=list)),
+                ('critical_path_seconds', models.FloatField(default=0.0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='run_profiles', to='planner.trip')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0011_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='chat_summary',
+            field=models.TextField(blank=True, default='', help_text='Rolling summary of the chat turns older than the recent window'),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='chat_summary_through',
+            field=models.PositiveIntegerField(default=0, help_text='Id of the last ChatMessage folded into chat_summary'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:52
+
+import html
+
+from django.db import migrations, models
+from django.utils.html import strip_tags
+
+
+def backfill_response_markdown(apps, schema_editor):
+    # The model text of existing answers was not kept; their HTML with the
+    # markup stripped is the closest compact stand-in.
+    ChatMessage = apps.get_model('planner', 'ChatMessage')
+    for message in ChatMessage.objects.filter(response_markdown='').only('id', 'response').iterator():
+        message.response_markdown = html.unescape(strip_tags(message.response)).strip()
+        message.save(update_fields=['response_markdown'])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0012_trip_chat_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='response_markdown',
+            field=models.TextField(blank=True, default='', help_text='The answer as the model wrote it, replayed as chat history'),
+        ),
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='response',
+            field=models.TextField(help_text='Rendered HTML of the answer, served to the page'),
+        ),
+        migrations.RunPython(backfill_response_markdown, migrations.RunPython.noop),
+    ]
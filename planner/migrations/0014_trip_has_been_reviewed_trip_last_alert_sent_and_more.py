@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0013_chatmessage_response_markdown'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='checkpoint',
+            name='feedback_submitted',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='checkpoint',
+            name='image_url',
+            field=models.URLField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='checkpoint',
+            name='video_url',
+            field=models.URLField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='has_been_reviewed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='last_alert_sent',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
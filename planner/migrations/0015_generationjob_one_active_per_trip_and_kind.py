@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0014_trip_has_been_reviewed_trip_last_alert_sent_and_more'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='generationjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('trip', 'kind'), name='one_active_generation_job_per_trip_and_kind'),
+        ),
+    ]
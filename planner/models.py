@@ -1,6 +1,7 @@
 from django.db import models
 from users.models import User
 from datetime import datetime, timedelta
+from django.utils import timezone
 
 class Trip(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -20,11 +21,14 @@ class Trip(models.Model):
     accommodation_info = models.JSONField(blank=True, null=True)
     expense_breakdown = models.TextField(blank=True, null=True)
     complete_trip_plan = models.TextField(blank=True, null=True)
+    generation_warnings = models.JSONField(default=dict, blank=True, help_text="Warnings of the last generation, by graph node; repair runs rerun these nodes")
     is_finalized = models.BooleanField(default=False)
     trip_status = models.CharField(max_length=20, default='draft')
     is_started = models.BooleanField(default=False)
     has_been_reviewed = models.BooleanField(default=False)
     last_alert_sent = models.DateTimeField(null=True, blank=True)
+    chat_summary = models.TextField(blank=True, default='', help_text="Rolling summary of the chat turns older than the recent window")
+    chat_summary_through = models.PositiveIntegerField(default=0, help_text="Id of the last ChatMessage folded into chat_summary")
     
     def __str__(self):
         return f"Trip to {self.destination} for {self.user.username}"
@@ -32,7 +36,8 @@ class Trip(models.Model):
 class ChatMessage(models.Model):
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE)
     question = models.TextField()
-    response = models.TextField()
+    response = models.TextField(help_text="Rendered HTML of the answer, served to the page")
+    response_markdown = models.TextField(blank=True, default='', help_text="The answer as the model wrote it, replayed as chat history")
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -73,4 +78,104 @@ class Feedback(models.Model):
     feedback = models.TextField()
 
     def __str__(self):
-        return f"Feedback for {self.checkpoint.name} by {self.user.username}"
\ No newline at end of file
+        return f"Feedback for {self.checkpoint.name} by {self.user.username}"
+
+class GenerationJob(models.Model):
+    """A queued run of the trip generation graph, picked up by run_generation_worker."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    )
+
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='generation_jobs')
+    kind = models.CharField(max_length=50, default='complete_trip')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    progress = models.PositiveIntegerField(default=0, help_text="Completion percentage of the current attempt")
+    progress_message = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    leased_by = models.CharField(max_length=255, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        constraints = [
+            # At most one queued or running job of each kind per trip, however many requests enqueue at once.
+            models.UniqueConstraint(
+                fields=['trip', 'kind'], condition=models.Q(status__in=['queued', 'running']),
+                name='one_active_generation_job_per_trip_and_kind',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} job for trip {self.trip_id} ({self.status})"
+
+
+class GenerationEvent(models.Model):
+    """A node-level event published by a worker while it runs a GenerationJob, streamed to the trip page."""
+    job = models.ForeignKey(GenerationJob, on_delete=models.CASCADE, related_name='events')
+    event = models.CharField(max_length=50)
+    node = models.CharField(max_length=100, blank=True)
+    payload = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.event} {self.node} (job {self.job_id})"
+
+
+class GraphRunProfile(models.Model):
+    """Per-node timings and the critical path of one generation graph run, for `manage.py critical_path_report`."""
+    FULL, RESUME, REPAIR = 'full', 'resume', 'repair'
+    MODE_CHOICES = [(FULL, 'Full'), (RESUME, 'Resume'), (REPAIR, 'Repair')]
+
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='run_profiles')
+    mode = models.CharField(max_length=10, choices=MODE_CHOICES, default=FULL)
+    succeeded = models.BooleanField(default=True)
+    wall_clock = models.FloatField(help_text='Seconds from the first node starting to the last one finishing')
+    node_timings = models.JSONField(default=dict, blank=True)
+    critical_path = models.JSONField(default=list, blank=True)
+    critical_path_seconds = models.FloatField(default=0.0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.mode} run of trip {self.trip_id}: {self.wall_clock:.2f}s"
+
+
+class IdempotencyKey(models.Model):
+    """
+    The response to a POST sent with an idempotency key, replayed when the same
+    request is sent again (double clicks, browser retries). ``status_code`` is
+    unset while the first request is still running.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    endpoint = models.CharField(max_length=100)
+    request_fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveIntegerField(null=True, blank=True)
+    response_headers = models.JSONField(default=dict, blank=True)
+    response_body = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key_per_user')]
+
+    def __str__(self):
+        return f"{self.endpoint} {self.key} ({self.status_code or 'in progress'})"
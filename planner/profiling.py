@@ -0,0 +1,159 @@
+import contextvars
+import functools
+import time
+
+# The timeline of the graph run the current task belongs to. LangGraph runs
+# each node in a task that copies the caller's context, so nodes see the
+# timeline set by generate_complete_trip_automatically().
+current_timeline = contextvars.ContextVar("current_timeline", default=None)
+
+
+class NodeTimeline:
+    """
+    Wall-clock start/end times of every node executed during one graph run.
+
+    An optional async ``listener(event, node_name, **data)`` is awaited when a
+    node starts and finishes, e.g. to publish job progress. ``deadline`` is
+    the epoch time by which the run's nodes have to be done, if any.
+    """
+
+    def __init__(self, listener=None, deadline=None):
+        self.origin = time.time()
+        self.spans = {}
+        self.trip_reads = 0
+        self.listener = listener
+        self.deadline = deadline
+
+    def remaining(self):
+        """Seconds left until the deadline, or None without one."""
+        return None if self.deadline is None else self.deadline - time.time()
+
+    def record(self, node_name, start, end):
+        self.spans[node_name] = (start, end)
+
+    async def emit(self, event, node_name, **data):
+        if self.listener is None:
+            return
+        try:
+            await self.listener(event, node_name, **data)
+        except Exception as e:
+            print(f"--- NodeTimeline: listener failed for {event} {node_name}: {e} ---")
+
+    def node_timings(self):
+        return {
+            name: {
+                "start": round(start - self.origin, 3),
+                "end": round(end - self.origin, 3),
+                "duration": round(end - start, 3),
+            }
+            for name, (start, end) in self.spans.items()
+        }
+
+    def overlap_report(self, node_names):
+        """
+        Summarises how much the given nodes actually overlapped in time.
+
+        ``parallelism`` is the sum of node durations divided by the wall-clock
+        span they covered: ~1.0 means they ran back to back, ~len(node_names)
+        means they ran fully side by side.
+        """
+        spans = {name: self.spans[name] for name in node_names if name in self.spans}
+        if not spans:
+            return {}
+
+        wall_clock = max(end for _, end in spans.values()) - min(start for start, _ in spans.values())
+        total = sum(end - start for start, end in spans.values())
+
+        events = sorted(
+            [(start, 1) for start, _ in spans.values()] + [(end, -1) for _, end in spans.values()],
+            key=lambda event: (event[0], event[1]),
+        )
+        running = max_concurrency = 0
+        for _, delta in events:
+            running += delta
+            max_concurrency = max(max_concurrency, running)
+
+        per_node = {}
+        for name, (start, end) in spans.items():
+            overlapped = 0.0
+            for other, (other_start, other_end) in spans.items():
+                if other != name:
+                    overlapped = max(overlapped, min(end, other_end) - max(start, other_start))
+            per_node[name] = {"duration": round(end - start, 3), "max_overlap": round(max(overlapped, 0.0), 3)}
+
+        return {
+            "wall_clock": round(wall_clock, 3),
+            "sum_of_durations": round(total, 3),
+            "parallelism": round(total / wall_clock, 2) if wall_clock > 0 else float(len(spans)),
+            "max_concurrency": max_concurrency,
+            "nodes": per_node,
+        }
+
+    def wall_clock(self):
+        if not self.spans:
+            return 0.0
+        return round(max(end for _, end in self.spans.values()) - min(start for start, _ in self.spans.values()), 3)
+
+    def critical_path(self, dependencies):
+        """
+        The chain of nodes that determined how long the run took.
+
+        Walks back from the node that finished last, each time through the
+        predecessor (per ``dependencies``, node -> nodes it waits for) that
+        finished latest, since that is the one the node was waiting on.
+        ``gaps`` is the time on the path spent between nodes rather than in
+        them, i.e. scheduling and checkpointing overhead.
+        """
+        if not self.spans:
+            return {"nodes": [], "duration": 0.0, "busy": 0.0, "gaps": 0.0}
+
+        node = max(self.spans, key=lambda name: self.spans[name][1])
+        path = [node]
+        while True:
+            ran = [name for name in dependencies.get(node, ()) if name in self.spans]
+            if not ran:
+                break
+            node = max(ran, key=lambda name: self.spans[name][1])
+            path.append(node)
+        path.reverse()
+
+        duration = self.spans[path[-1]][1] - self.spans[path[0]][0]
+        busy = sum(self.spans[name][1] - self.spans[name][0] for name in path)
+        return {
+            "nodes": path,
+            "duration": round(duration, 3),
+            "busy": round(busy, 3),
+            "gaps": round(max(duration - busy, 0.0), 3),
+        }
+
+
+def dag_depth(dependencies):
+    """Number of nodes on the longest chain of ``dependencies`` (node -> nodes it waits for)."""
+
+    @functools.lru_cache(maxsize=None)
+    def depth(node):
+        return 1 + max((depth(parent) for parent in dependencies.get(node, ())), default=0)
+
+    return max((depth(node) for node in dependencies), default=0)
+
+
+def timed_node(node_name, func):
+    """Wraps an async graph node so its wall-clock span lands on the current timeline."""
+
+    @functools.wraps(func)
+    async def wrapper(state):
+        timeline = current_timeline.get()
+        start = time.time()
+        if timeline is not None:
+            await timeline.emit("node_started", node_name)
+        result = None
+        try:
+            result = await func(state)
+            return result
+        finally:
+            end = time.time()
+            if timeline is not None:
+                timeline.record(node_name, start, end)
+                await timeline.emit("node_finished", node_name, duration=end - start, result=result)
+
+    return wrapper
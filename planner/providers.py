@@ -0,0 +1,231 @@
+import asyncio
+import hashlib
+import os
+import weakref
+
+import aiohttp
+from django.conf import settings
+from langchain_community.utilities import GoogleSerperAPIWrapper
+from langchain_core.messages import HumanMessage
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+from .breakers import serper_breaker
+from .caching import SQLiteCache, make_key, normalize_query
+from .concurrency import run_blocking
+from .ratelimit import acquire
+from .resilience import call_with_retries, hedge_delay
+
+# Shared provider clients. Every agent goes through the async helpers below so
+# a single event loop can keep many trip generations in flight without parking
+# a worker thread on each model or search round trip.
+# Retries happen in resilience.call_with_retries, under a retry budget, so the SDK's own are off.
+llm = ChatGoogleGenerativeAI(model="gemini-2.5-pro", google_api_key=os.getenv("GOOGLE_API_KEY"), max_retries=1)
+
+search = GoogleSerperAPIWrapper(serper_api_key=os.getenv("SERPER_API_KEY"))
+
+SERPER_BASE_URL = "https://google.serper.dev"
+SERPER_TIMEOUT = float(os.getenv("SERPER_TIMEOUT", 15))
+SERPER_MAX_CONNECTIONS = int(os.getenv("SERPER_MAX_CONNECTIONS", 32))
+
+# Thousands of users plan the same cities, so Serper results are cached on
+# disk and shared by every worker on the host.
+search_cache = SQLiteCache(
+    "serper",
+    ttl=settings.PLANNER_SEARCH_CACHE_TTL,
+    max_entries=settings.PLANNER_SEARCH_CACHE_MAX_ENTRIES,
+)
+
+# Outputs of agents that do not depend on anything personal (weather for a
+# destination and month, cultural etiquette, packing lists) are cached per
+# agent, keyed on the prompt template version and the normalised inputs.
+_artifact_caches = {}
+
+
+def artifact_cache(agent_name):
+    cache = _artifact_caches.get(agent_name)
+    if cache is None:
+        cache = _artifact_caches[agent_name] = SQLiteCache(
+            f"artifact:{agent_name}",
+            ttl=settings.PLANNER_ARTIFACT_CACHE_TTL,
+            max_entries=settings.PLANNER_ARTIFACT_CACHE_MAX_ENTRIES,
+        )
+    return cache
+
+# aiohttp sessions are bound to the loop they were created on, and Django runs
+# every async view on its own loop, so keep one keep-alive session per loop.
+_sessions = weakref.WeakKeyDictionary()
+
+
+def _get_serper_session():
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=SERPER_MAX_CONNECTIONS, keepalive_timeout=30)
+        session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=SERPER_TIMEOUT),
+        )
+        _sessions[loop] = session
+    return session
+
+
+async def close_provider_sessions():
+    """Closes the Serper session owned by the running event loop, if any."""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+
+def model_buckets(model):
+    """Rate limit buckets a Gemini call takes a token from: the provider's and the model's."""
+    # Models with tools bound wrap the underlying chat model.
+    name = getattr(getattr(model, "bound", model), "model", llm.model)
+    return "gemini", f"gemini/{name}"
+
+
+async def ainvoke_llm(messages, model=None, site="gemini", hedge=False):
+    """
+    Runs a chat model call natively on the event loop, retrying transient
+    failures. ``site`` names the call site in the provider metrics; ``hedge``
+    races a duplicate request against calls slower than the site's usual p95.
+    Every attempt waits for a slot under the model's rate limit.
+    """
+    model = model or llm
+    hedge_after = None
+    if hedge and settings.PLANNER_HEDGE_AFTER:
+        hedge_after = await run_blocking(hedge_delay, site, settings.PLANNER_HEDGE_AFTER)
+
+    async def invoke():
+        await acquire(*model_buckets(model))
+        return await model.ainvoke(messages)
+
+    return await call_with_retries(site, invoke, hedge_after=hedge_after)
+
+
+async def astream_llm(messages, model=None, site="gemini:stream"):
+    """
+    Streams a chat model call, yielding message chunks as the tokens arrive.
+    Failures before the first chunk are retried like ainvoke_llm; once text
+    has been sent on, they are raised.
+    """
+    model = model or llm
+
+    async def first_chunk():
+        await acquire(*model_buckets(model))
+        stream = model.astream(messages).__aiter__()
+        try:
+            return stream, await stream.__anext__()
+        except StopAsyncIteration:
+            return stream, None
+        except BaseException:
+            await stream.aclose()
+            raise
+
+    stream, chunk = await call_with_retries(site, first_chunk)
+    if chunk is None:
+        return
+    yield chunk
+    async for chunk in stream:
+        yield chunk
+
+
+def message_text(message):
+    """Flattens a model response whose content may be a list of text parts."""
+    if isinstance(message.content, list):
+        return "".join(
+            part["text"] if isinstance(part, dict) else part
+            for part in message.content
+            if isinstance(part, str) or (isinstance(part, dict) and "text" in part)
+        )
+    return message.content
+
+
+def prompt_version(template):
+    """Short hash of a prompt template; editing the template invalidates its cached outputs."""
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:12]
+
+
+async def cached_llm_text(agent_name, template, refresh=False, **params):
+    """
+    Renders ``template`` with ``params`` and returns the model's text, serving
+    it from the agent's artifact cache when the same inputs were seen before.
+    ``refresh`` skips the lookup (but still stores the new answer).
+    """
+    cache = artifact_cache(agent_name)
+    cache_key = make_key(
+        llm.model,
+        prompt_version(template),
+        {name: normalize_query(value) for name, value in params.items()},
+    )
+    if not refresh:
+        try:
+            cached = await run_blocking(cache.get, cache_key)
+            if cached is not None:
+                print(f"--- {agent_name}: artifact cache hit ---")
+                return cached
+        except Exception as e:
+            print(f"--- {agent_name}: artifact cache lookup failed: {e} ---")
+
+    result = await ainvoke_llm([HumanMessage(content=template.format(**params))], site=f"gemini:{agent_name}")
+    text = message_text(result).strip()
+    if text:
+        try:
+            await run_blocking(cache.set, cache_key, text)
+        except Exception as e:
+            print(f"--- {agent_name}: artifact cache write failed: {e} ---")
+    return text
+
+
+async def serper_search(query, use_cache=True, site="serper", **kwargs):
+    """
+    Async equivalent of GoogleSerperAPIWrapper.results() that reuses a
+    keep-alive connection pool instead of opening a session per query.
+    Results are served from the shared search cache when possible; misses
+    are retried like ainvoke_llm and recorded against ``site``, queue under
+    the Serper rate limits, and fail fast with CircuitOpenError while Serper
+    is down.
+    """
+    headers = {
+        "X-API-KEY": search.serper_api_key or "",
+        "Content-Type": "application/json",
+    }
+    params = {
+        "q": query,
+        "gl": search.gl,
+        "hl": search.hl,
+        "num": search.k,
+        "tbs": search.tbs,
+        **kwargs,
+    }
+    params = {key: value for key, value in params.items() if value is not None}
+
+    cache_key = make_key(search.type, normalize_query(query), {k: v for k, v in params.items() if k != "q"})
+    if use_cache:
+        try:
+            cached = await run_blocking(search_cache.get, cache_key)
+            if cached is not None:
+                return cached
+        except Exception as e:
+            print(f"--- serper_search: cache lookup failed: {e} ---")
+
+    async def post():
+        session = _get_serper_session()
+        async with session.post(f"{SERPER_BASE_URL}/{search.type}", params=params, headers=headers) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def take_slot():
+        await acquire("serper", f"serper/{search.type}")
+
+    async def attempt():
+        # The breaker goes first, so calls it rejects do not use up rate limit tokens.
+        return await serper_breaker.acall(post, prepare=take_slot)
+
+    results = await call_with_retries(site, attempt)
+
+    if use_cache:
+        try:
+            await run_blocking(search_cache.set, cache_key, results)
+        except Exception as e:
+            print(f"--- serper_search: cache write failed: {e} ---")
+    return results
@@ -1,91 +1,211 @@
 import chromadb
-import os
+import re
 from .models import Trip
 from langchain_core.messages import HumanMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
-from asgiref.sync import sync_to_async
 from langchain_community.embeddings import OllamaEmbeddings
-
-# Initialize LLM for HyDE
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-pro", google_api_key=os.getenv("GOOGLE_API_KEY"))
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from .breakers import CircuitOpenError, ollama_breaker
+from .caching import SQLiteCache, make_key, normalize_query
+from .concurrency import run_blocking
+from .providers import ainvoke_llm, llm, message_text
 
 class OllamaEmbeddingFunction(chromadb.EmbeddingFunction):
     def __init__(self):
         self.model = OllamaEmbeddings(model="llama3") # Assuming llama2 is available via Ollama
 
     def __call__(self, input: chromadb.Documents) -> chromadb.Embeddings:
-        return self.model.embed_documents(input)
+        return ollama_breaker.call(self.model.embed_documents, input)
 
 # Initialize the embedding function
 embeddings = OllamaEmbeddingFunction()
 
-# Initialize ChromaDB client
-client = chromadb.Client()
+# The trip index lives in a Chroma server (PLANNER_CHROMA_HOST), the one store
+# the web server and the generation workers all see: trips saved by a worker
+# are searchable from chat at once. Chroma's embedded on-disk client is not
+# used, as it only sees writes from its own process. Trips are indexed as they
+# are saved (see signals.py); each document carries a hash of its content so
+# unchanged trips are never embedded twice.
+INDEXED_FIELDS = {"destination", "duration", "itinerary", "comments", "user"}
+
+_collections = {}
+
+
+def trip_collection():
+    if not settings.PLANNER_CHROMA_HOST:
+        raise ImproperlyConfigured("PLANNER_CHROMA_HOST is not set; the trip index needs a Chroma server.")
+    location = f"{settings.PLANNER_CHROMA_HOST}:{settings.PLANNER_CHROMA_PORT}"
+    collection = _collections.get(location)
+    if collection is None:
+        client = chromadb.HttpClient(host=settings.PLANNER_CHROMA_HOST, port=settings.PLANNER_CHROMA_PORT)
+        collection = _collections[location] = client.get_or_create_collection(
+            name="trip_plans",
+            embedding_function=embeddings
+        )
+    return collection
+
+
+def trip_document(trip):
+    """The text a trip is indexed under."""
+    document = f"Trip to {trip.destination} for {trip.duration} days.\n"
+    if trip.itinerary:
+        document += f"Itinerary: {trip.itinerary}\n"
+    if trip.comments:
+        document += f"Comments: {trip.comments}\n"
+    return document
+
+
+def content_hash(document):
+    # Includes the embedding model, so switching models re-embeds everything.
+    return make_key(embeddings.model.model, document)
+
+
+def index_trip(trip, known_hash=None):
+    """
+    Adds or refreshes one trip in the index unless its content is unchanged.
+    ``known_hash`` is the indexed hash when the caller already fetched it.
+    Returns whether the trip was embedded.
+    """
+    document = trip_document(trip)
+    digest = content_hash(document)
+    collection = trip_collection()
+    if known_hash is None:
+        indexed = collection.get(ids=[str(trip.id)], include=["metadatas"])
+        known_hash = indexed["metadatas"][0].get("content_hash") if indexed["ids"] else None
+    if known_hash == digest:
+        return False
+    collection.upsert(
+        ids=[str(trip.id)],
+        documents=[document],
+        metadatas=[{"trip_id": trip.id, "user_id": trip.user_id, "content_hash": digest}],
+    )
+    return True
+
+
+def remove_trip(trip_id):
+    trip_collection().delete(ids=[str(trip_id)])
 
-# Create or get the collection with the specified embedding function
-collection = client.get_or_create_collection(
-    name="trip_plans",
-    embedding_function=embeddings
-)
 
 def index_trips():
     """
-    Indexes all trip plans into the ChromaDB collection.
+    Brings the index in line with the database: embeds new and changed trips
+    and drops deleted ones. Returns counts of each.
     """
-    trips = Trip.objects.all()
-    documents = []
-    metadatas = []
-    ids = []
-    
-    for trip in trips:
-        # Create a document from the trip details
-        document = f"Trip to {trip.destination} for {trip.duration} days.\n"
-        if trip.itinerary:
-            document += f"Itinerary: {trip.itinerary}\n"
-        if trip.comments:
-            document += f"Comments: {trip.comments}\n"
-        
-        documents.append(document)
-        metadatas.append({"trip_id": trip.id, "user_id": trip.user.id})
-        ids.append(str(trip.id))
-
-    if documents:
-        # Clear the collection before adding new documents to avoid duplicates
-        try:
-            collection.delete(ids=ids)
-        except Exception as e:
-            print(f"Error deleting documents from collection: {e}")
-        collection.add(
-            documents=documents,
-            metadatas=metadatas,
-            ids=ids
-        )
-    print(f"Indexed {len(documents)} trips.")
+    collection = trip_collection()
+    indexed = collection.get(include=["metadatas"])
+    known = {id_: (metadata or {}).get("content_hash") for id_, metadata in zip(indexed["ids"], indexed["metadatas"])}
+    embedded = 0
+    trip_ids = set()
+    for trip in Trip.objects.only("id", "user_id", *INDEXED_FIELDS - {"user"}).iterator():
+        trip_ids.add(str(trip.id))
+        embedded += index_trip(trip, known.get(str(trip.id), ""))
+    stale = [id_ for id_ in known if id_ not in trip_ids]
+    if stale:
+        collection.delete(ids=stale)
+    print(f"Indexed {len(trip_ids)} trips: {embedded} embedded, {len(trip_ids) - embedded} unchanged, {len(stale)} removed.")
+    return {"trips": len(trip_ids), "embedded": embedded, "removed": len(stale)}
 
 def search_trips(query, user_id, n_results=3):
     """
     Searches for relevant trip plans for a specific user in the ChromaDB collection.
     """
     print(f"--- RAG: Searching for query: '{query}' for user_id: {user_id} ---")
-    results = collection.query(
-        query_texts=[query],
-        n_results=n_results,
-        where={"user_id": user_id}
-    )
+    try:
+        results = trip_collection().query(
+            query_texts=[query],
+            n_results=n_results,
+            where={"user_id": user_id}
+        )
+    except CircuitOpenError as e:
+        # Answer without retrieved context rather than waiting on a dead embedding server.
+        print(f"--- RAG: {e} ---")
+        return []
     documents = results['documents'][0] if results['documents'] else []
     print(f"--- RAG: Found {len(documents)} documents. ---")
     return documents
 
+# Chat retrieval routes: no past trips at all, the question itself as the
+# search query, or a HyDE hypothetical trip summary (one model call) as the query.
+NO_RETRIEVAL, PLAIN, HYDE = "none", "plain", "hyde"
+
+SMALL_TALK_WORDS = {
+    "thanks", "thank", "thx", "ty", "you", "so", "much", "very", "a", "lot", "again", "ok", "okay", "cool",
+    "great", "nice", "perfect", "awesome", "got", "it", "sure", "yes", "no", "hi", "hello", "hey", "there",
+    "bye", "goodbye", "good", "morning", "evening", "night", "alright", "sounds", "that", "s", "fine",
+}
+# Requests the chat tools carry out on the current trip; past trips add nothing to them.
+COMMAND_PATTERN = re.compile(
+    r"^(please |can you |could you )*(give me|make|create|generate|regenerate|update|redo|refresh|rewrite|"
+    r"change|add|remove|replan|recalculate|repair)\b.*\b(packing|weather|forecast|itinerary|plan|activities|"
+    r"accommodation|hotels?|stays?|budget|expenses?|food|links)\b"
+)
+QUESTION_WORDS = {"what", "which", "where", "when", "who", "why", "how", "should", "can", "could", "is", "are", "do", "does"}
+
+hyde_cache = SQLiteCache(
+    "hyde",
+    ttl=settings.PLANNER_HYDE_CACHE_TTL,
+    max_entries=settings.PLANNER_HYDE_CACHE_MAX_ENTRIES,
+)
+
+
+def route_query(query):
+    """Picks how a chat question retrieves past trips: NO_RETRIEVAL, PLAIN or HYDE."""
+    normalized = normalize_query(query)
+    words = normalized.split()
+    if not words or set(words) <= SMALL_TALK_WORDS or COMMAND_PATTERN.search(normalized):
+        return NO_RETRIEVAL
+    if len(words) <= settings.PLANNER_RAG_PLAIN_MAX_WORDS and words[0] not in QUESTION_WORDS:
+        return PLAIN
+    return HYDE
+
+
+def hyde_cache_key(query, user_id):
+    # Prefixed with the user so invalidate_hyde_cache can drop all of a user's entries.
+    return f"{user_id}:{make_key(llm.model, normalize_query(query))}"
+
+
+def invalidate_hyde_cache(user_id):
+    hyde_cache.delete_prefix(f"{user_id}:")
+
+
+async def hypothetical_document(query, user_id):
+    """The HyDE trip summary for ``query``, from the per-user cache when possible."""
+    cache_key = hyde_cache_key(query, user_id)
+    try:
+        cached = await run_blocking(hyde_cache.get, cache_key)
+        if cached is not None:
+            print(f"--- HyDE: cache hit for query: '{query}' ---")
+            return cached
+    except Exception as e:
+        print(f"--- HyDE: cache lookup failed: {e} ---")
+
+    print(f"--- HyDE: Generating hypothetical document for query: '{query}' ---")
+    hyde_prompt = f"Generate a concise trip plan summary for: {query}"
+    llm_result = await ainvoke_llm([HumanMessage(content=hyde_prompt)], site="gemini:hyde")
+    document = message_text(llm_result).strip()
+    if document:
+        try:
+            await run_blocking(hyde_cache.set, cache_key, document)
+        except Exception as e:
+            print(f"--- HyDE: cache write failed: {e} ---")
+    return document
+
+
 async def hyde_search_trips(query, user_id, n_results=3):
     """
     Searches for relevant trip plans using the HyDE technique.
     """
-    print(f"--- HyDE: Generating hypothetical document for query: '{query}' ---")
-    # 1. Generate a hypothetical document
-    hyde_prompt = f"Generate a concise trip plan summary for: {query}"
-    llm_result = await sync_to_async(llm.invoke)([HumanMessage(content=hyde_prompt)])
-    hypothetical_document = llm_result.content
-    print(f"--- HyDE: Hypothetical document:\n{hypothetical_document} ---")
+    hypothetical = await hypothetical_document(query, user_id)
+    print(f"--- HyDE: Hypothetical document:\n{hypothetical} ---")
+    return await run_blocking(search_trips, hypothetical or query, user_id, n_results)
+
 
-    # 2. Search for the hypothetical document
-    return search_trips(hypothetical_document, user_id, n_results)
\ No newline at end of file
+async def retrieve_trip_context(query, user_id, n_results=3):
+    """Past trips relevant to a chat question, retrieved the way route_query picks."""
+    route = route_query(query)
+    print(f"--- RAG: routed query '{query}' to {route} retrieval ---")
+    if route == NO_RETRIEVAL:
+        return []
+    if route == PLAIN:
+        return await run_blocking(search_trips, query, user_id, n_results)
+    return await hyde_search_trips(query, user_id, n_results)
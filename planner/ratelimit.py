@@ -0,0 +1,139 @@
+import asyncio
+import math
+import time
+
+from django.conf import settings
+
+from .caching import _connect
+from .concurrency import run_blocking
+
+# Token buckets for provider quotas, shared by every worker process on the
+# host through the planner cache database. A call takes one token from each
+# bucket that applies to it: the provider ("gemini", "serper") and the model
+# or endpoint ("gemini/gemini-2.5-pro", "serper/places"). Limits come from
+# PLANNER_RATE_LIMITS; buckets without a limit are not tracked.
+#
+# Tokens are reserved up front and a bucket may go into debt, so callers
+# queue in the order they arrived: each one sleeps until its token would
+# have refilled. A call that would have to wait longer than
+# PLANNER_RATE_LIMIT_MAX_WAIT does not queue and raises RateLimitExceeded.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    bucket TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    granted INTEGER NOT NULL DEFAULT 0,
+    queued INTEGER NOT NULL DEFAULT 0,
+    queued_seconds REAL NOT NULL DEFAULT 0,
+    rejected INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+PERIODS = {"s": 1, "sec": 1, "min": 60, "h": 3600, "hour": 3600}
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a provider call would have to queue longer than PLANNER_RATE_LIMIT_MAX_WAIT."""
+
+    # The queue already absorbed what it could; retrying would only queue again.
+    is_retryable = False
+
+    def __init__(self, bucket, wait):
+        super().__init__(f"{bucket} rate limit reached (next slot in {wait:.1f}s)")
+        self.bucket = bucket
+        self.wait = wait
+
+
+def parse_limit(value):
+    """
+    Parses ``count/period`` with an optional ``:burst``, e.g. ``150/min`` or
+    ``5/s:10``, into (tokens per second, bucket size). The burst defaults to
+    one second's worth of calls, and at least one.
+    """
+    rate, _, burst = value.partition(":")
+    count, _, period = rate.partition("/")
+    per_second = float(count) / PERIODS[period.strip() or "s"]
+    return per_second, float(burst) if burst else float(max(1, math.ceil(per_second)))
+
+
+def _connection():
+    return _connect(str(settings.PLANNER_CACHE_DB), SCHEMA)
+
+
+def _limited(buckets):
+    return [(bucket, parse_limit(settings.PLANNER_RATE_LIMITS[bucket])) for bucket in buckets if bucket in settings.PLANNER_RATE_LIMITS]
+
+
+def reserve(buckets, max_wait=None):
+    """
+    Takes a token from each limited bucket in ``buckets`` and returns how
+    many seconds the caller has to wait before using it. Takes nothing and
+    raises RateLimitExceeded if that wait would exceed ``max_wait``.
+    """
+    limited = _limited(buckets)
+    if not limited:
+        return 0.0
+    max_wait = settings.PLANNER_RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+    connection = _connection()
+    now = time.time()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        waits = {}
+        for bucket, (rate, burst) in limited:
+            row = connection.execute("SELECT tokens, updated_at FROM rate_buckets WHERE bucket = ?", (bucket,)).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+            waits[bucket] = (tokens, max(0.0, (1 - tokens) / rate))
+        bucket, (_, wait) = max(waits.items(), key=lambda item: item[1][1])
+        if wait > max_wait:
+            connection.execute("UPDATE rate_buckets SET rejected = rejected + 1 WHERE bucket = ?", (bucket,))
+            connection.execute("COMMIT")
+            raise RateLimitExceeded(bucket, wait)
+        for bucket, (tokens, bucket_wait) in waits.items():
+            connection.execute(
+                "INSERT INTO rate_buckets (bucket, tokens, updated_at, granted, queued, queued_seconds) VALUES (?, ?, ?, 1, ?, ?) "
+                "ON CONFLICT(bucket) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at, "
+                "granted = granted + 1, queued = queued + excluded.queued, queued_seconds = queued_seconds + excluded.queued_seconds",
+                (bucket, tokens - 1, now, int(bucket_wait > 0), bucket_wait),
+            )
+        connection.execute("COMMIT")
+    except RateLimitExceeded:
+        raise
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    return wait
+
+
+async def acquire(*buckets):
+    """Waits for a slot in every limited bucket of ``buckets``; see reserve()."""
+    wait = await run_blocking(reserve, buckets)
+    if wait > 0:
+        await asyncio.sleep(wait)
+
+
+def bucket_stats():
+    """Counters of every rate limited bucket on record, with its current fill."""
+    now = time.time()
+    rows = _connection().execute(
+        "SELECT bucket, tokens, updated_at, granted, queued, queued_seconds, rejected FROM rate_buckets ORDER BY bucket"
+    ).fetchall()
+    stats = []
+    for bucket, tokens, updated_at, granted, queued, queued_seconds, rejected in rows:
+        limit = settings.PLANNER_RATE_LIMITS.get(bucket)
+        rate, burst = parse_limit(limit) if limit else (None, None)
+        stats.append({
+            "bucket": bucket,
+            "limit_per_second": rate,
+            "burst": burst,
+            "tokens": round(min(burst, tokens + (now - updated_at) * rate), 2) if rate else None,
+            "granted": granted,
+            "queued": queued,
+            "average_wait": round(queued_seconds / queued, 3) if queued else 0.0,
+            "rejected": rejected,
+        })
+    return stats
+
+
+def reset_bucket_stats():
+    _connection().execute("DELETE FROM rate_buckets")
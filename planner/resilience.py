@@ -0,0 +1,311 @@
+import asyncio
+import math
+import random
+import re
+import threading
+import time
+from collections import deque
+
+import aiohttp
+from django.conf import settings
+
+from .caching import _connect
+from .concurrency import run_blocking
+
+# Retries, backoff and hedging shared by every provider call (see
+# providers.py). Each call names its call site, e.g. "gemini:itinerary" or
+# "serper:useful_links"; the part before the colon is the provider, which
+# owns the retry budget. Per-site counters and a latency histogram are kept
+# in the planner cache database so `manage.py provider_metrics` sees every
+# worker process on the host.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS call_stats (
+    site TEXT PRIMARY KEY,
+    calls INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    failures INTEGER NOT NULL DEFAULT 0,
+    hedges INTEGER NOT NULL DEFAULT 0,
+    hedge_wins INTEGER NOT NULL DEFAULT 0,
+    budget_exhausted INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS call_latency (
+    site TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (site, bucket)
+);
+"""
+
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+# Latency histogram buckets grow by 20%, so percentiles read from it are
+# within 20% of the true value.
+LATENCY_BUCKET_BASE = 1.2
+
+# Calls a site needs on record before hedging uses its observed p95.
+HEDGE_MIN_SAMPLES = 20
+HEDGE_DELAY_REFRESH = 60
+
+
+def _metrics_path():
+    return str(settings.PLANNER_CACHE_DB)
+
+
+def error_status(error):
+    """The HTTP status a provider error carries, if any."""
+    for attribute in ("status", "status_code", "code"):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def is_retryable(error):
+    """Whether another attempt could succeed: timeouts, dropped connections, 429s and 5xx."""
+    retryable = getattr(error, "is_retryable", None)
+    if isinstance(retryable, bool):
+        return retryable
+    if isinstance(error, (asyncio.TimeoutError, aiohttp.ClientConnectionError, ConnectionError)):
+        return True
+    status = error_status(error)
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+    return bool(re.search(r"\b(429|500|502|503|504)\b|RESOURCE_EXHAUSTED|UNAVAILABLE", str(error)))
+
+
+def retry_hint(error):
+    """Seconds the provider asked us to wait (Retry-After, or Gemini's retry_delay), if it said."""
+    headers = getattr(error, "headers", None) or {}
+    value = headers.get("Retry-After", "") if hasattr(headers, "get") else ""
+    if str(value).isdigit():
+        return float(value)
+    match = re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", str(error)) or re.search(r"retry in (\d+(?:\.\d+)?)\s*s", str(error), re.IGNORECASE)
+    return float(match.group(1)) if match else None
+
+
+def backoff_delay(attempt, hint=None):
+    """
+    Seconds to wait before retry number ``attempt + 1``: exponential backoff
+    with full jitter, so callers that failed together do not retry together.
+    A provider's own hint is honoured, or the call is given up (None) when
+    the hint is longer than PLANNER_RETRY_MAX_DELAY.
+    """
+    if hint is not None:
+        if hint > settings.PLANNER_RETRY_MAX_DELAY:
+            return None
+        return hint + random.uniform(0, settings.PLANNER_RETRY_BASE_DELAY)
+    return random.uniform(0, min(settings.PLANNER_RETRY_MAX_DELAY, settings.PLANNER_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+class RetryBudget:
+    """
+    Limits retries to ``ratio`` of the calls made in the last ``window``
+    seconds, plus ``minimum``, so an outage of a provider is not multiplied
+    into a retry storm against it. Kept per process and per provider.
+    """
+
+    def __init__(self, ratio, minimum, window=10.0):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.window = window
+        self.calls = deque()
+        self.retries = deque()
+        self.lock = threading.Lock()
+
+    def _trim(self, now):
+        for events in (self.calls, self.retries):
+            while events and events[0] < now - self.window:
+                events.popleft()
+
+    def record_call(self):
+        with self.lock:
+            now = time.monotonic()
+            self._trim(now)
+            self.calls.append(now)
+
+    def try_retry(self):
+        with self.lock:
+            now = time.monotonic()
+            self._trim(now)
+            if len(self.retries) >= self.minimum + self.ratio * len(self.calls):
+                return False
+            self.retries.append(now)
+            return True
+
+
+_budgets = {}
+
+
+def retry_budget(provider):
+    budget = _budgets.get(provider)
+    if budget is None:
+        budget = _budgets[provider] = RetryBudget(settings.PLANNER_RETRY_BUDGET_RATIO, settings.PLANNER_RETRY_BUDGET_MIN)
+    return budget
+
+
+def latency_bucket(seconds):
+    return max(0, math.ceil(math.log(max(seconds * 1000, 1.0), LATENCY_BUCKET_BASE)))
+
+
+def bucket_seconds(bucket):
+    """Upper bound of a latency bucket, in seconds."""
+    return LATENCY_BUCKET_BASE ** bucket / 1000
+
+
+def record_call(site, seconds, attempts, failed=False, hedged=False, hedge_won=False, budget_exhausted=False):
+    connection = _connect(_metrics_path(), SCHEMA)
+    connection.execute(
+        "INSERT INTO call_stats (site, calls, attempts, failures, hedges, hedge_wins, budget_exhausted) "
+        "VALUES (?, 1, ?, ?, ?, ?, ?) ON CONFLICT(site) DO UPDATE SET calls = calls + 1, "
+        "attempts = attempts + excluded.attempts, failures = failures + excluded.failures, "
+        "hedges = hedges + excluded.hedges, hedge_wins = hedge_wins + excluded.hedge_wins, "
+        "budget_exhausted = budget_exhausted + excluded.budget_exhausted",
+        (site, attempts, int(failed), int(hedged), int(hedge_won), int(budget_exhausted)),
+    )
+    connection.execute(
+        "INSERT INTO call_latency (site, bucket, count) VALUES (?, ?, 1) "
+        "ON CONFLICT(site, bucket) DO UPDATE SET count = count + 1",
+        (site, latency_bucket(seconds)),
+    )
+
+
+def latency_percentiles(site, fractions=(0.5, 0.95, 0.99)):
+    """Approximate latency percentiles of a call site in seconds, and how many calls they cover."""
+    rows = _connect(_metrics_path(), SCHEMA).execute(
+        "SELECT bucket, count FROM call_latency WHERE site = ? ORDER BY bucket", (site,)
+    ).fetchall()
+    total = sum(count for _, count in rows)
+    percentiles = {}
+    for fraction in fractions:
+        seen = 0
+        for bucket, count in rows:
+            seen += count
+            if seen >= fraction * total:
+                percentiles[fraction] = round(bucket_seconds(bucket), 3)
+                break
+    return percentiles, total
+
+
+def call_site_stats():
+    """Counters and latency percentiles of every call site on record."""
+    connection = _connect(_metrics_path(), SCHEMA)
+    rows = connection.execute(
+        "SELECT site, calls, attempts, failures, hedges, hedge_wins, budget_exhausted FROM call_stats ORDER BY site"
+    ).fetchall()
+    stats = []
+    for site, calls, attempts, failures, hedges, hedge_wins, budget_exhausted in rows:
+        percentiles, _ = latency_percentiles(site)
+        stats.append({
+            "site": site,
+            "calls": calls,
+            "attempts": attempts,
+            "attempts_per_call": round(attempts / calls, 2) if calls else 0.0,
+            "failures": failures,
+            "hedges": hedges,
+            "hedge_wins": hedge_wins,
+            "budget_exhausted": budget_exhausted,
+            "p50": percentiles.get(0.5),
+            "p95": percentiles.get(0.95),
+            "p99": percentiles.get(0.99),
+        })
+    return stats
+
+
+def reset_call_site_stats():
+    connection = _connect(_metrics_path(), SCHEMA)
+    connection.execute("DELETE FROM call_stats")
+    connection.execute("DELETE FROM call_latency")
+
+
+_hedge_delays = {}
+
+
+def hedge_delay(site, fallback):
+    """
+    Seconds after which a call to ``site`` gets a duplicate request: the
+    site's observed p95 latency once enough calls are on record, otherwise
+    ``fallback``. Looked up at most once a minute per process.
+    """
+    cached = _hedge_delays.get(site)
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
+    delay = fallback
+    try:
+        percentiles, samples = latency_percentiles(site, (0.95,))
+        if samples >= HEDGE_MIN_SAMPLES:
+            delay = percentiles[0.95]
+    except Exception as e:
+        print(f"--- hedge_delay: could not read latency of {site}: {e} ---")
+    _hedge_delays[site] = (delay, time.monotonic() + HEDGE_DELAY_REFRESH)
+    return delay
+
+
+async def _attempt(call, hedge_after, outcome):
+    """One attempt; with ``hedge_after`` a slow one gets a duplicate request and the first success wins."""
+    outcome["attempts"] += 1
+    if not hedge_after:
+        return await call()
+
+    tasks = [asyncio.ensure_future(call())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+        if not done:
+            outcome["attempts"] += 1
+            outcome["hedged"] = True
+            tasks.append(asyncio.ensure_future(call()))
+        error = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    outcome["hedge_won"] = task is not tasks[0]
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def call_with_retries(site, call, attempts=None, hedge_after=None):
+    """
+    Awaits ``call()``, a coroutine factory, retrying failures that may be
+    transient with jittered exponential backoff while the provider's retry
+    budget allows. With ``hedge_after`` seconds, an attempt still running
+    after that long is raced against a duplicate request. The outcome is
+    recorded against ``site``.
+    """
+    attempts = attempts or settings.PLANNER_RETRY_ATTEMPTS
+    budget = retry_budget(site.split(":", 1)[0])
+    budget.record_call()
+    outcome = {"attempts": 0, "hedged": False, "hedge_won": False, "budget_exhausted": False}
+    start = time.monotonic()
+
+    async def save(failed):
+        try:
+            await run_blocking(record_call, site, time.monotonic() - start, failed=failed, **outcome)
+        except Exception as e:
+            print(f"--- {site}: could not record call metrics: {e} ---")
+
+    for attempt in range(attempts):
+        try:
+            result = await _attempt(call, hedge_after, outcome)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            delay = backoff_delay(attempt, retry_hint(e)) if is_retryable(e) and attempt + 1 < attempts else None
+            if delay is not None and not budget.try_retry():
+                outcome["budget_exhausted"] = True
+                print(f"--- {site}: retry budget exhausted, giving up after {e} ---")
+                delay = None
+            if delay is None:
+                await save(failed=True)
+                raise
+            print(f"--- {site}: attempt {attempt + 1} failed ({e}), retrying in {delay:.2f}s ---")
+            await asyncio.sleep(delay)
+        else:
+            await save(failed=False)
+            return result
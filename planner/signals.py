@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .concurrency import run_in_background
+from .models import Trip
+from .rag_logic import INDEXED_FIELDS, index_trip, invalidate_hyde_cache, remove_trip
+
+
+def reindex_trip(trip_id):
+    """Refreshes one trip in the vector index. Best effort: `manage.py index_trips` catches up on failures."""
+    try:
+        trip = Trip.objects.only("id", "user_id", *INDEXED_FIELDS - {"user"}).filter(id=trip_id).first()
+        if trip is None:
+            remove_trip(trip_id)
+        elif index_trip(trip):
+            print(f"--- reindex_trip: embedded trip {trip_id} ---")
+    except Exception as e:
+        print(f"--- reindex_trip: could not index trip {trip_id}: {e} ---")
+
+
+def unindex_trip(trip_id):
+    try:
+        remove_trip(trip_id)
+    except Exception as e:
+        print(f"--- unindex_trip: could not remove trip {trip_id} from the index: {e} ---")
+
+
+@receiver([post_save, post_delete], sender=Trip)
+def trip_changed(sender, instance, **kwargs):
+    """Drops the owner's cached HyDE documents whenever one of their trips changes."""
+    user_id = instance.user_id
+    try:
+        # save_trip_fields may save a bare Trip(id=...) without its owner.
+        if user_id is None:
+            user_id = Trip.objects.filter(id=instance.id).values_list('user_id', flat=True).first()
+        if user_id is not None:
+            invalidate_hyde_cache(user_id)
+    except Exception as e:
+        print(f"--- trip_changed: could not invalidate the HyDE cache of user {user_id}: {e} ---")
+
+
+# Embedding a trip is a model call, so the index is refreshed on the
+# background pool once the save has committed, never on the saving request.
+
+
+@receiver(post_save, sender=Trip)
+def trip_saved(sender, instance, update_fields=None, **kwargs):
+    if not settings.PLANNER_INDEX_TRIPS_ON_SAVE:
+        return
+    # Saves that only touch generated sections other than the itinerary leave the document as it was.
+    if update_fields is None or INDEXED_FIELDS & set(update_fields):
+        trip_id = instance.id
+        transaction.on_commit(lambda: run_in_background(reindex_trip, trip_id))
+
+
+@receiver(post_delete, sender=Trip)
+def trip_deleted(sender, instance, **kwargs):
+    if not settings.PLANNER_INDEX_TRIPS_ON_SAVE:
+        return
+    trip_id = instance.id
+    transaction.on_commit(lambda: run_in_background(unindex_trip, trip_id))
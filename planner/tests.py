@@ -1,3 +1,1138 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import importlib
+import json
+import os
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+import aiohttp
+import chromadb
+import requests
+
+from asgiref.sync import async_to_sync
+from django.apps import apps as django_apps
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langgraph.checkpoint.base import empty_checkpoint
+
+from users.models import User, UserProfile
+from . import admission, breakers, caching, chat_memory, checks, concurrency, idempotency, jobs, langgraph_logic, providers, rag_logic, ratelimit, resilience, signals, views
+from .artifacts import ArtifactStore, artifact_store, is_ref
+from .checkpointing import DiskCheckpointer
+from .concurrency import run_blocking
+from .models import ChatMessage, GenerationEvent, GenerationJob, GraphRunProfile, Trip
+from .profiling import dag_depth
+from .utils import MarkdownBlockBuffer
+
+FAKE_ITINERARY = {
+    "days": [
+        {
+            "day_number": 1,
+            "theme": "Arrival",
+            "activities": [
+                {"time": "Morning", "description": "Walk through the old town", "location": "Old Town"},
+                {"time": "Evening", "description": "Dinner by the river", "location": "Riverside"},
+            ],
+        }
+    ]
+}
+
+
+async def fake_llm(messages, model=None, **kwargs):
+    prompt = messages[-1].content
+    if "search queries" in prompt:
+        return AIMessage(content=json.dumps(["query one", "query two"]))
+    if "Pydantic schema" in prompt:
+        return AIMessage(content=json.dumps(FAKE_ITINERARY))
+    return AIMessage(content="- Simulated output")
+
+
+async def fake_cached_llm_text(agent_name, template, refresh=False, **params):
+    return "- Simulated output"
+
+
+async def fake_search(query, **kwargs):
+    return {"organic": [{"title": "Result", "link": "https://example.com", "snippet": "Snippet"}]}
+
+
+@contextlib.contextmanager
+def fake_providers():
+    with mock.patch.object(langgraph_logic, "ainvoke_llm", fake_llm), \
+            mock.patch.object(langgraph_logic, "cached_llm_text", fake_cached_llm_text), \
+            mock.patch.object(langgraph_logic, "serper_search", fake_search):
+        yield
+
+
+def use_temp_stores(test):
+    """Points the planner's cache and checkpoint stores at a temporary directory for one test."""
+    directory = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+    test.addCleanup(directory.cleanup)
+    stores = override_settings(
+        PLANNER_CACHE_DB=os.path.join(directory.name, "cache.sqlite3"),
+        PLANNER_CHECKPOINT_DB=os.path.join(directory.name, "checkpoints.sqlite3"),
+    )
+    stores.enable()
+    test.addCleanup(stores.disable)
+    # Runs first: let background work (trip indexing, chat summaries) finish before the stores are reset.
+    test.addCleanup(finish_background_work)
+
+
+def finish_background_work():
+    executor, concurrency._background_executor = concurrency._background_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def create_user(username="traveller", active=False, **fields):
+    """A user; ``active`` skips the OTP verification new accounts otherwise wait for."""
+    user = User.objects.create_user(username=username, email=f"{username}@example.com", password="secret", **fields)
+    if active:
+        user.is_active = True
+        user.save()
+    return user
+
+
+def create_trip(user, **fields):
+    """A trip of ``user``: three cultural days in Lisbon in May unless ``fields`` say otherwise."""
+    return Trip.objects.create(**{
+        "user": user, "destination": "Lisbon", "month": "May", "duration": 3, "num_people": "2",
+        "holiday_type": "cultural", "budget_type": "medium", **fields,
+    })
+
+
+class PlannerTestCase(TestCase):
+    """Runs every test against its own temporary planner stores."""
+
+    def setUp(self):
+        use_temp_stores(self)
+
+
+class TripTestCase(PlannerTestCase):
+    """A PlannerTestCase with a traveller (``self.user``) and one of their trips (``self.trip``)."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.trip = create_trip(self.user)
+
+
+# Keep every ORM call on the test's connection so queries can be captured.
+@override_settings(PLANNER_BRANCH_EXECUTION="thread_sensitive")
+class GraphRunTests(TripTestCase):
+    def run_graph(self):
+        with fake_providers():
+            return async_to_sync(langgraph_logic.generate_complete_trip_automatically)({"trip_id": self.trip.id})
+
+    def test_runs_of_one_trip_never_overlap(self):
+        log = []
+        ainvoke = langgraph_logic.graph.ainvoke
+
+        async def recorded(*args, **kwargs):
+            log.append("start")
+            try:
+                return await ainvoke(*args, **kwargs)
+            finally:
+                log.append("end")
+
+        async def two_runs():
+            return await asyncio.gather(
+                langgraph_logic.generate_complete_trip_automatically({"trip_id": self.trip.id}),
+                langgraph_logic.generate_complete_trip_automatically({"trip_id": self.trip.id}, deadline=0),
+            )
+
+        with fake_providers(), mock.patch.object(langgraph_logic.graph, "ainvoke", recorded):
+            results = async_to_sync(two_runs)()
+
+        self.assertTrue(all(result["complete_generation"] for result in results))
+        self.assertEqual(log, ["start", "end", "start", "end"])
+
+    @override_settings(PLANNER_ARTIFACT_ORPHAN_GRACE=0, PLANNER_ARTIFACT_INLINE_BYTES=10)
+    def test_run_drops_artifacts_of_replaced_snapshots(self):
+        earlier = artifact_store.put("an itinerary from an earlier run")
+        self.run_graph()
+
+        with self.assertRaises(LookupError):
+            artifact_store.get(earlier)
+        self.assertGreater(artifact_store.stats()["artifacts"], 0)
+
+    def test_full_run_reads_trip_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            result = self.run_graph()
+
+        trip_reads = [
+            query for query in queries.captured_queries
+            if query["sql"].startswith("SELECT") and 'FROM "planner_trip"' in query["sql"]
+        ]
+        self.assertTrue(result["complete_generation"])
+        self.assertEqual(len(trip_reads), 1)
+        self.assertEqual(result["trip_reads"], 1)
+
+    def test_outputs_written_in_one_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.run_graph()
+
+        trip_writes = [query for query in queries.captured_queries if query["sql"].startswith('UPDATE "planner_trip"')]
+        self.assertEqual(len(trip_writes), 1)
+        self.trip.refresh_from_db()
+        self.assertEqual(json.loads(self.trip.itinerary)["days"][0]["theme"], "Arrival")
+        self.assertTrue(self.trip.weather_forecast)
+        self.assertTrue(self.trip.complete_trip_plan)
+
+    @override_settings(PLANNER_ARTIFACT_INLINE_BYTES=0)
+    def test_state_carries_artifact_references(self):
+        result = self.run_graph()
+
+        self.assertTrue(is_ref(result["itinerary"]))
+        self.assertTrue(is_ref(result["weather_forecast"]))
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.weather_forecast, artifact_store.get(result["weather_forecast"]))
+        self.assertEqual(json.loads(self.trip.itinerary)["days"][0]["theme"], "Arrival")
+        # extract_places resolved the itinerary reference.
+        self.assertTrue(self.trip.checkpoint_set.exists())
+
+    def test_failed_run_resumes_from_last_checkpoint(self):
+        llm_calls = []
+
+        async def counting_llm(messages, model=None, **kwargs):
+            llm_calls.append(messages)
+            return await fake_llm(messages, model)
+
+        with fake_providers(), mock.patch.object(langgraph_logic, "ainvoke_llm", counting_llm):
+            with mock.patch.object(langgraph_logic, "save_trip_fields", side_effect=RuntimeError("database is locked")):
+                failed = async_to_sync(langgraph_logic.generate_complete_trip_automatically)({"trip_id": self.trip.id})
+            calls_before_resume = len(llm_calls)
+            resumed = async_to_sync(langgraph_logic.generate_complete_trip_automatically)({"trip_id": self.trip.id}, resume=True)
+
+        self.assertFalse(failed["complete_generation"])
+        self.assertTrue(resumed["complete_generation"])
+        self.assertEqual(len(llm_calls), calls_before_resume)
+        self.assertEqual(list(resumed["node_timings"]), ["persist_outputs"])
+        self.trip.refresh_from_db()
+        self.assertTrue(self.trip.complete_trip_plan)
+
+
+    def test_repair_reruns_only_failed_nodes(self):
+        async def flaky_search(query, **kwargs):
+            if "hostels" in query:
+                raise RuntimeError("Serper unavailable")
+            return await fake_search(query)
+
+        llm_calls = []
+
+        async def counting_llm(messages, model=None, **kwargs):
+            llm_calls.append(messages)
+            return await fake_llm(messages, model)
+
+        with fake_providers(), mock.patch.object(langgraph_logic, "ainvoke_llm", counting_llm):
+            with mock.patch.object(langgraph_logic, "serper_search", flaky_search):
+                async_to_sync(langgraph_logic.generate_complete_trip_automatically)({"trip_id": self.trip.id})
+            self.trip.refresh_from_db()
+            self.assertIn("accommodation_recommender", self.trip.generation_warnings)
+
+            calls_before_repair = len(llm_calls)
+            repaired = async_to_sync(langgraph_logic.generate_complete_trip_automatically)({"trip_id": self.trip.id}, repair=True)
+
+        self.assertEqual(repaired["repaired_nodes"], ["accommodation_recommender"])
+        self.assertEqual(len(llm_calls), calls_before_repair)
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.generation_warnings, {})
+        self.assertTrue(self.trip.accommodation_info)
+        self.assertTrue(self.trip.complete_trip_plan)
+
+    @override_settings(PLANNER_NODE_TIMEOUTS={"weather_forecaster": 0.05})
+    def test_late_node_is_left_pending_then_backfilled(self):
+        async def slow_cached_llm_text(agent_name, template, refresh=False, **params):
+            if agent_name == "weather_forecaster":
+                await asyncio.sleep(5)
+            return await fake_cached_llm_text(agent_name, template)
+
+        job = jobs.enqueue_generation(self.trip.id)
+        with fake_providers(), mock.patch.object(langgraph_logic, "cached_llm_text", slow_cached_llm_text):
+            async_to_sync(jobs.run_job)(jobs.claim_job("worker-a", 60), "worker-a", 60)
+
+        job.refresh_from_db()
+        self.trip.refresh_from_db()
+        self.assertEqual(job.status, GenerationJob.SUCCEEDED)
+        self.assertTrue(self.trip.complete_trip_plan)
+        self.assertFalse(self.trip.weather_forecast)
+        self.assertEqual(langgraph_logic.pending_nodes(self.trip.generation_warnings), ["weather_forecaster"])
+
+        backfill = jobs.claim_job("worker-a", 60)
+        self.assertEqual(backfill.kind, jobs.REPAIR)
+        with fake_providers():
+            async_to_sync(jobs.run_job)(backfill, "worker-a", 60)
+
+        backfill.refresh_from_db()
+        self.trip.refresh_from_db()
+        self.assertEqual(backfill.status, GenerationJob.SUCCEEDED)
+        self.assertTrue(self.trip.weather_forecast)
+        self.assertEqual(self.trip.generation_warnings, {})
+
+    def test_graph_depth_matches_data_dependencies(self):
+        dependencies = {}
+        for edge in langgraph_logic.graph.get_graph().edges:
+            if edge.target != "__end__":
+                dependencies.setdefault(edge.target, [])
+                if edge.source != "__start__":
+                    dependencies[edge.target].append(edge.source)
+
+        # generate_itinerary -> extract_places -> persist_outputs is the only
+        # chain the data forces; a deeper graph serializes independent nodes.
+        self.assertEqual(dag_depth(dependencies), dag_depth(langgraph_logic.NODE_DEPENDENCIES) + 1)
+        self.assertEqual(dag_depth(dependencies), 3)
+
+    def test_run_profile_records_critical_path(self):
+        result = self.run_graph()
+
+        profile = GraphRunProfile.objects.get(trip=self.trip)
+        self.assertTrue(profile.succeeded)
+        self.assertEqual(profile.critical_path, result["critical_path"]["nodes"])
+        self.assertEqual(profile.critical_path[-1], "persist_outputs")
+        self.assertIn(profile.critical_path[0], langgraph_logic.BRANCH_NODES)
+        self.assertEqual(set(profile.node_timings), set(langgraph_logic.GRAPH_NODES))
+
+    def test_repair_plan_includes_dependents(self):
+        outputs = {field: "value" for field in langgraph_logic.PERSISTED_FIELDS}
+        self.assertEqual(langgraph_logic.nodes_to_repair(outputs, {}, has_places=True), [])
+        self.assertEqual(
+            langgraph_logic.nodes_to_repair({**outputs, "itinerary": ""}, {}, has_places=True),
+            ["generate_itinerary", "extract_places"],
+        )
+        self.assertEqual(
+            langgraph_logic.nodes_to_repair(outputs, {"weather_forecaster": "timeout"}, has_places=True),
+            ["weather_forecaster"],
+        )
+
+
+@override_settings(PLANNER_BRANCH_EXECUTION="thread_sensitive", PLANNER_ITINERARY_SEARCH_TIMEOUT=0.5)
+class ItinerarySearchTests(TripTestCase):
+    def test_searches_run_concurrently_and_fail_on_their_own(self):
+        prompts = []
+
+        async def llm(messages, model=None, **kwargs):
+            prompts.append(messages[-1].content)
+            if "search queries" in messages[-1].content:
+                return AIMessage(content=json.dumps(["slow museums", "broken food", "hung nightlife", "fast parks"]))
+            return AIMessage(content=json.dumps(FAKE_ITINERARY))
+
+        async def search(query, **kwargs):
+            if query == "broken food":
+                raise aiohttp.ClientError("502 Bad Gateway")
+            await asyncio.sleep({"slow museums": 0.3, "hung nightlife": 5, "fast parks": 0}[query])
+            return {"organic": [{"snippet": f"{query} snippet"}]}
+
+        start = time.monotonic()
+        with mock.patch.object(langgraph_logic, "ainvoke_llm", llm), mock.patch.object(langgraph_logic, "serper_search", search):
+            result = async_to_sync(langgraph_logic.generate_itinerary)({"trip_id": self.trip.id})
+        elapsed = time.monotonic() - start
+
+        # One timeout, not the sum of the searches.
+        self.assertLess(elapsed, 1.5)
+        self.assertTrue(result["itinerary"])
+        context = prompts[-1].split("Up-to-date Context from the Web:")[1]
+        lines = [line.strip() for line in context.split("For each day")[0].strip().splitlines()]
+        self.assertEqual(lines, [
+            "slow museums snippet",
+            "Could not retrieve information for query: broken food",
+            "Could not retrieve information for query: hung nightlife",
+            "fast parks snippet",
+        ])
+
+
+@override_settings(PLANNER_BRANCH_EXECUTION="executor")
+class BlockingExecutorTests(TransactionTestCase):
+    def setUp(self):
+        use_temp_stores(self)
+
+    @override_settings(PLANNER_INDEX_TRIPS_ON_SAVE=False)
+    def test_pool_threads_run_orm_calls_and_recycle_their_connections(self):
+        user = create_user()
+
+        with mock.patch.object(concurrency, "close_old_connections", wraps=concurrency.close_old_connections) as close:
+            trip_id = async_to_sync(concurrency.run_blocking)(lambda: create_trip(user).id)
+            count = async_to_sync(concurrency.run_blocking)(Trip.objects.filter(id=trip_id).count)
+
+        self.assertEqual(count, 1)
+        self.assertEqual(close.call_count, 4)
+
+    @override_settings(PLANNER_CHAT_HISTORY_TURNS=1, PLANNER_CHAT_SUMMARY_BATCH=1)
+    def test_chat_summary_is_folded_on_the_background_pool(self):
+        trip = create_trip(create_user())
+        for n in range(2):
+            ChatMessage.objects.create(trip=trip, question=f"question {n}", response="", response_markdown=f"answer {n}")
+        summarise = mock.AsyncMock(return_value=AIMessage(content="Traveller likes trams."))
+
+        with mock.patch.object(chat_memory, "ainvoke_llm", summarise):
+            chat_memory.schedule_chat_summary(trip.id).result(timeout=10)
+        trip.refresh_from_db()
+        self.assertEqual(trip.chat_summary, "Traveller likes trams.")
+        self.assertIn("question 0", summarise.await_args.args[0][0].content)
+
+    def test_background_failures_are_logged_not_raised(self):
+        failing = mock.Mock(side_effect=RuntimeError("boom"), __name__="failing")
+        with mock.patch("traceback.print_exc") as print_exc:
+            self.assertIsNone(concurrency.run_in_background(failing, 1).result(timeout=10))
+        failing.assert_called_once_with(1)
+        print_exc.assert_called_once()
+
+
+class DiskCheckpointerTests(TestCase):
+    def test_prune_keeps_newest_snapshots_per_thread(self):
+        with tempfile.TemporaryDirectory() as directory:
+            saver = DiskCheckpointer(os.path.join(directory, "checkpoints.sqlite3"))
+            config = {"configurable": {"thread_id": "1", "checkpoint_ns": ""}}
+            for _ in range(5):
+                config = saver.put(config, empty_checkpoint(), {}, {})
+                saver.put_writes(config, [("changed_fields", ["itinerary"])], task_id="task")
+            saver.put({"configurable": {"thread_id": "2", "checkpoint_ns": ""}}, empty_checkpoint(), {}, {})
+
+            self.assertEqual(saver.prune(max_per_thread=2), 3)
+            self.assertEqual(saver.stats()["checkpoints"], 3)
+            self.assertEqual(saver.stats()["writes"], 2)
+            latest = saver.get_tuple({"configurable": {"thread_id": "1", "checkpoint_ns": ""}})
+            self.assertEqual(latest.config["configurable"]["checkpoint_id"], config["configurable"]["checkpoint_id"])
+            saver.conn.close()
+
+    def test_artifacts_go_once_no_snapshot_refers_to_them(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "checkpoints.sqlite3")
+            saver, store = DiskCheckpointer(path), ArtifactStore(path)
+            old_itinerary, itinerary, forecast, orphan = (store.put(f"value {n}") for n in range(4))
+            config = {"configurable": {"thread_id": "1", "checkpoint_ns": ""}}
+            for ref in (old_itinerary, itinerary):
+                checkpoint = empty_checkpoint()
+                checkpoint["channel_values"] = {"itinerary": ref}
+                config = saver.put(config, checkpoint, {}, {})
+            saver.put_writes(config, [("weather_forecast", forecast)], task_id="task")
+
+            self.assertEqual(store.prune_unreferenced(grace=60), 0)
+            self.assertEqual(store.prune_unreferenced(grace=0), 1)
+            saver.prune(thread_id="1", max_per_thread=1)
+            self.assertEqual(store.prune_unreferenced(grace=0), 1)
+
+            self.assertEqual(store.get_many([itinerary, forecast]), {itinerary: "value 1", forecast: "value 2"})
+            for gone in (old_itinerary, orphan):
+                with self.assertRaises(LookupError):
+                    store.get(gone)
+            saver.conn.close()
+
+
+class SearchCacheTests(PlannerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = 1000.0
+        clock = mock.patch.object(caching, "time", mock.Mock(time=lambda: self.now))
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def test_entries_expire_after_their_ttl(self):
+        cache = caching.SQLiteCache("test", ttl=60, max_entries=10)
+        cache.set("short", "value", ttl=10)
+        cache.set("long", "value")
+
+        self.now += 30
+        self.assertIsNone(cache.get("short"))
+        self.assertEqual(cache.get("long"), "value")
+        self.now += 31
+        self.assertIsNone(cache.get("long"))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_least_recently_used_entries_are_evicted_over_the_size_cap(self):
+        cache = caching.SQLiteCache("test", ttl=60, max_entries=2)
+        for key in ("lisbon", "porto"):
+            cache.set(key, key.title())
+            self.now += 1
+        cache.get("lisbon")
+        self.now += 1
+        cache.set("faro", "Faro")
+
+        self.assertIsNone(cache.get("porto"))
+        self.assertEqual([cache.get("lisbon"), cache.get("faro")], ["Lisbon", "Faro"])
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_delete_prefix_drops_only_matching_keys(self):
+        cache = caching.SQLiteCache("test", ttl=60, max_entries=10)
+        for key in ("1:lisbon", "1:porto", "12:faro"):
+            cache.set(key, key)
+
+        cache.delete_prefix("1:")
+
+        self.assertEqual([cache.get(key) for key in ("1:lisbon", "1:porto", "12:faro")], [None, None, "12:faro"])
+
+    def test_counters_are_kept_per_namespace(self):
+        searches = caching.SQLiteCache("searches", ttl=60, max_entries=10)
+        forecasts = caching.SQLiteCache("forecasts", ttl=60, max_entries=10)
+        searches.set("lisbon", ["result"])
+        searches.get("lisbon")
+        searches.get("lisbon")
+        forecasts.get("lisbon")
+
+        self.assertEqual({key: searches.stats()[key] for key in ("hits", "misses", "hit_rate")}, {"hits": 2, "misses": 0, "hit_rate": 1.0})
+        self.assertEqual({key: forecasts.stats()[key] for key in ("hits", "misses", "hit_rate")}, {"hits": 0, "misses": 1, "hit_rate": 0.0})
+        self.assertEqual(caching.namespaces(), ["forecasts", "searches"])
+
+    @override_settings(PLANNER_RATE_LIMITS={})
+    def test_repeated_search_is_served_without_another_request(self):
+        posts = []
+
+        class Response:
+            def raise_for_status(self):
+                pass
+
+            async def json(self):
+                return {"organic": [{"title": "Hostels in Lisbon", "link": "https://example.com"}]}
+
+        class Session:
+            closed = False
+
+            @contextlib.asynccontextmanager
+            async def post(self, url, params=None, headers=None):
+                posts.append(params["q"])
+                yield Response()
+
+        with mock.patch.object(providers, "_get_serper_session", Session):
+            first = async_to_sync(providers.serper_search)("Lisbon hostels")
+            again = async_to_sync(providers.serper_search)("  lisbon HOSTELS? ")
+
+        self.assertEqual(posts, ["Lisbon hostels"])
+        self.assertEqual(again, first)
+        self.assertEqual(providers.search_cache.stats()["hits"], 1)
+
+
+class ArtifactCacheTests(PlannerTestCase):
+    FORECAST = "Weather in {destination} in {month}."
+
+    def setUp(self):
+        super().setUp()
+        self.generate = mock.AsyncMock(side_effect=lambda messages, **kwargs: AIMessage(content=f"Answer to: {messages[0].content}"))
+        model = mock.patch.object(providers, "ainvoke_llm", self.generate)
+        model.start()
+        self.addCleanup(model.stop)
+
+    def forecast(self, template=FORECAST, agent_name="weather_forecaster", **params):
+        return async_to_sync(providers.cached_llm_text)(agent_name, template, **{"destination": "Lisbon", "month": "May", **params})
+
+    def test_repeated_prompt_is_served_from_the_cache(self):
+        first = self.forecast()
+        again = self.forecast(destination="  lisbon ")
+
+        self.assertEqual(again, first)
+        self.assertEqual(first, "Answer to: Weather in Lisbon in May.")
+        self.assertEqual(self.generate.await_count, 1)
+
+    def test_changed_prompt_or_inputs_miss_the_cache(self):
+        self.forecast()
+        self.assertEqual(self.forecast(month="June"), "Answer to: Weather in Lisbon in June.")
+        self.assertEqual(self.forecast(template="Forecast for {destination} in {month}."), "Answer to: Forecast for Lisbon in May.")
+        self.assertEqual(self.generate.await_count, 3)
+
+    def test_hit_rate_is_counted_per_agent(self):
+        self.forecast()
+        self.forecast()
+        self.forecast(agent_name="packing_list_generator", template="Pack for {destination} in {month}.")
+
+        weather, packing = providers.artifact_cache("weather_forecaster").stats(), providers.artifact_cache("packing_list_generator").stats()
+        self.assertEqual((weather["namespace"], weather["hits"], weather["misses"]), ("artifact:weather_forecaster", 1, 1))
+        self.assertEqual((packing["namespace"], packing["hits"], packing["misses"]), ("artifact:packing_list_generator", 0, 1))
+
+
+class ProviderError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+@override_settings(PLANNER_RETRY_BASE_DELAY=0, PLANNER_RETRY_ATTEMPTS=3)
+class ProviderResilienceTests(PlannerTestCase):
+    def setUp(self):
+        super().setUp()
+        budgets = mock.patch.dict(resilience._budgets, clear=True)
+        budgets.start()
+        self.addCleanup(budgets.stop)
+
+    def call(self, site, statuses, **kwargs):
+        """Calls a fake provider that fails with each of ``statuses`` in turn, then succeeds."""
+        remaining = list(statuses)
+
+        async def provider():
+            if remaining:
+                raise ProviderError(remaining.pop(0))
+            return "ok"
+
+        return async_to_sync(resilience.call_with_retries)(site, provider, **kwargs)
+
+    def stats(self, site):
+        return next(row for row in resilience.call_site_stats() if row["site"] == site)
+
+    def test_transient_errors_are_retried(self):
+        self.assertEqual(self.call("gemini:test", [503, 429]), "ok")
+        self.assertEqual(self.stats("gemini:test")["attempts"], 3)
+
+        with self.assertRaises(ProviderError):
+            self.call("gemini:test", [400])
+        stats = self.stats("gemini:test")
+        self.assertEqual((stats["calls"], stats["attempts"], stats["failures"]), (2, 4, 1))
+
+    @override_settings(PLANNER_RETRY_BUDGET_RATIO=0, PLANNER_RETRY_BUDGET_MIN=1)
+    def test_retry_budget_caps_retries_per_provider(self):
+        self.assertEqual(self.call("serper:a", [503]), "ok")
+        with self.assertRaises(ProviderError):
+            self.call("serper:b", [503])
+        self.assertEqual(self.stats("serper:b")["budget_exhausted"], 1)
+
+    def test_slow_call_is_hedged(self):
+        calls = []
+
+        async def provider():
+            calls.append(len(calls))
+            if len(calls) == 1:
+                await asyncio.sleep(5)
+                return "slow"
+            return "fast"
+
+        result = async_to_sync(resilience.call_with_retries)("gemini:hedged", provider, hedge_after=0.05)
+
+        self.assertEqual(result, "fast")
+        stats = self.stats("gemini:hedged")
+        self.assertEqual((stats["attempts"], stats["hedges"], stats["hedge_wins"]), (2, 1, 1))
+
+    @override_settings(PLANNER_RATE_LIMITS={"gemini": "100/s", "gemini/test-model": "2/s:2"}, PLANNER_RATE_LIMIT_MAX_WAIT=0.6)
+    def test_rate_limit_queues_then_rejects(self):
+        buckets = ("gemini", "gemini/test-model", "gemini/unlimited")
+        waits = [ratelimit.reserve(buckets) for _ in range(3)]
+
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertAlmostEqual(waits[2], 0.5, delta=0.05)
+        with self.assertRaises(ratelimit.RateLimitExceeded) as raised:
+            ratelimit.reserve(buckets)
+        self.assertEqual(raised.exception.bucket, "gemini/test-model")
+        self.assertFalse(resilience.is_retryable(raised.exception))
+
+        stats = {row["bucket"]: row for row in ratelimit.bucket_stats()}
+        self.assertEqual(set(stats), {"gemini", "gemini/test-model"})
+        self.assertEqual((stats["gemini/test-model"]["granted"], stats["gemini/test-model"]["queued"]), (3, 1))
+        self.assertEqual(stats["gemini/test-model"]["rejected"], 1)
+
+    @override_settings(PLANNER_RATE_LIMITS={"gemini/gemini-2.5-pro": "10/s:1"})
+    def test_model_calls_wait_for_their_slot(self):
+        model = mock.Mock(spec=["model", "ainvoke"], model="gemini-2.5-pro")
+        model.ainvoke = mock.AsyncMock(return_value=AIMessage(content="ok"))
+
+        async def two_calls():
+            start = time.monotonic()
+            await asyncio.gather(*(providers.ainvoke_llm([], model=model, site="gemini:test") for _ in range(2)))
+            return time.monotonic() - start
+
+        self.assertGreaterEqual(async_to_sync(two_calls)(), 0.09)
+        self.assertEqual(model.ainvoke.await_count, 2)
+
+
+@override_settings(PLANNER_BREAKER_FAILURE_THRESHOLD=2, PLANNER_BREAKER_RESET_TIMEOUT=0.2)
+class CircuitBreakerTests(PlannerTestCase):
+    def test_opens_after_failures_then_probes_once(self):
+        breaker = breakers.CircuitBreaker("provider")
+        calls = []
+
+        def down():
+            calls.append("down")
+            raise requests.ConnectionError("connection refused")
+
+        for _ in range(2):
+            with self.assertRaises(requests.ConnectionError):
+                breaker.call(down)
+        with self.assertRaises(breakers.CircuitOpenError):
+            breaker.call(down)
+        self.assertEqual(len(calls), 2)
+
+        time.sleep(0.25)
+        breaker.before_call()  # the probe
+        with self.assertRaises(breakers.CircuitOpenError):
+            breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.call(lambda: "up"), "up")
+        self.assertEqual(breakers.breaker_states()[0]["state"], breakers.CLOSED)
+
+    def open_breaker(self, breaker):
+        for _ in range(2):
+            with contextlib.suppress(requests.ConnectionError):
+                breaker.call(mock.Mock(side_effect=requests.ConnectionError("connection refused")))
+
+    @override_settings(PLANNER_RATE_LIMITS={"serper": "5/s"}, PLANNER_RETRY_ATTEMPTS=1)
+    def test_open_serper_breaker_rejects_before_taking_a_rate_limit_token(self):
+        self.open_breaker(providers.serper_breaker)
+
+        with self.assertRaises(breakers.CircuitOpenError):
+            async_to_sync(providers.serper_search)("lisbon hostels", use_cache=False)
+        self.assertEqual([stats["granted"] for stats in ratelimit.bucket_stats()], [])
+
+    def test_probe_that_cannot_get_a_rate_limit_slot_lets_the_next_call_probe(self):
+        breaker = breakers.CircuitBreaker("provider")
+        self.open_breaker(breaker)
+        time.sleep(0.25)
+
+        async def no_slot():
+            raise ratelimit.RateLimitExceeded("provider", 1.0)
+
+        with self.assertRaises(ratelimit.RateLimitExceeded):
+            async_to_sync(breaker.acall)(mock.AsyncMock(), prepare=no_slot)
+        self.assertTrue(breaker.before_call())
+
+    @override_settings(PLANNER_BREAKER_FAILURE_THRESHOLD=1)
+    def test_weather_falls_back_to_last_good_answer(self):
+        ok = mock.Mock(status_code=200)
+        ok.json.return_value = {
+            "main": {"temp": 21.04, "humidity": 60}, "weather": [{"description": "clear sky", "icon": "01d"}],
+            "wind": {"speed": 3.1}, "visibility": 10000, "name": "Lisbon", "sys": {"country": "PT"},
+        }
+        with mock.patch.dict(os.environ, {"OPENWEATHERMAP_API_KEY": "key"}), \
+                mock.patch.object(views.requests, "get", side_effect=[ok, requests.Timeout("timed out")]) as get:
+            fresh = views.get_current_weather("Lisbon")
+            during_failure = views.get_current_weather("Lisbon")
+            while_open = views.get_current_weather("lisbon")
+
+        self.assertEqual(get.call_count, 2)
+        self.assertEqual(fresh["temperature"], 21.0)
+        self.assertEqual(during_failure, {**fresh, "stale": True})
+        self.assertEqual(while_open, {**fresh, "stale": True})
+
+
+@override_settings(
+    PLANNER_BRANCH_EXECUTION="thread_sensitive", PLANNER_ADMISSION_MAX_RUNS=2, PLANNER_ADMISSION_PAID_RESERVED=1, PLANNER_ADMISSION_PER_USER=1,
+    PLANNER_ADMISSION_MAX_WAIT=0, PLANNER_ADMISSION_RETRY_AFTER=7,
+)
+class AdmissionControlTests(PlannerTestCase):
+    def admit(self, user):
+        return async_to_sync(admission.admit)(user)
+
+    def test_paid_lane_gets_reserved_capacity(self):
+        first_free, second_free = create_user("first"), create_user("second")
+        paid = create_user("paid", prepaid_itineraries_count=1)
+
+        slot = self.admit(first_free)
+        with self.assertRaises(admission.AdmissionRejected):
+            self.admit(second_free)  # the free lane is full
+        with self.assertRaises(admission.AdmissionRejected):
+            self.admit(first_free)  # per-user cap
+        self.admit(paid)
+
+        admission.release(slot)
+        self.admit(second_free)
+
+    def test_rejected_request_gets_429_with_retry_after(self):
+        user = create_user(active=True)
+        trip = create_trip(user)
+        self.admit(user)
+        self.client.force_login(user)
+
+        response = self.client.post(f"/planner/trip/{trip.id}/chat/", {"user_question": "Hi"})
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "7")
+
+
+@override_settings(PLANNER_BRANCH_EXECUTION="thread_sensitive", PLANNER_SINGLE_FLIGHT_POLL_INTERVAL=0.01)
+class DuplicateRequestTests(PlannerTestCase):
+    def test_repeated_paid_trip_request_is_replayed(self):
+        user = create_user(active=True)
+        UserProfile.objects.create(user=user, paid_plan_credits=10)
+        self.client.force_login(user)
+        form = {
+            "destination": "Lisbon", "month": "May", "duration": 3, "num_people": "2",
+            "holiday_type": "cultural", "budget_type": "medium", "idempotency_key": "double-click",
+        }
+
+        first = self.client.post("/planner/create_paid_trip/", form)
+        second = self.client.post("/planner/create_paid_trip/", form)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(Trip.objects.filter(user=user).count(), 1)
+        self.assertEqual(UserProfile.objects.get(user=user).paid_plan_credits, 5)
+
+        reused = self.client.post("/planner/create_paid_trip/", {**form, "destination": "Porto"})
+        self.assertEqual(reused.status_code, 422)
+
+    def test_identical_runs_share_one_flight(self):
+        runs = []
+
+        async def run():
+            runs.append(1)
+            await asyncio.sleep(0.1)
+            return {"warnings": {"weather_forecaster": "slow"}}
+
+        async def three_requests():
+            return await asyncio.gather(*(idempotency.single_flight("process_trip:1:generate_complete_trip", run) for _ in range(3)))
+
+        results = async_to_sync(three_requests)()
+
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(results, [{"warnings": {"weather_forecaster": "slow"}}] * 3)
+
+    @override_settings(PLANNER_SINGLE_FLIGHT_TTL=0.3)
+    def test_exclusive_flights_take_turns_and_keep_their_claim(self):
+        log = []
+
+        async def run(name):
+            async with idempotency.exclusive_flight("graph:1"):
+                log.append(("start", name))
+                # Longer than the claim's TTL: renewal keeps the second run waiting.
+                await asyncio.sleep(0.5)
+                log.append(("end", name))
+
+        async def two_runs():
+            first = asyncio.ensure_future(run("first"))
+            await asyncio.sleep(0.05)
+            await asyncio.gather(first, run("second"))
+
+        async_to_sync(two_runs)()
+
+        self.assertEqual(log, [("start", "first"), ("end", "first"), ("start", "second"), ("end", "second")])
+        self.assertEqual(idempotency.claim_flight("graph:1", "next")[0], "lead")
+
+
+@override_settings(PLANNER_JOB_MAX_ATTEMPTS=2, PLANNER_JOB_RETRY_DELAY=0)
+class GenerationJobQueueTests(TripTestCase):
+    def test_job_is_leased_to_one_worker(self):
+        job = jobs.enqueue_generation(self.trip.id)
+        self.assertEqual(jobs.enqueue_generation(self.trip.id), job)
+
+        claimed = jobs.claim_job("worker-a", lease_seconds=60)
+        self.assertEqual(claimed.id, job.id)
+        self.assertIsNone(jobs.claim_job("worker-b", lease_seconds=60))
+
+    def test_failed_job_is_retried_then_failed(self):
+        job = jobs.enqueue_generation(self.trip.id)
+        for _ in range(2):
+            claimed = jobs.claim_job("worker-a", lease_seconds=60)
+            jobs.fail_job(claimed.id, "worker-a", "provider down")
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, GenerationJob.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_only_one_job_of_a_kind_can_be_active_per_trip(self):
+        job = jobs.enqueue_generation(self.trip.id)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            GenerationJob.objects.create(trip=self.trip, kind=jobs.COMPLETE_TRIP, status=GenerationJob.RUNNING)
+
+        # A request that raced past the lookup gets the job the other one created.
+        with mock.patch.object(GenerationJob.objects, "filter", return_value=GenerationJob.objects.none()):
+            self.assertEqual(jobs.enqueue_generation(self.trip.id), job)
+        self.assertNotEqual(jobs.enqueue_generation(self.trip.id, jobs.REPAIR), job)
+
+    @override_settings(PLANNER_BRANCH_EXECUTION="thread_sensitive")
+    def test_run_stops_when_another_worker_takes_over_the_lease(self):
+        jobs.enqueue_generation(self.trip.id)
+        job = jobs.claim_job("worker-a", lease_seconds=0.3)
+        cancelled = []
+
+        async def slow_generation(state, **kwargs):
+            # Another worker claims the job while this run is still going.
+            await run_blocking(GenerationJob.objects.filter(id=job.id).update, leased_by="worker-b")
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(state["trip_id"])
+                raise
+
+        start = time.monotonic()
+        with mock.patch.object(langgraph_logic, "generate_complete_trip_automatically", slow_generation):
+            async_to_sync(jobs.run_job)(job, "worker-a", lease_seconds=0.3)
+
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(cancelled, [self.trip.id])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.leased_by), (GenerationJob.RUNNING, "worker-b"))
+
+
+@override_settings(PLANNER_BRANCH_EXECUTION="thread_sensitive", PLANNER_PROGRESS_POLL_INTERVAL=0)
+class GenerationStreamTests(TripTestCase):
+    async def read_stream(self, last_event_id=0):
+        return [message async for message in jobs.stream_job_events(self.trip.id, last_event_id)]
+
+    def test_stream_replays_node_events_until_job_finishes(self):
+        jobs.enqueue_generation(self.trip.id)
+        job = jobs.claim_job("worker-a", lease_seconds=60)
+        with fake_providers():
+            async_to_sync(jobs.run_job)(job, "worker-a", 60)
+
+        messages = async_to_sync(self.read_stream)()
+        events = [line.split(": ", 1)[1] for message in messages for line in message.splitlines() if line.startswith("event: ")]
+        self.assertEqual(events[0], "job_started")
+        self.assertEqual(events[-1], "job_succeeded")
+        self.assertEqual(events.count("node_started"), len(langgraph_logic.GRAPH_NODES))
+        self.assertEqual(events.count("node_finished"), len(langgraph_logic.GRAPH_NODES))
+
+        weather = GenerationEvent.objects.get(job=job, event="node_finished", node="weather_forecaster")
+        self.assertIn("weather_forecast", weather.payload["artifacts"])
+
+        # A reconnecting client only receives the events it has not seen.
+        resumed = async_to_sync(self.read_stream)(last_event_id=weather.id)
+        self.assertFalse(any(f"id: {weather.id}\n" in message for message in resumed))
+        self.assertIn("event: job_succeeded", resumed[-1])
+
+
+FAKE_PLAN_CHUNKS = ["## Day 1\n\nVisit <place>Belem", " Tower</place>.\n\n", "| Meal | Place |\n|---|", "---|\n| Lunch | Cafe |\n"]
+
+
+async def fake_stream(messages, model=None, **kwargs):
+    for text in FAKE_PLAN_CHUNKS:
+        yield AIMessageChunk(content=text)
+
+
+class MarkdownBlockBufferTests(TestCase):
+    def test_releases_only_finished_blocks(self):
+        buffer = MarkdownBlockBuffer()
+        self.assertEqual(buffer.feed("# Title\n\nFirst para"), "# Title\n\n")
+        self.assertEqual(buffer.feed("graph\n```\ncode\n\nmore"), "")
+        self.assertEqual(buffer.feed(" code\n```\n\n"), "First paragraph\n```\ncode\n\nmore code\n```\n\n")
+        self.assertEqual(buffer.feed("tail"), "")
+        self.assertEqual(buffer.flush(), "tail")
+
+
+@override_settings(PLANNER_BRANCH_EXECUTION="thread_sensitive")
+class StreamingAgentTests(TripTestCase):
+    async def collect(self, events):
+        return [event async for event in events]
+
+    def test_trip_plan_streams_blocks_then_saves_whole_plan(self):
+        with mock.patch.object(langgraph_logic, "astream_llm", fake_stream):
+            events = async_to_sync(self.collect)(langgraph_logic.stream_complete_trip_plan({"trip_id": self.trip.id}))
+
+        kinds = [kind for kind, _ in events]
+        self.assertEqual(kinds, ["delta", "delta", "delta", "done"])
+        self.assertIn("<h2>Day 1</h2>", events[0][1])
+        self.assertIn("<table>", events[2][1])
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.complete_trip_plan, "".join(FAKE_PLAN_CHUNKS).strip())
+
+
+class FakeTool:
+    def __init__(self, name, seconds, log):
+        self.name = name
+        self.seconds = seconds
+        self.log = log
+
+    async def ainvoke(self, args):
+        self.log.append(("start", self.name))
+        await asyncio.sleep(self.seconds)
+        self.log.append(("end", self.name))
+        return f"{self.name} done for trip {args['trip_id']}"
+
+
+@override_settings(PLANNER_CHAT_TOOL_TIMEOUTS={"update_packing_list": 0.1})
+class ChatToolTests(TestCase):
+    def test_independent_tools_run_concurrently_in_fixed_order(self):
+        log = []
+        fake_tools = [
+            FakeTool("update_weather_forecast", 0.3, log),
+            FakeTool("update_activities", 0.3, log),
+            FakeTool("update_packing_list", 5, log),
+            FakeTool("update_complete_trip_plan", 0.01, log),
+        ]
+        tool_calls = [{"name": tool.name, "args": {"instruction": "refresh"}} for tool in fake_tools]
+        tool_calls.insert(2, {"name": "book_flights", "args": {}})
+
+        start = time.monotonic()
+        with mock.patch.object(langgraph_logic, "tools", fake_tools):
+            outputs = async_to_sync(langgraph_logic.run_chat_tools)(tool_calls, mock.Mock(id=7))
+        elapsed = time.monotonic() - start
+
+        self.assertLess(elapsed, 0.55)
+        self.assertEqual(outputs, [
+            "Tool update_weather_forecast executed: update_weather_forecast done for trip 7",
+            "Tool update_activities executed: update_activities done for trip 7",
+            "Tool book_flights not found.",
+            "Tool update_packing_list timed out after 0.1 seconds; that section was not updated.",
+            "Tool update_complete_trip_plan executed: update_complete_trip_plan done for trip 7",
+        ])
+        # The complete plan is built from the other sections, so it waits for them.
+        self.assertEqual(log[-2:], [("start", "update_complete_trip_plan"), ("end", "update_complete_trip_plan")])
+
+
+@override_settings(
+    PLANNER_BRANCH_EXECUTION="thread_sensitive", PLANNER_CHAT_HISTORY_TURNS=2, PLANNER_CHAT_SUMMARY_BATCH=2,
+    PLANNER_CHAT_HISTORY_TOKENS=100, PLANNER_CHAT_SUMMARY_TOKENS=20,
+)
+class ChatMemoryTests(TripTestCase):
+    def add_turns(self, count):
+        start = ChatMessage.objects.filter(trip=self.trip).count()
+        for n in range(start, start + count):
+            ChatMessage.objects.create(
+                trip=self.trip, question=f"question {n}", response=f"<p><strong>answer</strong> {n}</p>",
+                response_markdown=f"**answer** {n}",
+            )
+
+    def test_old_turns_are_folded_into_the_summary_a_batch_at_a_time(self):
+        summarise = mock.AsyncMock(return_value=AIMessage(content="Traveller prefers trams. " * 20))
+        self.add_turns(3)
+        with mock.patch.object(chat_memory, "ainvoke_llm", summarise):
+            self.assertFalse(async_to_sync(chat_memory.update_chat_summary)(self.trip.id))
+            self.add_turns(1)
+            self.assertTrue(async_to_sync(chat_memory.update_chat_summary)(self.trip.id))
+        self.assertEqual(summarise.await_count, 1)
+        prompt = summarise.await_args.args[0][0].content
+        self.assertIn("Traveller: question 1\nAssistant: **answer** 1", prompt)
+        self.assertNotIn("question 2", prompt)
+
+        memory = chat_memory.load_chat_memory(self.trip.id)
+        self.assertTrue(memory["chat_summary"].startswith("Traveller prefers trams."))
+        self.assertLessEqual(chat_memory.estimate_tokens(memory["chat_summary"]), 22)
+        self.assertEqual([message["content"] for message in memory["chat_history"]],
+                         ["question 2", "**answer** 2", "question 3", "**answer** 3"])
+
+    @override_settings(PLANNER_CHAT_SUMMARY_FOLD_TOKENS=12)
+    def test_a_long_backlog_of_turns_is_folded_a_budget_at_a_time(self):
+        summarise = mock.AsyncMock(return_value=AIMessage(content="Traveller prefers trams."))
+        self.add_turns(8)
+        with mock.patch.object(chat_memory, "ainvoke_llm", summarise):
+            self.assertTrue(async_to_sync(chat_memory.update_chat_summary)(self.trip.id))
+            first = summarise.await_args.args[0][0].content
+            self.assertTrue(async_to_sync(chat_memory.update_chat_summary)(self.trip.id))
+            second = summarise.await_args.args[0][0].content
+        self.assertIn("question 1", first)
+        self.assertNotIn("question 2", first)
+        self.assertIn("question 2", second)
+        self.assertNotIn("question 1", second)
+
+    def test_history_is_trimmed_oldest_first_to_the_token_budget(self):
+        self.add_turns(3)
+        ChatMessage.objects.filter(trip=self.trip, question="question 0").update(response_markdown="x" * 400)
+
+        memory = chat_memory.load_chat_memory(self.trip.id)
+        self.assertEqual(memory["chat_summary"], "")
+        self.assertEqual([message["content"] for message in memory["chat_history"][::2]], ["question 1", "question 2"])
+
+    def test_replies_keep_the_model_text_for_history_and_html_for_the_page(self):
+        reply = "Try **pastéis** at:\n\n| Place | Area |\n|---|---|\n| Manteigaria | Chiado |"
+        async_to_sync(langgraph_logic.save_chat_reply)(self.trip, "Where to eat?", reply)
+
+        message = ChatMessage.objects.get(trip=self.trip)
+        self.assertIn("<table>", message.response)
+        self.assertEqual(message.response_markdown, reply)
+        self.assertEqual(chat_memory.load_chat_memory(self.trip.id)["chat_history"][1]["content"], reply)
+
+    def test_migration_backfills_existing_answers_without_markup(self):
+        backfill = importlib.import_module("planner.migrations.0013_chatmessage_response_markdown").backfill_response_markdown
+        ChatMessage.objects.create(trip=self.trip, question="Hi", response="<p>Fish &amp; chips<br />\nin <em>Belém</em></p>")
+
+        backfill(django_apps, None)
+        self.assertEqual(ChatMessage.objects.get(trip=self.trip).response_markdown, "Fish & chips\nin Belém")
+
+
+@override_settings(PLANNER_BRANCH_EXECUTION="thread_sensitive", PLANNER_RAG_PLAIN_MAX_WORDS=4)
+class ChatRetrievalTests(PlannerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+
+    def test_router_skips_hyde_unless_the_question_needs_it(self):
+        for query, route in [
+            ("Thanks so much!", rag_logic.NO_RETRIEVAL),
+            ("ok", rag_logic.NO_RETRIEVAL),
+            ("Give me a new packing list", rag_logic.NO_RETRIEVAL),
+            ("Please update the itinerary for day 2", rag_logic.NO_RETRIEVAL),
+            ("Lisbon street food", rag_logic.PLAIN),
+            ("What did I do on my last beach holiday?", rag_logic.HYDE),
+        ]:
+            self.assertEqual(rag_logic.route_query(query), route, query)
+
+    def test_hypothetical_documents_are_cached_per_user_until_their_trips_change(self):
+        generate = mock.AsyncMock(return_value=AIMessage(content="Three relaxed days in Lisbon."))
+        search = mock.Mock(return_value=["Trip to Lisbon for 3 days."])
+        question = "What should I pack for a rainy city break?"
+
+        with mock.patch.object(rag_logic, "ainvoke_llm", generate), mock.patch.object(rag_logic, "search_trips", search):
+            retrieve = async_to_sync(rag_logic.retrieve_trip_context)
+            self.assertEqual(retrieve(question, user_id=self.user.id), ["Trip to Lisbon for 3 days."])
+            retrieve("what should I pack for a RAINY city break", user_id=self.user.id)
+            self.assertEqual(generate.await_count, 1)
+            retrieve(question, user_id=self.user.id + 1)
+            self.assertEqual(generate.await_count, 2)
+
+            create_trip(self.user, destination="Porto", month="June", duration=2, num_people="1", budget_type="low")
+            retrieve(question, user_id=self.user.id)
+            self.assertEqual(generate.await_count, 3)
+
+            # Agents write their sections through save_trip_fields, which saves without the owner loaded.
+            langgraph_logic.save_trip_fields(Trip.objects.get(user=self.user).id, packing_list="<ul><li>Raincoat</li></ul>")
+            retrieve(question, user_id=self.user.id)
+            self.assertEqual(generate.await_count, 4)
+
+            self.assertEqual(retrieve("thanks!", user_id=self.user.id), [])
+            retrieve("Lisbon street food", user_id=self.user.id)
+            self.assertEqual(generate.await_count, 4)
+        search.assert_called_with("Lisbon street food", self.user.id, 3)
+
+
+class TripIndexTests(PlannerTestCase):
+    def setUp(self):
+        super().setUp()
+        # An in-process Chroma stands in for the server, one per test.
+        directory = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+        self.addCleanup(directory.cleanup)
+        server = mock.patch.object(rag_logic.chromadb, "HttpClient", lambda host, port: chromadb.PersistentClient(path=directory.name))
+        server.start()
+        self.addCleanup(server.stop)
+        collections = mock.patch.dict(rag_logic._collections, clear=True)
+        collections.start()
+        self.addCleanup(collections.stop)
+        self.embed = mock.Mock(side_effect=lambda texts: [[float(len(text)), 1.0, 0.5] for text in texts])
+        model = mock.patch.object(rag_logic.embeddings, "model", mock.Mock(spec=["model", "embed_documents"], model="llama3", embed_documents=self.embed))
+        model.start()
+        self.addCleanup(model.stop)
+        self.user = create_user()
+        # The test's data is not committed, so run the background refresh on its connection.
+        background = mock.patch.object(signals, "run_in_background", side_effect=lambda func, *args: func(*args))
+        self.run_in_background = background.start()
+        self.addCleanup(background.stop)
+
+    def create_trip(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return create_trip(self.user)
+
+    def test_trips_are_indexed_on_save_and_only_reembedded_when_their_document_changes(self):
+        trip = self.create_trip()
+        self.run_in_background.assert_called_once_with(signals.reindex_trip, trip.id)
+        self.assertEqual(self.embed.call_count, 1)
+        self.assertEqual(rag_logic.search_trips("Lisbon", self.user.id), ["Trip to Lisbon for 3 days.\n"])
+        self.embed.reset_mock()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            langgraph_logic.save_trip_fields(trip.id, packing_list="<ul><li>Umbrella</li></ul>")
+            trip.save()
+        self.embed.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            langgraph_logic.save_trip_fields(trip.id, itinerary=json.dumps(FAKE_ITINERARY))
+        self.assertEqual(self.embed.call_count, 1)
+        indexed = rag_logic.trip_collection().get(ids=[str(trip.id)], include=["documents", "metadatas"])
+        self.assertIn("Walk through the old town", indexed["documents"][0])
+        self.assertEqual(indexed["metadatas"][0]["content_hash"], rag_logic.content_hash(indexed["documents"][0]))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            trip.delete()
+        self.assertEqual(rag_logic.trip_collection().get(ids=[str(trip.id)])["ids"], [])
+
+    @override_settings(PLANNER_CHROMA_HOST="")
+    def test_the_index_requires_a_chroma_server(self):
+        with self.assertRaises(ImproperlyConfigured):
+            rag_logic.trip_collection()
+        self.assertEqual([error.id for error in checks.chroma_server_configured(None)], ["planner.E001"])
+
+    def test_full_reindex_skips_unchanged_trips_and_drops_deleted_ones(self):
+        kept = self.create_trip()
+        Trip.objects.filter(id=kept.id).update(comments="Prefers trams")
+        rag_logic.trip_collection().upsert(ids=["999"], documents=["Trip to nowhere"], metadatas=[{"trip_id": 999, "user_id": self.user.id}])
+        self.embed.reset_mock()
+
+        self.assertEqual(rag_logic.index_trips(), {"trips": 1, "embedded": 1, "removed": 1})
+        self.assertEqual(self.embed.call_count, 1)
+        self.assertEqual(rag_logic.index_trips(), {"trips": 1, "embedded": 0, "removed": 0})
+        self.assertEqual(self.embed.call_count, 1)
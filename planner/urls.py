@@ -10,7 +10,11 @@ urlpatterns = [
     path('create_paid_trip/', views.create_paid_trip, name='create_paid_trip'),
     path('trip_detail/<int:trip_id>/', views.trip_detail, name='trip_detail'),
     path('process_trip/<int:trip_id>/', views.process_trip, name='process_trip'),
+    path('trip/<int:trip_id>/generation_status/', views.generation_status, name='generation_status'),
+    path('trip/<int:trip_id>/generation_stream/', views.generation_stream, name='generation_stream'),
     path('trip/<int:trip_id>/chat/', views.chat_with_agent, name='chat_with_agent'),
+    path('trip/<int:trip_id>/chat/stream/', views.stream_chat_with_agent, name='stream_chat_with_agent'),
+    path('trip/<int:trip_id>/trip_plan/stream/', views.stream_trip_plan, name='stream_trip_plan'),
     path('trip/<int:trip_id>/start_journey/', views.start_journey, name='start_journey'),
     path('get_realtime_weather/', views.get_realtime_weather, name='get_realtime_weather'),
     path('trip/<int:trip_id>/download_pdf/', views.download_trip_pdf, name='download_trip_pdf'),
@@ -11,4 +11,47 @@ def convert_markdown_to_html(markdown_text):
         'nl2br',        # For newline to <br> conversion
         'extra',        # A collection of common extensions
     ]
-    return markdown.markdown(markdown_text, extensions=extensions)
\ No newline at end of file
+    return markdown.markdown(markdown_text, extensions=extensions)
+
+
+class MarkdownBlockBuffer:
+    """
+    Collects streamed markdown and hands it back one finished block at a time.
+
+    A block ends at a blank line outside a fenced code block, so tables, lists
+    and code are only released once complete and render on their own. Blocks
+    rendered separately can differ slightly from the whole document (e.g. loose
+    lists), so render the assembled text again once the stream is done.
+    """
+
+    def __init__(self):
+        self.pending = ""
+
+    def feed(self, text):
+        """Adds streamed text; returns the markdown of any blocks it completed, or ''."""
+        self.pending += text
+        boundary = self._last_boundary()
+        if boundary is None:
+            return ""
+        ready, self.pending = self.pending[:boundary], self.pending[boundary:]
+        return ready if ready.strip() else ""
+
+    def flush(self):
+        """Returns whatever is left once the stream has ended."""
+        rest, self.pending = self.pending, ""
+        return rest if rest.strip() else ""
+
+    def _last_boundary(self):
+        in_fence = False
+        boundary = None
+        position = 0
+        for line in self.pending.splitlines(keepends=True):
+            if not line.endswith("\n"):
+                break
+            position += len(line)
+            stripped = line.strip()
+            if stripped.startswith(("```", "~~~")):
+                in_fence = not in_fence
+            elif not stripped and not in_fence:
+                boundary = position
+        return boundary
@@ -1,11 +1,17 @@
 from django.shortcuts import render, redirect, get_object_or_404
 import traceback
 import asyncio
+import functools
 from django.contrib.auth.decorators import login_required
 from .models import Trip, ChatMessage, Checkpoint, Feedback
 from .forms import TripForm
-from .langgraph_logic import graph, generate_itinerary, recommend_activities_agent, fetch_useful_links_agent, weather_forecaster_agent, packing_list_generator_agent, food_culture_recommender_agent, chat_agent, accommodation_recommender_agent, expense_breakdown_agent, complete_trip_plan_agent, generate_complete_trip_automatically
-from django.http import JsonResponse, HttpResponse
+from .admission import admission_controlled
+from .idempotency import idempotent, new_idempotency_key, single_flight
+from .breakers import openweathermap_breaker
+from .caching import SQLiteCache, make_key, normalize_query
+from .jobs import REPAIR, enqueue_generation, latest_job, job_status, sse_message, stream_job_events
+from .langgraph_logic import graph, generate_itinerary, recommend_activities_agent, fetch_useful_links_agent, weather_forecaster_agent, packing_list_generator_agent, food_culture_recommender_agent, chat_agent, accommodation_recommender_agent, expense_breakdown_agent, complete_trip_plan_agent, generate_complete_trip_automatically, run_agent_standalone, stream_chat_agent, stream_complete_trip_plan
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 import json
 from django.urls import reverse
 from django.views.decorators.http import require_POST
@@ -27,6 +33,7 @@ def dashboard(request):
     return render(request, 'planner/dashboard.html')
 
 @login_required
+@idempotent
 async def create_trip(request):
     form = TripForm()
     payment_required = False
@@ -53,13 +60,8 @@ async def create_trip(request):
             trip.user = request.user
             await sync_to_async(trip.save)()
             
-            inputs = {"trip_id": trip.id}
-            try:
-                # Await the completion of the trip generation before redirecting
-                await generate_complete_trip_automatically(inputs)
-                await sync_to_async(trip.refresh_from_db)()
-            except Exception as e:
-                print(f"Error generating complete trip automatically: {e}")
+            # Generation runs in a worker; the trip page polls its progress.
+            await sync_to_async(enqueue_generation)(trip.id)
             
             return redirect('planner:trip_detail', trip_id=trip.id)
     
@@ -70,10 +72,12 @@ async def create_trip(request):
         'payment_required': payment_required,
         'trip_data': json.dumps(trip_data) if trip_data else '{}',
         'remaining_free_itineraries': remaining_free_itineraries,
+        'idempotency_key': new_idempotency_key(),
     })
 
 @login_required
 @require_POST
+@idempotent
 async def create_paid_trip(request):
     form = TripForm(request.POST)
     if form.is_valid():
@@ -86,9 +90,7 @@ async def create_paid_trip(request):
             trip.user = request.user
             await sync_to_async(trip.save)()
             
-            state = {"trip_id": trip.id}
-            await generate_complete_trip_automatically(state)
-            await sync_to_async(trip.refresh_from_db)()
+            await sync_to_async(enqueue_generation)(trip.id)
 
             return JsonResponse({'status': 'success', 'redirect_url': reverse('planner:trip_detail', kwargs={'trip_id': trip.id})})
         else:
@@ -139,10 +141,35 @@ def trip_detail(request, trip_id):
         'daily_checkpoints_data': daily_checkpoints_data,
         'checkpoint_weather_data': checkpoint_weather_data,
         'has_been_reviewed': trip.has_been_reviewed,
+        'generation_job': latest_job(trip.id),
     }
     return render(request, 'planner/trip_detail_interactive.html', context)
 
 @login_required
+def generation_status(request, trip_id):
+    trip = get_object_or_404(Trip, id=trip_id, user=request.user)
+    return JsonResponse(job_status(latest_job(trip.id)))
+
+@login_required
+async def generation_stream(request, trip_id):
+    """Server-Sent Events feed of node-level progress for the trip's latest generation job."""
+    user = await request.auser()
+    trip = await sync_to_async(get_object_or_404)(Trip, id=trip_id, user=user)
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or 0)
+    except ValueError:
+        last_event_id = 0
+    response = StreamingHttpResponse(stream_job_events(trip.id, last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+# Parts of an agent result that process_trip passes on; shared with requests attached to the same run.
+AGENT_RESULT_KEYS = ('warning', 'warnings', 'repaired_nodes', 'pending_nodes')
+
+@login_required
+@idempotent
+@admission_controlled
 async def process_trip(request, trip_id):
     trip = await sync_to_async(Trip.objects.get)(id=trip_id, user=request.user)
     if request.method == 'POST':
@@ -152,6 +179,7 @@ async def process_trip(request, trip_id):
         agent_functions = {
             "generate_itinerary": generate_itinerary,
             "generate_complete_trip": generate_complete_trip_automatically,
+            "repair_trip": functools.partial(generate_complete_trip_automatically, repair=True),
             "recommend_activities": recommend_activities_agent,
             "fetch_useful_links": fetch_useful_links_agent,
             "weather_forecaster": weather_forecaster_agent,
@@ -168,17 +196,26 @@ async def process_trip(request, trip_id):
         if not selected_agent_function:
             return JsonResponse({'status': 'error', 'message': 'Invalid agent name provided.'})
 
-        state = {
-            "trip_id": trip.id, "preferences_text": "", "itinerary": trip.itinerary,
-            "activity_suggestions": trip.activity_suggestions, "useful_links": trip.useful_links,
-            "weather_forecast": trip.weather_forecast, "packing_list": trip.packing_list,
-            "food_culture_info": trip.food_culture_info, "accommodation_info": trip.accommodation_info,
-            "expense_breakdown": trip.expense_breakdown,
-            "chat_history": [], "user_question": user_question, "chat_response": "",
-        }
+        # Agents load the trip preferences themselves; outputs are read back from the row below.
+        state = {"trip_id": trip.id, "user_question": user_question, "chat_history": []}
+
+        async def run_agent():
+            if agent_name in ("generate_complete_trip", "repair_trip", "chat"):
+                # The graph persists its own outputs; chat stores a ChatMessage.
+                result = await selected_agent_function(state)
+            else:
+                result = await run_agent_standalone(selected_agent_function, state)
+            if not isinstance(result, dict):
+                return {}
+            return {key: result[key] for key in AGENT_RESULT_KEYS if key in result}
+
+        # Identical requests for this trip made while one is running wait for it instead of starting another.
+        flight_key = f"process_trip:{trip.id}:{agent_name}"
+        if agent_name == "chat":
+            flight_key += f":{make_key(user_question)}"
 
         try:
-            result = await selected_agent_function(state)
+            result = await single_flight(flight_key, run_agent)
             await sync_to_async(trip.refresh_from_db)()
             
             last_chat_message = await sync_to_async(trip.chatmessage_set.last)()
@@ -194,10 +231,16 @@ async def process_trip(request, trip_id):
                 'expense_breakdown': trip.expense_breakdown,
                 'chat_response': last_chat_message.response if last_chat_message else ''
             }
-            if isinstance(result, dict) and "warning" in result:
+            if "warning" in result:
                 response_data["warning"] = result["warning"]
-            if isinstance(result, dict) and "warnings" in result:
+            if "warnings" in result:
                 response_data["warnings"] = result["warnings"]
+            if "repaired_nodes" in result:
+                response_data["repaired_nodes"] = result["repaired_nodes"]
+            if result.get("pending_nodes"):
+                # Nodes that missed the deadline are backfilled in the background.
+                await sync_to_async(enqueue_generation)(trip.id, REPAIR)
+                response_data["pending_nodes"] = result["pending_nodes"]
             return JsonResponse(response_data)
         except Exception as e:
             print(f"Error in process_trip: {e}")
@@ -205,26 +248,54 @@ async def process_trip(request, trip_id):
             return JsonResponse({'status': 'error', 'message': str(e)})
     return JsonResponse({'status': 'error', 'message': 'Invalid request method'})
 
+async def _agent_event_stream(events):
+    """Turns ("delta" | "done" | "error", text) pairs from a streaming agent into Server-Sent Events."""
+    try:
+        async for event, text in events:
+            yield sse_message(event, {'message': text} if event == 'error' else {'html': text})
+    except Exception as e:
+        print(f"Error while streaming agent output: {e}")
+        print(traceback.format_exc())
+        yield sse_message('error', {'message': str(e)})
+
+def _event_stream_response(events):
+    response = StreamingHttpResponse(_agent_event_stream(events), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@login_required
+@require_POST
+@admission_controlled
+async def stream_chat_with_agent(request, trip_id):
+    """Like chat_with_agent, but streams the answer as rendered HTML blocks while it is written."""
+    user = await request.auser()
+    trip = await sync_to_async(get_object_or_404)(Trip, id=trip_id, user=user)
+    state = {
+        "trip_id": trip.id,
+        "user_question": request.POST.get('user_question', ''),
+        "chat_response": "",
+    }
+    return _event_stream_response(stream_chat_agent(state))
+
+@login_required
+@require_POST
+@admission_controlled
+async def stream_trip_plan(request, trip_id):
+    """Streams the complete day-by-day trip plan as it is generated; the full plan is saved at the end."""
+    user = await request.auser()
+    trip = await sync_to_async(get_object_or_404)(Trip, id=trip_id, user=user)
+    return _event_stream_response(stream_complete_trip_plan({"trip_id": trip.id}))
+
 @login_required
+@admission_controlled
 async def chat_with_agent(request, trip_id):
     trip = await sync_to_async(Trip.objects.get)(id=trip_id, user=request.user)
     if request.method == 'POST':
         user_question = request.POST.get('user_question')
-        
-        # Load chat history
-        chat_history_messages = await sync_to_async(list)(
-            ChatMessage.objects.filter(trip=trip).order_by('created_at')
-        )
-        
-        chat_history_for_state = []
-        for msg in chat_history_messages:
-            chat_history_for_state.append({"role": "user", "content": msg.question})
-            chat_history_for_state.append({"role": "assistant", "content": msg.response})
-
         state = {
             "trip_id": trip.id,
             "user_question": user_question,
-            "chat_history": chat_history_for_state,
             "chat_response": "",
         }
 
@@ -314,6 +385,34 @@ def submit_checkpoint_feedback(request, trip_id, checkpoint_id):
         return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
 
 # Helper functions for weather and progress tracking
+OPENWEATHERMAP_URL = "https://api.openweathermap.org/data/2.5/weather"
+
+# The last good answer per place, served (marked stale) while OpenWeatherMap is down.
+weather_fallback = SQLiteCache("fallback:openweathermap", ttl=settings.PLANNER_BREAKER_FALLBACK_TTL, max_entries=5000)
+
+def fetch_openweathermap(params):
+    """GETs current weather through the OpenWeatherMap circuit breaker; 5xx and 429 responses count as failures."""
+    def get():
+        response = requests.get(OPENWEATHERMAP_URL, params=params, timeout=10)
+        if response.status_code >= 500 or response.status_code == 429:
+            response.raise_for_status()
+        return response
+    return openweathermap_breaker.call(get)
+
+def remember_weather(cache_key, weather_data):
+    try:
+        weather_fallback.set(cache_key, weather_data)
+    except Exception as e:
+        print(f"Could not store fallback weather: {e}")
+
+def last_known_weather(cache_key):
+    try:
+        weather_data = weather_fallback.get(cache_key)
+    except Exception as e:
+        print(f"Fallback weather lookup failed: {e}")
+        return None
+    return {**weather_data, 'stale': True} if weather_data else None
+
 def get_weather_by_coords(latitude, longitude):
     """Get current weather for given coordinates using OpenWeatherMap API"""
     import requests
@@ -323,8 +422,8 @@ def get_weather_by_coords(latitude, longitude):
     if not api_key:
         return None
     
+    cache_key = make_key('coords', round(latitude, 2), round(longitude, 2))
     try:
-        base_url = "https://api.openweathermap.org/data/2.5/weather"
         params = {
             'lat': latitude,
             'lon': longitude,
@@ -332,7 +431,7 @@ def get_weather_by_coords(latitude, longitude):
             'units': 'metric'
         }
         
-        response = requests.get(base_url, params=params, timeout=10)
+        response = fetch_openweathermap(params)
         
         if response.status_code == 200:
             data = response.json()
@@ -346,6 +445,7 @@ def get_weather_by_coords(latitude, longitude):
                 'location_name': data['name'],
                 'country': data['sys']['country']
             }
+            remember_weather(cache_key, weather_data)
             return weather_data
         else:
             return {
@@ -360,7 +460,7 @@ def get_weather_by_coords(latitude, longitude):
             }
     except Exception as e:
         print(f"Error fetching weather by coords: {e}")
-        return None
+        return last_known_weather(cache_key)
 
 def get_current_weather(destination):
     """Get current weather for destination using OpenWeatherMap API"""
@@ -371,15 +471,15 @@ def get_current_weather(destination):
     if not api_key:
         return None
     
+    cache_key = make_key('city', normalize_query(destination))
     try:
-        base_url = "https://api.openweathermap.org/data/2.5/weather"
         params = {
             'q': destination,
             'appid': api_key,
             'units': 'metric'
         }
         
-        response = requests.get(base_url, params=params, timeout=10)
+        response = fetch_openweathermap(params)
         
         if response.status_code == 200:
             data = response.json()
@@ -393,6 +493,7 @@ def get_current_weather(destination):
                 'city': data['name'],
                 'country': data['sys']['country']
             }
+            remember_weather(cache_key, weather_data)
             return weather_data
         else:
             # Fallback to dummy data if API fails
@@ -408,7 +509,7 @@ def get_current_weather(destination):
             }
     except Exception as e:
         print(f"Weather API error: {e}")
-        return None
+        return last_known_weather(cache_key)
 
 def calculate_trip_progress(trip):
     """Calculate trip progress based on existing itinerary data"""
@@ -146,4 +146,163 @@ LOGIN_REDIRECT_URL = '/planner/dashboard/'
 
 # Razorpay Settings
 RAZORPAY_KEY_ID = os.getenv('RAZORPAY_KEY_ID')
-RAZORPAY_KEY_SECRET = os.getenv('RAZORPAY_KEY_SECRET')
\ No newline at end of file
+RAZORPAY_KEY_SECRET = os.getenv('RAZORPAY_KEY_SECRET')
+
+# Planner agent execution
+# "executor" runs blocking work of the graph nodes (ORM calls, markdown
+# rendering) on a dedicated bounded pool so the parallel branches overlap;
+# "thread_sensitive" queues it all on Django's single shared sync thread.
+PLANNER_BRANCH_EXECUTION = os.getenv('PLANNER_BRANCH_EXECUTION', 'executor')
+PLANNER_BLOCKING_WORKERS = int(os.getenv('PLANNER_BLOCKING_WORKERS', 12))
+# Threads for follow-up work started after a response, such as folding old
+# chat turns into the trip's summary.
+PLANNER_BACKGROUND_WORKERS = int(os.getenv('PLANNER_BACKGROUND_WORKERS', 2))
+# Per-query timeout (seconds) for the web searches generate_itinerary fans out.
+PLANNER_ITINERARY_SEARCH_TIMEOUT = float(os.getenv('PLANNER_ITINERARY_SEARCH_TIMEOUT', 8))
+# Seconds each graph node may run (0 for no limit), with per-node overrides
+# given as "node=seconds,node=seconds". A generation run gets
+# PLANNER_GENERATION_DEADLINE seconds overall; nodes still running then are
+# left pending and backfilled by a repair job.
+PLANNER_NODE_TIMEOUT = float(os.getenv('PLANNER_NODE_TIMEOUT', 90))
+PLANNER_NODE_TIMEOUTS = {
+    name.strip(): float(seconds)
+    for name, seconds in (item.split('=') for item in os.getenv('PLANNER_NODE_TIMEOUTS', '').split(',') if item.strip())
+}
+PLANNER_GENERATION_DEADLINE = float(os.getenv('PLANNER_GENERATION_DEADLINE', 240))
+
+# Tools a chat turn calls run concurrently, up to PLANNER_CHAT_TOOL_CONCURRENCY
+# at a time, each bounded by PLANNER_CHAT_TOOL_TIMEOUT seconds (0 for no limit)
+# or its "tool=seconds" override in PLANNER_CHAT_TOOL_TIMEOUTS.
+PLANNER_CHAT_TOOL_CONCURRENCY = int(os.getenv('PLANNER_CHAT_TOOL_CONCURRENCY', 4))
+PLANNER_CHAT_TOOL_TIMEOUT = float(os.getenv('PLANNER_CHAT_TOOL_TIMEOUT', 90))
+PLANNER_CHAT_TOOL_TIMEOUTS = {
+    name.strip(): float(seconds)
+    for name, seconds in (
+        item.split('=') for item in os.getenv('PLANNER_CHAT_TOOL_TIMEOUTS', 'generate_full_trip_plan=300,repair_trip_plan=300').split(',') if item.strip()
+    )
+}
+
+# Trip chat memory: the prompt carries the last PLANNER_CHAT_HISTORY_TURNS
+# turns verbatim (at most PLANNER_CHAT_HISTORY_TOKENS estimated tokens,
+# summary included) and a rolling summary of everything before them, refreshed
+# once PLANNER_CHAT_SUMMARY_BATCH older turns have piled up and capped at
+# PLANNER_CHAT_SUMMARY_TOKENS. A single fold reads at most
+# PLANNER_CHAT_SUMMARY_FOLD_TOKENS of old turns, so a long conversation
+# without a summary yet is caught up over several folds. Retrieved trip
+# context is capped at PLANNER_CHAT_CONTEXT_TOKENS.
+PLANNER_CHAT_HISTORY_TURNS = int(os.getenv('PLANNER_CHAT_HISTORY_TURNS', 6))
+PLANNER_CHAT_SUMMARY_BATCH = int(os.getenv('PLANNER_CHAT_SUMMARY_BATCH', 4))
+PLANNER_CHAT_HISTORY_TOKENS = int(os.getenv('PLANNER_CHAT_HISTORY_TOKENS', 3000))
+PLANNER_CHAT_SUMMARY_TOKENS = int(os.getenv('PLANNER_CHAT_SUMMARY_TOKENS', 400))
+PLANNER_CHAT_SUMMARY_FOLD_TOKENS = int(os.getenv('PLANNER_CHAT_SUMMARY_FOLD_TOKENS', 6000))
+PLANNER_CHAT_CONTEXT_TOKENS = int(os.getenv('PLANNER_CHAT_CONTEXT_TOKENS', 2000))
+
+# Provider calls (Gemini, Serper) are retried with jittered exponential
+# backoff. Retries per provider are capped at PLANNER_RETRY_BUDGET_RATIO of
+# recent calls (plus PLANNER_RETRY_BUDGET_MIN) so outages are not amplified.
+# Hedged calls (the itinerary) send a duplicate request once they run past
+# the call site's p95 latency, or PLANNER_HEDGE_AFTER seconds until that is known.
+PLANNER_RETRY_ATTEMPTS = int(os.getenv('PLANNER_RETRY_ATTEMPTS', 3))
+PLANNER_RETRY_BASE_DELAY = float(os.getenv('PLANNER_RETRY_BASE_DELAY', 0.5))
+PLANNER_RETRY_MAX_DELAY = float(os.getenv('PLANNER_RETRY_MAX_DELAY', 10))
+PLANNER_RETRY_BUDGET_RATIO = float(os.getenv('PLANNER_RETRY_BUDGET_RATIO', 0.2))
+PLANNER_RETRY_BUDGET_MIN = int(os.getenv('PLANNER_RETRY_BUDGET_MIN', 5))
+PLANNER_HEDGE_AFTER = float(os.getenv('PLANNER_HEDGE_AFTER', 45))
+
+# Local SQLite file holding the planner's provider caches. It is shared by all
+# workers on the host and survives restarts.
+PLANNER_CACHE_DB = os.getenv('PLANNER_CACHE_DB', str(BASE_DIR / 'planner_cache.sqlite3'))
+PLANNER_SEARCH_CACHE_TTL = int(os.getenv('PLANNER_SEARCH_CACHE_TTL', 60 * 60 * 24))
+PLANNER_SEARCH_CACHE_MAX_ENTRIES = int(os.getenv('PLANNER_SEARCH_CACHE_MAX_ENTRIES', 20000))
+PLANNER_ARTIFACT_CACHE_TTL = int(os.getenv('PLANNER_ARTIFACT_CACHE_TTL', 60 * 60 * 24 * 7))
+PLANNER_ARTIFACT_CACHE_MAX_ENTRIES = int(os.getenv('PLANNER_ARTIFACT_CACHE_MAX_ENTRIES', 5000))
+PLANNER_HYDE_CACHE_TTL = int(os.getenv('PLANNER_HYDE_CACHE_TTL', 60 * 60 * 24 * 7))
+PLANNER_HYDE_CACHE_MAX_ENTRIES = int(os.getenv('PLANNER_HYDE_CACHE_MAX_ENTRIES', 5000))
+
+# Chat retrieval skips past trips for small talk and plan commands, and
+# searches with the question itself (no HyDE model call) when it is a keyword
+# query of at most PLANNER_RAG_PLAIN_MAX_WORDS words.
+PLANNER_RAG_PLAIN_MAX_WORDS = int(os.getenv('PLANNER_RAG_PLAIN_MAX_WORDS', 4))
+
+# Vector index of trips for chat retrieval. It lives in a Chroma server
+# (`chroma run`), so the web server and every generation worker read and write
+# the same index; the planner refuses to start without one configured.
+PLANNER_CHROMA_HOST = os.getenv('PLANNER_CHROMA_HOST', 'localhost')
+PLANNER_CHROMA_PORT = int(os.getenv('PLANNER_CHROMA_PORT', 8001))
+# Refresh a trip's index entry in the background whenever it is saved. With
+# this off, run `manage.py index_trips` periodically instead.
+PLANNER_INDEX_TRIPS_ON_SAVE = os.getenv('PLANNER_INDEX_TRIPS_ON_SAVE', 'True') == 'True'
+
+# LangGraph snapshots of generation runs, kept on disk so failed runs can resume.
+# Compact with `manage.py compact_checkpoints`.
+PLANNER_CHECKPOINT_DB = os.getenv('PLANNER_CHECKPOINT_DB', str(BASE_DIR / 'planner_checkpoints.sqlite3'))
+PLANNER_CHECKPOINT_MAX_AGE = int(os.getenv('PLANNER_CHECKPOINT_MAX_AGE', 60 * 60 * 24 * 7))
+PLANNER_CHECKPOINT_MAX_PER_THREAD = int(os.getenv('PLANNER_CHECKPOINT_MAX_PER_THREAD', 20))
+# Agent outputs larger than this (JSON bytes) travel through the graph as
+# references into a content-addressed store instead of inline state.
+PLANNER_ARTIFACT_INLINE_BYTES = int(os.getenv('PLANNER_ARTIFACT_INLINE_BYTES', 512))
+# Artifacts no snapshot refers to are dropped after every run, except those
+# written in the last PLANNER_ARTIFACT_ORPHAN_GRACE seconds (a run in flight
+# may not have checkpointed its reference yet).
+PLANNER_ARTIFACT_ORPHAN_GRACE = int(os.getenv('PLANNER_ARTIFACT_ORPHAN_GRACE', 600))
+
+# Background trip generation (see `manage.py run_generation_worker`)
+PLANNER_JOB_MAX_ATTEMPTS = int(os.getenv('PLANNER_JOB_MAX_ATTEMPTS', 3))
+PLANNER_JOB_LEASE_SECONDS = int(os.getenv('PLANNER_JOB_LEASE_SECONDS', 300))
+PLANNER_JOB_RETRY_DELAY = int(os.getenv('PLANNER_JOB_RETRY_DELAY', 30))
+
+# Server-Sent Events progress stream for running generation jobs
+PLANNER_PROGRESS_STREAM_TIMEOUT = int(os.getenv('PLANNER_PROGRESS_STREAM_TIMEOUT', 900))
+PLANNER_PROGRESS_POLL_INTERVAL = float(os.getenv('PLANNER_PROGRESS_POLL_INTERVAL', 1.0))
+
+# Per-node timings and critical path of every generation run (see `manage.py critical_path_report`)
+PLANNER_RECORD_RUN_PROFILES = os.getenv('PLANNER_RECORD_RUN_PROFILES', 'True') == 'True'
+
+# Circuit breakers for Serper, OpenWeatherMap, NewsData.io and Ollama (see
+# `manage.py circuit_breakers`): after PLANNER_BREAKER_FAILURE_THRESHOLD
+# consecutive failures calls fail fast for PLANNER_BREAKER_RESET_TIMEOUT
+# seconds, then one probe call decides whether to close again. Weather falls
+# back to the last good answer, kept for PLANNER_BREAKER_FALLBACK_TTL seconds.
+PLANNER_BREAKER_FAILURE_THRESHOLD = int(os.getenv('PLANNER_BREAKER_FAILURE_THRESHOLD', 5))
+PLANNER_BREAKER_RESET_TIMEOUT = float(os.getenv('PLANNER_BREAKER_RESET_TIMEOUT', 30))
+PLANNER_BREAKER_FALLBACK_TTL = int(os.getenv('PLANNER_BREAKER_FALLBACK_TTL', 60 * 60 * 6))
+
+# Provider quotas, enforced across all workers on the host (see planner/ratelimit.py).
+# Comma separated `bucket=count/period[:burst]`, period one of s, min, h. A bucket
+# is a provider ("gemini", "serper"), a Gemini model ("gemini/gemini-2.5-pro")
+# or a Serper endpoint ("serper/places"). Calls over the limit queue for up to
+# PLANNER_RATE_LIMIT_MAX_WAIT seconds, then fail.
+PLANNER_RATE_LIMITS = {
+    name.strip(): limit.strip()
+    for name, limit in (
+        item.split('=') for item in os.getenv('PLANNER_RATE_LIMITS', 'gemini/gemini-2.5-pro=150/min:10,serper=5/s').split(',') if item.strip()
+    )
+}
+PLANNER_RATE_LIMIT_MAX_WAIT = float(os.getenv('PLANNER_RATE_LIMIT_MAX_WAIT', 20))
+
+# Admission control for agent runs started from web requests (see planner/admission.py).
+# Runs beyond the global or per-user cap wait in a bounded queue, paying users
+# first, for up to PLANNER_ADMISSION_MAX_WAIT seconds; past that, or with the
+# queue full, the request gets a 429 with Retry-After.
+PLANNER_ADMISSION_MAX_RUNS = int(os.getenv('PLANNER_ADMISSION_MAX_RUNS', 8))
+PLANNER_ADMISSION_PAID_RESERVED = int(os.getenv('PLANNER_ADMISSION_PAID_RESERVED', 2))
+PLANNER_ADMISSION_PER_USER = int(os.getenv('PLANNER_ADMISSION_PER_USER', 2))
+PLANNER_ADMISSION_QUEUE_SIZE = int(os.getenv('PLANNER_ADMISSION_QUEUE_SIZE', 32))
+PLANNER_ADMISSION_MAX_WAIT = float(os.getenv('PLANNER_ADMISSION_MAX_WAIT', 15))
+PLANNER_ADMISSION_POLL_INTERVAL = float(os.getenv('PLANNER_ADMISSION_POLL_INTERVAL', 0.25))
+PLANNER_ADMISSION_RETRY_AFTER = int(os.getenv('PLANNER_ADMISSION_RETRY_AFTER', 15))
+PLANNER_ADMISSION_SLOT_TTL = int(os.getenv('PLANNER_ADMISSION_SLOT_TTL', 900))
+
+# Idempotency keys on trip creation and process_trip (see planner/idempotency.py).
+# Responses are replayed for PLANNER_IDEMPOTENCY_TTL seconds; a repeat of a
+# request still running waits up to PLANNER_IDEMPOTENCY_WAIT seconds for it.
+# Identical agent runs for a trip share one in-flight run (single flight),
+# whose result stays attachable for PLANNER_SINGLE_FLIGHT_RESULT_TTL seconds.
+# Graph runs of one trip take turns; a run's claim lapses
+# PLANNER_SINGLE_FLIGHT_TTL seconds after its process stops renewing it.
+PLANNER_IDEMPOTENCY_TTL = int(os.getenv('PLANNER_IDEMPOTENCY_TTL', 60 * 60 * 24))
+PLANNER_IDEMPOTENCY_WAIT = float(os.getenv('PLANNER_IDEMPOTENCY_WAIT', 30))
+PLANNER_IDEMPOTENCY_IN_PROGRESS_TTL = int(os.getenv('PLANNER_IDEMPOTENCY_IN_PROGRESS_TTL', 900))
+PLANNER_SINGLE_FLIGHT_TTL = int(os.getenv('PLANNER_SINGLE_FLIGHT_TTL', 900))
+PLANNER_SINGLE_FLIGHT_RESULT_TTL = float(os.getenv('PLANNER_SINGLE_FLIGHT_RESULT_TTL', 10))
+PLANNER_SINGLE_FLIGHT_POLL_INTERVAL = float(os.getenv('PLANNER_SINGLE_FLIGHT_POLL_INTERVAL', 0.25))
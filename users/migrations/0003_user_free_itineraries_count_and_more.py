@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_reset_otp_user_reset_otp_created_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='free_itineraries_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='prepaid_itineraries_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='UserProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('paid_plan_credits', models.DecimalField(decimal_places=2, default=0.0, max_digits=10)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]